@@ -1,202 +1,513 @@
-import sys
+import random
 
 import numpy as np
 
-import scipy.special as sc
-
 from algorithms.anchor_detector import AnchorDetector
 from algorithms.id_matcher import IDMatcher
-from feedback.neural_solver import NeuralSolver
+from algorithms.expert_history import ExpertHistory
+from algorithms.feedback_worker import FeedbackWorker
+from algorithms.loss_evaluator import LossEvaluator
+from algorithms.waa import WAADelayed, MultiWAADelayed
+from feedback.neural_solver import NeuralSolver, embed_crops
+from time_manager import StageTimer
 from algorithms.aaa_util import (
-    convert_df,
     weighted_random_choice,
-    eval_results,
-    frame_loss,
+    sequence_seed,
+    top_k_experts,
+    stack_results,
+    split_results,
+    reduce_loss,
 )
 
 
-class WAADelayed:
-    def __init__(self):
-        pass
+# settings added after the first experiments, with the values which keep the old behaviour
+CONFIG_DEFAULTS = {
+    "HISTORY": {"dtype": "float64"},
+    "ASYNC_FEEDBACK": {"enabled": False, "max_pending": 2, "policy": "coalesce"},
+    "PRUNING": {"enabled": False, "floor": 1e-6, "explore_every": 10},
+    "SAMPLING": {"top_k": 0, "eps": 0.0},
+    "LOSS_EVAL": {"workers": 0},
+    "MULTI_LEARNER": {"seed": 0, "configs": []},
+    "SEED": 0,
+    "MATCHING": {"solver": "flow", "k_search": "linear"},
+}
+
+# the random streams are seeded per sequence rather than once for the whole run,
+# which is recorded with the results by track_algorithm
+SEED_STREAMS = "sequence"
+
+
+def complete_config(config):
+    """
+    Return a copy of config where the missing settings take their default values
+    """
+
+    config = dict(config)
+    for key, default in CONFIG_DEFAULTS.items():
+        if isinstance(default, dict):
+            config[key] = {**default, **config.get(key, {})}
+        else:
+            config.setdefault(key, default)
+    return config
 
-    def initialize(self, n):
-        self.w = np.ones(n) / n
-        self.est_D = 1
 
+def get_name(config):
     """
-    gradient_losses should be n
+    Name of AAA with the settings which change its results
     """
 
-    def update(self, gradient_losses, delays):
-        # check the number of element
-        assert len(gradient_losses) == len(self.w)
+    config = complete_config(config)
 
-        total_delayed = sum(delays)
-        while self.est_D < total_delayed:
-            self.est_D *= 2
+    # the solver and the k search of the matching are named only when they are not the default ones
+    search = CONFIG_DEFAULTS["MATCHING"]
+    matching = {
+        key: value for key, value in config["MATCHING"].items() if key not in search
+    }
+    name = f"{config['OFFLINE']}, {matching}, {config['DETECTOR']}, {config['LOSS']}"
 
-        lr = np.sqrt(self.est_D * np.log(len(self.w)))
+    search = {
+        key: config["MATCHING"][key]
+        for key, default in search.items()
+        if config["MATCHING"][key] != default
+    }
+    if search:
+        name += f", {search}"
 
-        changes = lr * gradient_losses
-        temp = np.log(self.w + sys.float_info.min) - changes
-        self.w = np.exp(temp - sc.logsumexp(temp))
+    if config["PRUNING"]["enabled"]:
+        name += f", {config['PRUNING']}"
+
+    if config["SAMPLING"]["top_k"] > 0 or config["SAMPLING"]["eps"] > 0:
+        name += f", {config['SAMPLING']}"
+
+    if config["ASYNC_FEEDBACK"]["enabled"]:
+        name += f", {config['ASYNC_FEEDBACK']}"
+
+    if config["HISTORY"]["dtype"] != CONFIG_DEFAULTS["HISTORY"]["dtype"]:
+        name += f", {config['HISTORY']}"
+
+    return name
 
 
 class AAA:
-    def __init__(self, config):
-        self.name = f"{config['OFFLINE']}, {config['MATCHING']}, {config['DETECTOR']}, {config['LOSS']}"
-        self.n_experts = len(config["EXPERTS"])
-        self.config = config
-
-        self.offline = NeuralSolver(
-            self.config["FEEDBACK"]["ckpt_path"],
-            self.config["FEEDBACK"]["frcnn_weights_path"],
-            self.config["FEEDBACK"]["reid_weights_path"],
-            self.config["FEEDBACK"]["tracking_cfg_path"],
-            self.config["FEEDBACK"]["preprocessing_cfg_path"],
-            self.config["OFFLINE"]["use_gt"],
-            self.config["OFFLINE"]["pre_cnn"],
-            self.config["OFFLINE"]["pre_track"],
-        )
+    def __init__(self, config, offline=None, evaluator=None):
+        self.config = complete_config(config)
+        self.name = get_name(self.config)
+        self.n_experts = len(self.config["EXPERTS"])
+        self.timer = StageTimer()
+
+        # the networks of another session's offline tracker are reused if given
+        if offline is None:
+            self.offline = NeuralSolver(
+                self.config["FEEDBACK"]["ckpt_path"],
+                self.config["FEEDBACK"]["frcnn_weights_path"],
+                self.config["FEEDBACK"]["reid_weights_path"],
+                self.config["FEEDBACK"]["tracking_cfg_path"],
+                self.config["FEEDBACK"]["preprocessing_cfg_path"],
+                self.config["OFFLINE"]["use_gt"],
+                self.config["OFFLINE"]["pre_cnn"],
+                self.config["OFFLINE"]["pre_track"],
+                timer=self.timer,
+            )
+        else:
+            self.offline = offline.share(self.timer)
+
+        if self.config["ASYNC_FEEDBACK"]["enabled"]:
+            self.worker = FeedbackWorker(
+                self.offline.solve,
+                self.config["ASYNC_FEEDBACK"]["max_pending"],
+                self.config["ASYNC_FEEDBACK"]["policy"],
+                self.timer,
+            )
+        else:
+            self.worker = None
 
         self.learner = WAADelayed()
-        self.detector = AnchorDetector(self.offline)
-        self.matcher = IDMatcher(config)
+
+        # learners of other loss configurations which share the feedback of this one
+        self.multi_configs = self.config["MULTI_LEARNER"]["configs"]
+        if len(self.multi_configs) > 0:
+            self.multi_learner = MultiWAADelayed()
+            self.multi_delayed = np.array(
+                [loss_config["delayed"] for loss_config in self.multi_configs]
+            )
+        else:
+            self.multi_learner = None
+        self.detector = AnchorDetector(self.offline, self.worker, self.timer)
+        self.matcher = IDMatcher(self.config, self.timer)
+        # the loss workers of another session are reused if given
+        if evaluator is None:
+            self.evaluator = LossEvaluator(self.config["LOSS_EVAL"]["workers"], self.timer)
+        else:
+            self.evaluator = evaluator.share(self.timer)
 
     def initialize(self, seq_info):
         self.frame_idx = -1
 
         self.seq_info = seq_info
+        self.timer.reset()
+
+        # each sequence has its own random streams, so it does not depend on the sequences before it
+        seed = sequence_seed(self.config["SEED"], seq_info["seq_name"])
+        self.rng = np.random.RandomState(seed)
+
         self.detector.initialize(seq_info)
         self.learner.initialize(self.n_experts)
-        self.matcher.initialize(self.n_experts)
+        self.matcher.initialize(self.n_experts, random.Random(seed))
         self.offline.initialize(seq_info)
+        self.evaluator.initialize(seq_info)
 
-        self.experts_results = [[] for _ in range(self.n_experts)]
-        self.delay = []
-        self.evaluated = []
+        # the results of every expert are kept together as [frame, expert, id, x, y, w, h]
+        self.experts_results = ExpertHistory(
+            n_cols=7, dtype=self.config["HISTORY"]["dtype"]
+        )
+        # every unevaluated frame gains a delay per frame, and the frames from
+        # first_unevaluated onwards are the only ones left to be evaluated
+        self.n_pending = 0
+        self.delay_sum = 0
+        self.first_unevaluated = 0
+
+        # the first frame of the window of the last returned feedback
+        self.feedback_start = None
+        self.peak_memory = self.memory_usage()
+
+        self.n_updates = 0
+        self.n_evaluated = 0
+        self.n_skipped = 0
+
+        if self.multi_learner is not None:
+            self.multi_learner.initialize(len(self.multi_configs), self.n_experts)
+            self.multi_delay_sum = np.zeros(len(self.multi_configs), dtype=np.int64)
+            self.multi_selected = np.zeros(len(self.multi_configs), dtype=np.int64)
+            self.multi_rng = np.random.RandomState(self.config["MULTI_LEARNER"]["seed"])
+
+    def close(self):
+        # the loss workers are shut down for every session sharing them
+        self.evaluator.close()
+
+    def state_dict(self):
+        state = {
+            "frame_idx": self.frame_idx,
+            "selected_expert": getattr(self, "selected_expert", None),
+            "rng": self.rng.get_state(),
+            "experts_results": self.experts_results,
+            "n_pending": self.n_pending,
+            "delay_sum": self.delay_sum,
+            "first_unevaluated": self.first_unevaluated,
+            "peak_memory": self.peak_memory,
+            "n_updates": self.n_updates,
+            "n_evaluated": self.n_evaluated,
+            "n_skipped": self.n_skipped,
+            "learner": self.learner.state_dict(),
+            "detector": self.detector.state_dict(),
+            "matcher": self.matcher.state_dict(),
+            "offline": self.offline.state_dict(),
+            "timer": self.timer.state_dict(),
+        }
+        if self.multi_learner is not None:
+            state["multi"] = {
+                "learner": self.multi_learner.state_dict(),
+                "delay_sum": self.multi_delay_sum,
+                "selected": self.multi_selected,
+                "rng": self.multi_rng.get_state(),
+            }
+        return state
+
+    def load_state_dict(self, state):
+        """
+        Restore a state taken by state_dict after initializing the same sequence
+        """
+
+        self.frame_idx = state["frame_idx"]
+        self.rng.set_state(state["rng"])
+        if state["selected_expert"] is not None:
+            self.selected_expert = state["selected_expert"]
+        self.experts_results = state["experts_results"]
+        self.n_pending = state["n_pending"]
+        self.delay_sum = state["delay_sum"]
+        self.first_unevaluated = state["first_unevaluated"]
+        self.peak_memory = state["peak_memory"]
+        self.n_updates = state["n_updates"]
+        self.n_evaluated = state["n_evaluated"]
+        self.n_skipped = state["n_skipped"]
+        self.learner.load_state_dict(state["learner"])
+        self.detector.load_state_dict(state["detector"])
+        self.matcher.load_state_dict(state["matcher"])
+        self.offline.load_state_dict(state["offline"])
+        self.timer.load_state_dict(state["timer"])
+        if self.multi_learner is not None:
+            self.multi_learner.load_state_dict(state["multi"]["learner"])
+            self.multi_delay_sum = state["multi"]["delay_sum"]
+            self.multi_selected = state["multi"]["selected"]
+            self.multi_rng.set_state(state["multi"]["rng"])
+
+    def memory_usage(self):
+        return {
+            "history_bytes": int(self.experts_results.nbytes),
+            "history_rows": int(len(self.experts_results)),
+        }
+
+    def memory_report(self):
+        return {
+            "frames": self.frame_idx + 1,
+            "current": self.memory_usage(),
+            "peak": self.peak_memory,
+        }
+
+    def evaluation_report(self):
+        report = {
+            "updates": self.n_updates,
+            "evaluated": self.n_evaluated,
+            "skipped": self.n_skipped,
+            "stable_checks": self.detector.n_checks,
+            "stable_check_hits": self.detector.n_check_hits,
+            "loss_memo": self.evaluator.stats(),
+            "unpruned_fits": sum(counts[0] for counts in self.matcher.fit_counts),
+            "fits": sum(counts[1] for counts in self.matcher.fit_counts),
+        }
+        if self.worker is not None:
+            report["feedback"] = self.worker.stats()
+        return report
+
+    def oldest_request(self):
+        """
+        Return the end frame of the oldest window the offline tracker can still be asked for
+        """
+
+        if self.worker is not None and self.worker.oldest_frame() is not None:
+            return self.worker.oldest_frame()
+        return self.frame_idx + 1
+
+    def _select_evaluated(self):
+        # experts under the weight floor are skipped except on exploration updates
+        self.n_updates += 1
+        evaluated = np.ones(self.n_experts, dtype=bool)
+        if (
+            self.config["PRUNING"]["enabled"]
+            and self.n_updates % self.config["PRUNING"]["explore_every"] != 0
+        ):
+            evaluated = self.learner.w >= self.config["PRUNING"]["floor"]
+            evaluated[np.argmax(self.learner.w)] = True
+
+        self.n_evaluated += int(evaluated.sum())
+        self.n_skipped += int((~evaluated).sum())
+        return evaluated
+
+    def _trim(self, window):
+        # only the last window frames of the current or a pending anchor can be evaluated
+        last_anchor = self.frame_idx
+        if self.worker is not None and self.worker.oldest_frame() is not None:
+            last_anchor = min(last_anchor, self.worker.oldest_frame())
+
+        self.experts_results.trim(last_anchor + 2 - window)
+        self.evaluator.evict(self.seq_info["seq_name"], last_anchor + 2 - window)
+
+        memory = self.memory_usage()
+        for key, value in memory.items():
+            self.peak_memory[key] = max(self.peak_memory[key], value)
+
+    def _gradient_losses(self, losses, evaluated, is_last, loss_config):
+        loss = reduce_loss(losses, loss_config["type"])
+        if is_last:
+            loss = loss[:, -1:]
+        loss = loss / loss_config["bound"]
+        gradient_losses = loss.sum(axis=1)
+
+        # skipped experts take the worst loss of the window
+        if not evaluated.all():
+            gradient_losses[~evaluated] = gradient_losses[evaluated].max()
+
+        return gradient_losses
+
+    def _update_weight(self, anchor_frame, feedback, feedback_length):
+        feedback_start = anchor_frame + 1 - feedback_length
+        first_unevaluated_idx = max(self.first_unevaluated - feedback_start, 0)
+        is_last = False
+        if first_unevaluated_idx == feedback_length - 1:
+            first_unevaluated_idx = feedback_length - 2
+            is_last = True
+        feedback_idx = feedback[:, 0] > first_unevaluated_idx
+        evaluate_feedback = feedback[feedback_idx].copy()
+        evaluate_feedback[:, 0] -= first_unevaluated_idx
+        feedback_max = int(evaluate_feedback[:, 0].max()) if len(evaluate_feedback) > 0 else 0
+
+        if feedback_max == 0:
+            return None
+
+        # calculate loss
+        evaluated = self._select_evaluated()
+        dt = feedback_start + first_unevaluated_idx
+        evaluate_results = self.experts_results.view(dt + 1, dt + feedback_max).copy()
+        evaluate_results[:, 0] -= dt - self.experts_results.base_frame
+        experts_results = split_results(evaluate_results, self.n_experts)
+
+        losses = np.zeros((self.n_experts, feedback_max, 3))
+        evaluated_idxs = np.flatnonzero(evaluated)
+        with self.timer.measure("loss.evaluate"):
+            evaluated_losses = self.evaluator.evaluate(
+                evaluate_feedback,
+                [experts_results[i] for i in evaluated_idxs],
+                feedback_max,
+                evaluated_idxs,
+                dt,
+            )
+        for i, loss in zip(evaluated_idxs, evaluated_losses):
+            losses[i] = loss
+
+        gradient_losses = self._gradient_losses(
+            losses, evaluated, is_last, self.config["LOSS"]
+        )
+
+        with self.timer.measure("learner.update"):
+            self.learner.update(gradient_losses, self.delay_sum)
+
+            # the other configurations only differ in how the same losses are reduced
+            if self.multi_learner is not None:
+                multi_gradient_losses = np.stack(
+                    [
+                        self._gradient_losses(losses, evaluated, is_last, loss_config)
+                        for loss_config in self.multi_configs
+                    ]
+                )
+                self.multi_learner.update(multi_gradient_losses, self.multi_delay_sum)
+
+        # every frame of the window up to the anchor is evaluated now
+        self.n_pending -= anchor_frame + 1 - max(self.first_unevaluated, feedback_start)
+        self.first_unevaluated = anchor_frame + 1
+
+        return gradient_losses
 
     def track(self, img_path, dets, gts, results):
+        with self.timer.measure("aaa.track"):
+            self.observe(img_path, dets, gts, results)
+            embed_crops([self.offline])
+            return self.decide(results)
+
+    def observe(self, img_path, dets, gts, results):
+        """
+        Store the experts' results and preprocess the frame for the offline tracker.
+        The crops of the frame have to be embedded by embed_crops before decide.
+        """
+
         self.frame_idx += 1
 
         # save experts' result
-        for i, result in enumerate(results):
-            if len(result) > 0:
-                frame_result = np.zeros((result.shape[0], result.shape[1] + 1))
-                frame_result[:, 1:] = result.copy()
-                frame_result[:, 0] = self.frame_idx + 1
-                if len(self.experts_results[i]) > 0:
-                    self.experts_results[i] = np.concatenate(
-                        [self.experts_results[i], frame_result], axis=0
-                    )
-                else:
-                    self.experts_results[i] = frame_result
-
-        if self.config["LOSS"]["delayed"]:
-            self.delay = [
-                self.delay[i] if self.evaluated[i] else self.delay[i] + 1
-                for i in range(len(self.delay))
-            ]
-        self.delay.append(1)
-        self.evaluated.append(False)
-
-        self.offline.step(img_path, dets, gts, results, self.learner.w)
-
-        # detect anchor frame
-        if self.config["DETECTOR"]["type"] == "fixed":
-            is_anchor, feedback, feedback_length = self.detector.fixed_detect(
-                self.frame_idx, self.config["DETECTOR"]["duration"]
-            )
-        elif self.config["DETECTOR"]["type"] == "stable":
-            is_anchor, feedback, feedback_length = self.detector.stable_detect(
-                self.seq_info,
-                self.frame_idx,
-                self.config["DETECTOR"]["duration"],
-                self.config["DETECTOR"]["threshold"],
-            )
-
-        # update weight
-        if is_anchor and feedback is not None:
-            first_unevaluated_idx = self.evaluated[-feedback_length:].index(False)
-            is_last = False
-            if first_unevaluated_idx == feedback_length - 1:
-                first_unevaluated_idx = feedback_length - 2
-                is_last = True
-            feedback_idx = feedback[:, 0] > first_unevaluated_idx
-            evaluate_feedback = feedback[feedback_idx].copy()
-            evaluate_feedback[:, 0] -= first_unevaluated_idx
-            feedback_max = int(evaluate_feedback[:, 0].max()) if len(evaluate_feedback) > 0 else 0
-
-            if feedback_max > 0:
-                df_feedback = convert_df(evaluate_feedback, is_offline=True)
-
-                # calculate loss
-                gradient_losses = np.zeros((self.n_experts))
-                dt = (
-                    self.frame_idx + 1 - feedback_length
-                    if self.frame_idx + 1 > feedback_length
-                    else 0
+        with self.timer.measure("aaa.history"):
+            self.experts_results.append(self.frame_idx + 1, stack_results(results))
+
+            if self.config["LOSS"]["delayed"]:
+                self.delay_sum += self.n_pending
+            if self.multi_learner is not None:
+                self.multi_delay_sum += np.where(self.multi_delayed, self.n_pending, 0)
+                self.multi_delay_sum += 1
+            self.n_pending += 1
+            self.delay_sum += 1
+            self._trim(self.config["DETECTOR"]["duration"])
+
+        with self.timer.measure("offline.step"):
+            self.offline.preprocess(img_path, dets, gts, results, self.learner.w)
+
+    def decide(self, results):
+        """
+        Update the weights with the finished feedback and return the result of the frame
+        """
+
+        with self.timer.anchor(self.frame_idx):
+            # detect anchor frame
+            if self.worker is not None:
+                self.detector.submit(
+                    self.config["DETECTOR"]["type"],
+                    self.frame_idx,
+                    self.config["DETECTOR"]["duration"],
                 )
-                for i, expert_results in enumerate(self.experts_results):
-                    if len(expert_results) > 0:
-                        evaluate_idx = expert_results[:, 0] > dt + first_unevaluated_idx
-                        evaluate_results = expert_results[evaluate_idx].copy()
-                        evaluate_results[:, 0] -= dt + first_unevaluated_idx
-
-                        evaluate_idx = feedback_max >= evaluate_results[:, 0]
-                        evaluate_results = evaluate_results[evaluate_idx]
-                    else:
-                        evaluate_results = []
-                    df_expert_results = convert_df(evaluate_results)
-
-                    acc, ana, df_map = eval_results(
-                        self.seq_info, df_feedback, df_expert_results,
-                    )
-                    loss = frame_loss(df_map, range(1, feedback_max + 1))
-                    if self.config["LOSS"]["type"] == "w_id":
-                        loss = loss.sum(axis=1)
-                    elif self.config["LOSS"]["type"] == "wo_id":
-                        loss = loss[:, :2].sum(axis=1)
-                    elif self.config["LOSS"]["type"] == "fn":
-                        loss = loss[:, 1]
-                    if is_last:
-                        loss = loss[-1]
-                    loss /= self.config["LOSS"]["bound"]
-
-                    gradient_losses[i] = loss.sum()
-
-                self.learner.update(gradient_losses, self.delay)
-
-                self.evaluated[-feedback_length:] = [True] * len(
-                    self.evaluated[-feedback_length:]
+                anchors = self.detector.collect(
+                    self.seq_info,
+                    self.config["DETECTOR"]["type"],
+                    self.config["DETECTOR"]["threshold"],
                 )
             else:
-                feedback = None
-                gradient_losses = None
-        else:
+                if self.config["DETECTOR"]["type"] == "fixed":
+                    is_anchor, feedback, feedback_length = self.detector.fixed_detect(
+                        self.frame_idx, self.config["DETECTOR"]["duration"]
+                    )
+                elif self.config["DETECTOR"]["type"] == "stable":
+                    is_anchor, feedback, feedback_length = self.detector.stable_detect(
+                        self.seq_info,
+                        self.frame_idx,
+                        self.config["DETECTOR"]["duration"],
+                        self.config["DETECTOR"]["threshold"],
+                    )
+                anchors = [(self.frame_idx, is_anchor, feedback, feedback_length)]
+
+            # update weight
+            # several feedbacks can be finished at once in async mode, then their losses are summed
+            is_anchor = False
             feedback = None
             gradient_losses = None
+            for anchor_frame, anchor_detected, anchor_feedback, feedback_length in anchors:
+                is_anchor = is_anchor or anchor_detected
+                if anchor_detected and anchor_feedback is not None:
+                    anchor_losses = self._update_weight(
+                        anchor_frame, anchor_feedback, feedback_length
+                    )
+                    if anchor_losses is not None:
+                        feedback = anchor_feedback
+                        self.feedback_start = anchor_frame + 1 - feedback_length
+                        if gradient_losses is None:
+                            gradient_losses = anchor_losses
+                        else:
+                            gradient_losses = gradient_losses + anchor_losses
+
+            if is_anchor:
+                self.timer.keep_anchor()
 
         if self.frame_idx > 0:
             prev_selected_expert = self.selected_expert
         else:
             prev_selected_expert = None
 
+        # only the experts with the top-k weights above eps times the largest one are candidates
+        if self.config["SAMPLING"]["top_k"] > 0 or self.config["SAMPLING"]["eps"] > 0:
+            candidates = top_k_experts(
+                self.learner.w,
+                self.config["SAMPLING"]["top_k"],
+                self.config["SAMPLING"]["eps"],
+            )
+        else:
+            candidates = None
+
         # select expert
         if self.frame_idx == 0 or is_anchor or self.config["LOSS"]["delayed"]:
-            self.selected_expert = weighted_random_choice(self.learner.w)
+            if candidates is None:
+                self.selected_expert = weighted_random_choice(self.learner.w, self.rng)
+            else:
+                self.selected_expert = candidates[
+                    weighted_random_choice(self.learner.w[candidates], self.rng)
+                ]
+
+        # the other configurations select their own experts which are only recorded
+        if self.multi_learner is not None:
+            resample = np.logical_or(self.frame_idx == 0 or is_anchor, self.multi_delayed)
+            for k in np.flatnonzero(resample):
+                self.multi_selected[k] = weighted_random_choice(
+                    self.multi_learner.w[k], self.multi_rng
+                )
 
         # match id
-        if self.config["MATCHING"]["method"] == "anchor":
-            curr_expert_bboxes = self.matcher.anchor_match(
-                prev_selected_expert, self.selected_expert, results
-            )
-        elif self.config["MATCHING"]["method"] == "kmeans":
-            curr_expert_bboxes = self.matcher.kmeans_match(
-                self.learner.w, self.selected_expert, results
-            )
-        else:
-            raise NameError("Please enter a valid matching method")
+        with self.timer.measure(f"matcher.{self.config['MATCHING']['method']}"):
+            if self.config["MATCHING"]["method"] == "anchor":
+                curr_expert_bboxes = self.matcher.anchor_match(
+                    prev_selected_expert, self.selected_expert, results
+                )
+            elif self.config["MATCHING"]["method"] == "kmeans":
+                curr_expert_bboxes = self.matcher.kmeans_match(
+                    self.learner.w, self.selected_expert, results, candidates
+                )
+            elif self.config["MATCHING"]["method"] == "graph":
+                curr_expert_bboxes = self.matcher.graph_match(
+                    self.learner.w, self.selected_expert, results, candidates
+                )
+            else:
+                raise NameError("Please enter a valid matching method")
 
         if len(curr_expert_bboxes) > 0:
             u, c = np.unique(curr_expert_bboxes[:, 0], return_counts=True)
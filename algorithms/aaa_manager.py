@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+
+from algorithms.aaa import AAA
+from feedback.neural_solver import embed_crops
+
+
+class AAAManager:
+    """
+    Hosts one AAA session per stream on a single set of offline tracker networks.
+
+    Frames are processed round-robin: every stream of a round is preprocessed
+    first, then the crops of the whole round are embedded in one batch, and
+    finally each stream updates its weights and selects its result.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.offline = None
+        self.evaluator = None
+        self.sessions = {}
+        self.latencies = {}
+        self.n_frames = 0
+        self.busy_time = 0.0
+
+    def add_stream(self, stream_id, seq_info):
+        if stream_id in self.sessions:
+            raise KeyError(f"Stream {stream_id} already exists")
+
+        algorithm = AAA(self.config, self.offline, self.evaluator)
+        if self.offline is None:
+            self.offline = algorithm.offline
+            self.evaluator = algorithm.evaluator
+        algorithm.initialize(seq_info)
+
+        self.sessions[stream_id] = algorithm
+        self.latencies[stream_id] = []
+        return algorithm
+
+    def remove_stream(self, stream_id):
+        self.latencies.pop(stream_id)
+        return self.sessions.pop(stream_id)
+
+    def step(self, frames):
+        """
+        frames: {stream_id: (img_path, dets, gts, results)}
+        Return {stream_id: output of AAA.track}
+        """
+
+        start = time.perf_counter()
+        for stream_id, (img_path, dets, gts, results) in frames.items():
+            self.sessions[stream_id].observe(img_path, dets, gts, results)
+
+        embed_crops([self.sessions[stream_id].offline for stream_id in frames])
+
+        # the latency of a frame is counted from the start of its round
+        outputs = {}
+        for stream_id, (_, _, _, results) in frames.items():
+            outputs[stream_id] = self.sessions[stream_id].decide(results)
+            self.latencies[stream_id].append(time.perf_counter() - start)
+
+        self.n_frames += len(frames)
+        self.busy_time += time.perf_counter() - start
+        return outputs
+
+    def run(self, streams):
+        """
+        streams: {stream_id: iterable of (img_path, dets, gts, results)}
+        Yield (stream_id, frame_idx, output of AAA.track) until every stream ends
+        """
+
+        iterators = {stream_id: iter(frames) for stream_id, frames in streams.items()}
+        frame_idxs = {stream_id: 0 for stream_id in streams}
+        while len(iterators) > 0:
+            frames = {}
+            for stream_id, iterator in list(iterators.items()):
+                try:
+                    frames[stream_id] = next(iterator)
+                except StopIteration:
+                    iterators.pop(stream_id)
+            if len(frames) == 0:
+                break
+
+            for stream_id, output in self.step(frames).items():
+                yield stream_id, frame_idxs[stream_id], output
+                frame_idxs[stream_id] += 1
+
+    def report(self):
+        streams = {}
+        for stream_id, latencies in self.latencies.items():
+            latencies = np.array(latencies)
+            if len(latencies) == 0:
+                continue
+            streams[stream_id] = {
+                "frames": len(latencies),
+                "mean": float(latencies.mean()),
+                "p50": float(np.percentile(latencies, 50)),
+                "p95": float(np.percentile(latencies, 95)),
+                "max": float(latencies.max()),
+            }
+
+        return {
+            "streams": streams,
+            "frames": self.n_frames,
+            "time": self.busy_time,
+            "fps": self.n_frames / self.busy_time if self.busy_time > 0 else 0.0,
+        }
@@ -1,45 +1,37 @@
+import zlib
 import numpy as np
 import pandas as pd
 import motmetrics as mm
 
 
-def overlap_ratio(rect1, rect2):
+def _overlap(rect1, rect2):
     """
     https://github.com/StrangerZhang/pysot-toolkit
     """
-    if rect1.ndim == 1:
-        rect1 = rect1[np.newaxis, :]
-    if rect2.ndim == 1:
-        rect2 = rect2[np.newaxis, :]
-    left = np.maximum(rect1[:, 0], rect2[:, 0])
-    right = np.minimum(rect1[:, 0] + rect1[:, 2], rect2[:, 0] + rect2[:, 2])
-    top = np.maximum(rect1[:, 1], rect2[:, 1])
-    bottom = np.minimum(rect1[:, 1] + rect1[:, 3], rect2[:, 1] + rect2[:, 3])
+    left = np.maximum(rect1[..., 0], rect2[..., 0])
+    right = np.minimum(rect1[..., 0] + rect1[..., 2], rect2[..., 0] + rect2[..., 2])
+    top = np.maximum(rect1[..., 1], rect2[..., 1])
+    bottom = np.minimum(rect1[..., 1] + rect1[..., 3], rect2[..., 1] + rect2[..., 3])
 
     intersect = np.maximum(0, right - left) * np.maximum(0, bottom - top)
-    union = rect1[:, 2] * rect1[:, 3] + rect2[:, 2] * rect2[:, 3] - intersect
+    union = rect1[..., 2] * rect1[..., 3] + rect2[..., 2] * rect2[..., 3] - intersect
     iou = intersect / union
     iou = np.maximum(np.minimum(1, iou), 0)
     return iou
 
 
-def goverlap_ratio(rect1, rect2):
-    if rect1.ndim == 1:
-        rect1 = rect1[None, :]
-    if rect2.ndim == 1:
-        rect2 = rect2[None, :]
-
-    left = np.maximum(rect1[:, 0], rect2[:, 0])
-    left_min = np.minimum(rect1[:, 0], rect2[:, 0])
-    right = np.minimum(rect1[:, 0] + rect1[:, 2], rect2[:, 0] + rect2[:, 2])
-    right_max = np.maximum(rect1[:, 0] + rect1[:, 2], rect2[:, 0] + rect2[:, 2])
-    top = np.maximum(rect1[:, 1], rect2[:, 1])
-    top_min = np.minimum(rect1[:, 1], rect2[:, 1])
-    bottom = np.minimum(rect1[:, 1] + rect1[:, 3], rect2[:, 1] + rect2[:, 3])
-    bottom_max = np.maximum(rect1[:, 1] + rect1[:, 3], rect2[:, 1] + rect2[:, 3])
+def _goverlap(rect1, rect2):
+    left = np.maximum(rect1[..., 0], rect2[..., 0])
+    left_min = np.minimum(rect1[..., 0], rect2[..., 0])
+    right = np.minimum(rect1[..., 0] + rect1[..., 2], rect2[..., 0] + rect2[..., 2])
+    right_max = np.maximum(rect1[..., 0] + rect1[..., 2], rect2[..., 0] + rect2[..., 2])
+    top = np.maximum(rect1[..., 1], rect2[..., 1])
+    top_min = np.minimum(rect1[..., 1], rect2[..., 1])
+    bottom = np.minimum(rect1[..., 1] + rect1[..., 3], rect2[..., 1] + rect2[..., 3])
+    bottom_max = np.maximum(rect1[..., 1] + rect1[..., 3], rect2[..., 1] + rect2[..., 3])
 
     intersect = np.maximum(0, right - left) * np.maximum(0, bottom - top)
-    union = rect1[:, 2] * rect1[:, 3] + rect2[:, 2] * rect2[:, 3] - intersect
+    union = rect1[..., 2] * rect1[..., 3] + rect2[..., 2] * rect2[..., 3] - intersect
     iou = np.clip(intersect / union, 0, 1)
     closure = np.maximum(0, right_max - left_min) * np.maximum(0, bottom_max - top_min)
     g_iou = iou - (closure - union) / closure
@@ -48,12 +40,133 @@ def goverlap_ratio(rect1, rect2):
     return g_iou
 
 
-def weighted_random_choice(weights):
+def overlap_ratio(rect1, rect2):
+    if rect1.ndim == 1:
+        rect1 = rect1[np.newaxis, :]
+    if rect2.ndim == 1:
+        rect2 = rect2[np.newaxis, :]
+    return _overlap(rect1, rect2)
+
+
+def goverlap_ratio(rect1, rect2):
+    if rect1.ndim == 1:
+        rect1 = rect1[None, :]
+    if rect2.ndim == 1:
+        rect2 = rect2[None, :]
+    return _goverlap(rect1, rect2)
+
+
+def _pairwise(kernel, rects1, rects2, dtype, max_elements):
+    rects1 = np.asarray(rects1, dtype=dtype).reshape(-1, 4)
+    rects2 = np.asarray(rects2, dtype=dtype).reshape(-1, 4)
+    scores = np.empty((len(rects1), len(rects2)), dtype=dtype)
+
+    # the rows are computed by chunks to bound the memory of the intermediate arrays
+    chunk_size = max(1, max_elements // max(1, len(rects2)))
+    for start in range(0, len(rects1), chunk_size):
+        chunk = rects1[start : start + chunk_size, np.newaxis, :]
+        scores[start : start + chunk_size] = kernel(chunk, rects2[np.newaxis])
+    return scores
+
+
+def overlap_matrix(rects1, rects2, dtype=np.float64, max_elements=1 << 20):
+    """
+    IoU of every pair of boxes as a len(rects1) x len(rects2) matrix,
+    the same as overlap_ratio of each box of rects1 against rects2
+    """
+    return _pairwise(_overlap, rects1, rects2, dtype, max_elements)
+
+
+def goverlap_matrix(rects1, rects2, dtype=np.float64, max_elements=1 << 20):
+    """
+    GIoU of every pair of boxes as a len(rects1) x len(rects2) matrix,
+    the same as goverlap_ratio of each box of rects1 against rects2
+    """
+    return _pairwise(_goverlap, rects1, rects2, dtype, max_elements)
+
+
+def overlapping_pairs(rects):
+    """
+    Pairs (i, j) with i < j of the boxes whose extents intersect or touch, found by
+    sweeping the boxes sorted by their left side so the separate ones are never compared
+    """
+
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+    order = np.argsort(rects[:, 0], kind="stable")
+    left = rects[order, 0]
+    right = left + rects[order, 2]
+
+    # the boxes after each box in the order which start before its right side
+    starts = np.arange(len(rects)) + 1
+    counts = np.maximum(np.searchsorted(left, right, side="right") - starts, 0)
+    firsts = np.repeat(np.arange(len(rects)), counts)
+    seconds = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(
+        counts.sum()
+    )
+
+    i = order[firsts]
+    j = order[seconds]
+    top = rects[:, 1]
+    bottom = rects[:, 1] + rects[:, 3]
+    keep = (top[i] <= bottom[j]) & (top[j] <= bottom[i])
+    i, j = np.minimum(i[keep], j[keep]), np.maximum(i[keep], j[keep])
+
+    # in the same order as the pairs of np.triu_indices
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+
+def weighted_random_choice(weights, rng=np.random):
     selection_probs = weights / np.sum(weights)
-    selected = np.random.choice(len(weights), p=selection_probs)
+    selected = rng.choice(len(weights), p=selection_probs)
     return selected
 
 
+def sequence_seed(seed, seq_name):
+    """
+    Seed of the random streams of a sequence, which only depends on the seed and the name
+    """
+    return zlib.crc32(f"{seed}/{seq_name}".encode())
+
+
+def top_k_experts(weights, k, eps=0.0):
+    """
+    Return the sorted indices of the k largest weights above eps times the largest weight,
+    or of every weight above it if k is 0
+    """
+
+    candidates = np.flatnonzero(weights > eps * weights.max())
+    if 0 < k < len(candidates):
+        candidates = candidates[np.argpartition(weights[candidates], -k)[-k:]]
+    return np.sort(candidates)
+
+
+def stack_results(results):
+    """
+    Stack the results of every expert into rows of [expert, id, x, y, w, h]
+    """
+
+    lengths = [len(result) for result in results]
+    if sum(lengths) == 0:
+        return np.empty((0, 6))
+
+    stacked = np.empty((sum(lengths), 6))
+    stacked[:, 0] = np.repeat(np.arange(len(results)), lengths)
+    stacked[:, 1:] = np.concatenate([result for result in results if len(result) > 0])
+    return stacked
+
+
+def split_results(rows, n_experts):
+    """
+    Split rows of [frame, expert, id, x, y, w, h] into [frame, id, x, y, w, h] of each expert
+    """
+
+    experts = rows[:, 1].astype(np.int64)
+    order = np.argsort(experts, kind="stable")
+    bounds = np.cumsum(np.bincount(experts, minlength=n_experts))[:-1]
+    return np.split(rows[order][:, [0, 2, 3, 4, 5, 6]], bounds)
+
+
 def convert_df(results, is_offline=False):
     if len(results) > 0:
         data = np.zeros((len(results), 10))
@@ -94,30 +207,37 @@ def frame_loss(df_map, frame_list):
         df = df_map.noraw.reset_index()
     else:
         df = df_map
-    fp = df[df["Type"] == "FP"]
-    fn = df[df["Type"] == "MISS"]
-    ids = df[df["Type"] == "SWITCH"]
+    frames = np.asarray(frame_list, dtype=np.int64)
+    event_frames = df["FrameId"].values.astype(np.int64)
+    event_types = df["Type"].values
 
-    result = np.zeros((len(frame_list), 3))
-    for i, frame in enumerate(frame_list):
-        if len(fp) > 0:
-            frame_fp = (fp["FrameId"] == frame).sum()
-        else:
-            frame_fp = 0
+    result = np.zeros((len(frames), 3))
+    if len(frames) == 0:
+        return result
 
-        if len(fn) > 0:
-            frame_fn = (fn["FrameId"] == frame).sum()
-        else:
-            frame_fn = 0
+    # count the events of each type per frame at once
+    for i, event_type in enumerate(["FP", "MISS", "SWITCH"]):
+        counts = np.bincount(
+            event_frames[event_types == event_type], minlength=frames.max() + 1
+        )
+        result[:, i] = counts[frames]
 
-        if len(ids) > 0:
-            frame_ids = (ids["FrameId"] == frame).sum()
-        else:
-            frame_ids = 0
+    return result
 
-        result[i] = [frame_fp, frame_fn, frame_ids]
 
-    return result
+def reduce_loss(loss, loss_type):
+    """
+    Reduce [..., (fp, fn, ids)] to the loss of each frame
+    """
+
+    if loss_type == "w_id":
+        return loss.sum(axis=-1)
+    elif loss_type == "wo_id":
+        return loss[..., :2].sum(axis=-1)
+    elif loss_type == "fn":
+        return loss[..., 1]
+    else:
+        raise NameError("Please enter a valid loss type")
 
 
 def eval_results(seq_info, gt, pred):
@@ -1,13 +1,77 @@
+import numpy as np
+
+from time_manager import StageTimer
 from .aaa_util import eval_results, get_summary, convert_df
 
 
+def same_tracks(previous, current):
+    """
+    Check whether two feedbacks have the same boxes in every frame and ids which
+    correspond one to one, so that each is a perfect tracking result of the other
+    """
+
+    if len(previous) == 0 or len(previous) != len(current):
+        return False
+
+    # sort the rows of both by frame and box
+    cols = [0, 2, 3, 4, 5]
+    previous = previous[np.lexsort(previous[:, cols].T[::-1])]
+    current = current[np.lexsort(current[:, cols].T[::-1])]
+    boxes = previous[:, cols]
+    if not np.array_equal(boxes, current[:, cols]):
+        return False
+
+    # every box should be distinct within a frame and have an area
+    if (boxes[1:] == boxes[:-1]).all(axis=1).any():
+        return False
+    if (boxes[:, 3] <= 0).any() or (boxes[:, 4] <= 0).any():
+        return False
+
+    # an id can appear once per frame
+    if len(np.unique(previous[:, :2], axis=0)) != len(previous):
+        return False
+
+    n_pairs = len(np.unique(np.stack([previous[:, 1], current[:, 1]], axis=1), axis=0))
+    return n_pairs == len(np.unique(previous[:, 1])) == len(np.unique(current[:, 1]))
+
+
 class AnchorDetector:
-    def __init__(self, offline):
+    def __init__(self, offline, worker=None, timer=None):
         self.offline = offline
+        self.worker = worker
+        self.timer = StageTimer() if timer is None else timer
 
     def initialize(self, seq_info):
         self.seq_info = seq_info
         self.previous_offline = None
+        self.previous_start = None
+        self.previous_end = None
+        self.n_checks = 0
+        self.n_check_hits = 0
+
+        if self.worker is not None:
+            self.worker.reset()
+
+    def state_dict(self):
+        state = {
+            "previous_offline": self.previous_offline,
+            "previous_start": self.previous_start,
+            "previous_end": self.previous_end,
+            "n_checks": self.n_checks,
+            "n_check_hits": self.n_check_hits,
+        }
+        if self.worker is not None:
+            state["worker"] = self.worker.state_dict()
+        return state
+
+    def load_state_dict(self, state):
+        self.previous_offline = state["previous_offline"]
+        self.previous_start = state["previous_start"]
+        self.previous_end = state["previous_end"]
+        self.n_checks = state["n_checks"]
+        self.n_check_hits = state["n_check_hits"]
+        if self.worker is not None:
+            self.worker.load_state_dict(state["worker"])
 
     def fixed_detect(self, frame_idx, duration):
         feedback_length = duration
@@ -22,43 +86,84 @@ class AnchorDetector:
         return is_anchor, feedback, feedback_length
 
     def stable_detect(self, seq_info, frame_idx, duration, threshold):
-        if frame_idx + 1 > duration:
-            current_offline = self._get_feedback(frame_idx - duration + 1, frame_idx)
+        start_frame = max(frame_idx + 1 - duration, 0)
+        current_offline = self._get_feedback(start_frame, frame_idx)
+        return self._stable_check(
+            seq_info, current_offline, start_frame, frame_idx, threshold
+        )
 
-            if self.previous_offline is not None and current_offline is not None:
-                overlap_previous = self.previous_offline[
-                    self.previous_offline[:, 0] > 1
-                ]
-                overlap_previous[:, 0] -= 1
-                overlap_previous = convert_df(overlap_previous, is_offline=True)
+    def submit(self, detector_type, frame_idx, duration):
+        """
+        Request the feedback of the window ending at frame_idx from the worker
+        """
 
-                overlap_current = current_offline[current_offline[:, 0] < duration]
-                overlap_current = convert_df(overlap_current, is_offline=True)
-
-            feedback_length = duration
-        else:
-            current_offline = self._get_feedback(0, frame_idx)
+        if detector_type == "fixed" and (frame_idx + 1) % duration != 0:
+            return
 
-            if self.previous_offline is not None and current_offline is not None:
-                overlap_previous = convert_df(self.previous_offline, is_offline=True)
-
-                overlap_current = current_offline[current_offline[:, 0] <= frame_idx]
-                overlap_current = convert_df(overlap_current, is_offline=True)
-
-            feedback_length = frame_idx + 1
-
-        if self.previous_offline is not None and current_offline is not None:
-            prev_acc, prev_ana, _ = eval_results(
-                seq_info, overlap_previous, overlap_current
-            )
-            prev_sum = get_summary(prev_acc, prev_ana)
-
-            curr_acc, curr_ana, _ = eval_results(
-                seq_info, overlap_current, overlap_previous
-            )
-            curr_sum = get_summary(curr_acc, curr_ana)
-
-            mean_mota = (prev_sum[3] + curr_sum[3]) / 2
+        start_frame = max(frame_idx + 1 - duration, 0)
+        try:
+            with self.timer.measure("offline.prepare"):
+                request = self.offline.prepare(start_frame, frame_idx)
+        except (RuntimeError, ValueError):
+            request = None
+        self.worker.submit(frame_idx, start_frame, request)
+
+    def collect(self, seq_info, detector_type, threshold, block=False):
+        """
+        Return [(anchor frame, is_anchor, feedback, feedback_length)] of the finished requests
+        """
+
+        anchors = []
+        for frame_idx, start_frame, current_offline in self.worker.completed(block):
+            if detector_type == "fixed":
+                detected = (True, current_offline, frame_idx + 1 - start_frame)
+            elif detector_type == "stable":
+                detected = self._stable_check(
+                    seq_info, current_offline, start_frame, frame_idx, threshold
+                )
+            anchors.append((frame_idx,) + detected)
+
+        return anchors
+
+    def _stable_check(self, seq_info, current_offline, start_frame, end_frame, threshold):
+        feedback_length = end_frame + 1 - start_frame
+
+        if (
+            self.previous_offline is not None
+            and current_offline is not None
+            and self.previous_end >= start_frame
+        ):
+            # compare the frames both windows have, in the current window's frame numbers
+            shift = start_frame - self.previous_start
+            overlap_previous = self.previous_offline[
+                self.previous_offline[:, 0] > shift
+            ]
+            overlap_previous[:, 0] -= shift
+            overlap_current = current_offline[
+                current_offline[:, 0] <= self.previous_end + 1 - start_frame
+            ]
+
+            # the windows usually agree on the overlap up to the ids, then MOTA is 1 both ways
+            self.n_checks += 1
+            with self.timer.measure("detector.stable_check"):
+                if same_tracks(overlap_previous, overlap_current):
+                    self.n_check_hits += 1
+                    mean_mota = 1.0
+                else:
+                    overlap_previous = convert_df(overlap_previous, is_offline=True)
+                    overlap_current = convert_df(overlap_current, is_offline=True)
+
+                    prev_acc, prev_ana, _ = eval_results(
+                        seq_info, overlap_previous, overlap_current
+                    )
+                    prev_sum = get_summary(prev_acc, prev_ana)
+
+                    curr_acc, curr_ana, _ = eval_results(
+                        seq_info, overlap_current, overlap_previous
+                    )
+                    curr_sum = get_summary(curr_acc, curr_ana)
+
+                    mean_mota = (prev_sum[3] + curr_sum[3]) / 2
             if mean_mota >= threshold:
                 is_anchor = True
                 feedback = current_offline
@@ -66,18 +171,21 @@ class AnchorDetector:
                 is_anchor = False
                 feedback = None
 
-            # print(f"Frame {frame_idx}, MOTA {mean_mota}")
+            # print(f"Frame {end_frame}, MOTA {mean_mota}")
 
         else:
             is_anchor = False
             feedback = None
         self.previous_offline = current_offline
+        self.previous_start = start_frame
+        self.previous_end = end_frame
 
         return is_anchor, feedback, feedback_length
 
     def _get_feedback(self, start_frame, end_frame):
         try:
-            feedback = self.offline.track(start_frame, end_frame)
+            with self.timer.measure("offline.track"):
+                feedback = self.offline.track(start_frame, end_frame)
         except (RuntimeError, ValueError):
             feedback = None
 
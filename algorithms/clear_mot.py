@@ -0,0 +1,220 @@
+import numpy as np
+from motmetrics.distances import iou_matrix
+from motmetrics.lap import linear_sum_assignment
+
+
+class PreparedFeedback:
+    """
+    Feedback of an anchor arranged once for the evaluation of every expert.
+
+    The rows are grouped by frame with their boxes, ids and ignore flags, so that
+    each expert is compared with the same CLEAR MOT procedure as motmetrics
+    (compare_to_groundtruth, or CLEAR_MOT_M whose distractor preprocessing is the
+    ignore flags) without rebuilding and regrouping the feedback per expert.
+    """
+
+    def __init__(self, feedback, ignore=None, distth=0.5):
+        """
+        feedback should be rows of [frame, id, x, y, w, h]
+        ignore flags the rows which are distractors
+        """
+
+        self.distth = distth
+
+        feedback = np.asarray(feedback, dtype=np.float64).reshape(-1, 6)
+        if ignore is None:
+            ignore = np.zeros(len(feedback), dtype=bool)
+        order = np.argsort(feedback[:, 0], kind="stable")
+        feedback = feedback[order]
+        self.ignore = np.asarray(ignore, dtype=bool)[order]
+
+        # the boxes are moved by the matlab convention as in convert_df
+        self.ids = feedback[:, 1]
+        self.boxes = feedback[:, 2:6].copy()
+        self.boxes[:, :2] -= 1
+
+        self.frames, starts = np.unique(feedback[:, 0], return_index=True)
+        self.offsets = np.append(starts, len(feedback))
+        self.has_ignore = self.ignore.any()
+
+    def frame_loss(self, results, frame_list, memo=None, offset=0):
+        """
+        results should be rows of [frame, id, x, y, w, h]
+        Return [fp, fn, ids] of each frame in frame_list
+
+        With a FrameMemo, the frames are looked up by their frame plus offset,
+        and the ones matched before in the same way are not matched again
+        """
+
+        results = np.asarray(results, dtype=np.float64).reshape(-1, 6)
+        order = np.argsort(results[:, 0], kind="stable")
+        results = results[order]
+        hyp_ids = results[:, 1]
+        hyp_boxes = results[:, 2:6].copy()
+        hyp_boxes[:, :2] -= 1
+        hyp_frames, hyp_starts = np.unique(results[:, 0], return_index=True)
+        hyp_offsets = np.append(hyp_starts, len(results))
+
+        counts = {}
+        m = {}
+        for frame in np.union1d(self.frames, hyp_frames):
+            k = np.searchsorted(self.frames, frame)
+            if k < len(self.frames) and self.frames[k] == frame:
+                gt_slice = slice(self.offsets[k], self.offsets[k + 1])
+            else:
+                gt_slice = slice(0, 0)
+            k = np.searchsorted(hyp_frames, frame)
+            if k < len(hyp_frames) and hyp_frames[k] == frame:
+                hyp_slice = slice(hyp_offsets[k], hyp_offsets[k + 1])
+            else:
+                hyp_slice = slice(0, 0)
+
+            oids = self.ids[gt_slice]
+            obj_boxes = self.boxes[gt_slice]
+            hids = hyp_ids[hyp_slice]
+            boxes = hyp_boxes[hyp_slice]
+
+            if self.has_ignore:
+                oids, obj_boxes, hids, boxes = self._drop_ignored(
+                    gt_slice, hids, boxes
+                )
+
+            if memo is None:
+                counts[frame] = self._update(m, oids, obj_boxes, hids, boxes)
+                continue
+
+            key = frame_key(m, oids, obj_boxes, hids, boxes)
+            matched = memo.frames.setdefault(int(frame) + offset, {})
+            if key in matched:
+                counts[frame], correspondences = matched[key]
+                m.update(correspondences)
+                memo.n_hits += 1
+            else:
+                counts[frame] = self._update(m, oids, obj_boxes, hids, boxes)
+                matched[key] = (counts[frame], {o: m[o] for o in oids if o in m})
+                memo.n_misses += 1
+
+        result = np.zeros((len(frame_list), 3))
+        for i, frame in enumerate(frame_list):
+            result[i] = counts.get(frame, (0, 0, 0))
+        return result
+
+    def _drop_ignored(self, gt_slice, hids, boxes):
+        ignore = self.ignore[gt_slice]
+        keep = drop_distractors(self.boxes[gt_slice], ignore, hids, boxes)
+        return (
+            self.ids[gt_slice][~ignore],
+            self.boxes[gt_slice][~ignore],
+            hids[keep],
+            boxes[keep],
+        )
+
+    def _update(self, m, oids, obj_boxes, hids, boxes):
+        dists = None
+        if len(oids) > 0 and len(hids) > 0:
+            dists = iou_matrix(obj_boxes, boxes, max_iou=self.distth)
+        return match_frame(m, oids, hids, dists)
+
+
+class FrameMemo:
+    """
+    Counts of the frames of an expert which were matched before, for the windows
+    which overlap.
+
+    The counts of a frame and the correspondences after it only depend on the boxes
+    and ids of the frame and on the correspondences of its objects before it, so a
+    frame with the same ones takes the same counts and correspondences.
+    """
+
+    def __init__(self):
+        # frame -> {key of the frame: (counts, correspondences of its objects)}
+        self.frames = {}
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def evict(self, frame):
+        """
+        Drop the frames before frame
+        """
+
+        for key in [key for key in self.frames if key < frame]:
+            del self.frames[key]
+
+
+def frame_key(m, oids, obj_boxes, hids, boxes):
+    """
+    Return what the matching of a frame with the correspondences m depends on
+    """
+
+    return (
+        oids.tobytes(),
+        obj_boxes.tobytes(),
+        hids.tobytes(),
+        boxes.tobytes(),
+        tuple(m.get(o) for o in oids),
+    )
+
+
+def drop_distractors(obj_boxes, ignore, hids, boxes):
+    """
+    Return the mask of the hypotheses which are kept by the preprocessing of CLEAR_MOT_M,
+    where the hypotheses matched to the ignored objects are removed
+    """
+
+    keep = np.ones(len(boxes), dtype=bool)
+    if len(obj_boxes) > 0 and len(boxes) > 0 and ignore.any():
+        dists = iou_matrix(obj_boxes, boxes, max_iou=0.5)
+        for i, j in zip(*linear_sum_assignment(dists)):
+            # motmetrics drops them by (frame, id), which removes every box of the id
+            if np.isfinite(dists[i, j]) and ignore[i]:
+                keep[hids == hids[j]] = False
+    return keep
+
+
+def match_frame(m, oids, hids, dists):
+    """
+    Match the objects and the hypotheses of a frame with the same steps as MOTAccumulator.update
+    m is the correspondences of the previous frames which is updated, and dists is modified
+    Return [fp, fn, ids] of the frame
+    """
+
+    oids_masked = np.zeros(len(oids), dtype=bool)
+    hids_masked = np.zeros(len(hids), dtype=bool)
+    n_switches = 0
+
+    if len(oids) > 0 and len(hids) > 0:
+        # keep the previous correspondences
+        for i in range(len(oids)):
+            if oids[i] not in m:
+                continue
+
+            (j,) = np.where(~hids_masked & (hids == m[oids[i]]))
+            if len(j) == 0:
+                continue
+            j = j[0]
+
+            if np.isfinite(dists[i, j]):
+                oids_masked[i] = True
+                hids_masked[j] = True
+                m[oids[i]] = hids[j]
+
+        # match the remaining ones
+        dists[oids_masked, :] = np.nan
+        dists[:, hids_masked] = np.nan
+        for i, j in zip(*linear_sum_assignment(dists)):
+            if not np.isfinite(dists[i, j]):
+                continue
+
+            o = oids[i]
+            h = hids[j]
+            if o in m and m[o] != h:
+                n_switches += 1
+            oids_masked[i] = True
+            hids_masked[j] = True
+            m[o] = h
+
+    return (
+        int((~hids_masked).sum()),
+        int((~oids_masked).sum()),
+        n_switches,
+    )
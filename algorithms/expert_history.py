@@ -0,0 +1,131 @@
+import numpy as np
+
+
+class ExpertHistory:
+    """
+    Append-only history of experts' results.
+
+    Rows start with the frame, e.g. [frame, expert, id, x, y, w, h], and are kept
+    contiguous in frame order inside a buffer which grows by whole chunks, so
+    appending a frame is amortized O(1) and any range of frames is a zero-copy
+    view of the buffer.
+
+    Frames older than a retention window can be dropped with trim. The buffer is
+    compacted once the dropped part outweighs the kept one, and the stored frame
+    numbers are re-based on base_frame at the same time so they stay small.
+    """
+
+    def __init__(self, n_cols=6, dtype=np.float64, chunk_size=1024):
+        self.n_cols = n_cols
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        self.data = np.empty((self.chunk_size, self.n_cols), dtype=self.dtype)
+        self.n_rows = 0
+
+        # offsets[k] is the first row of frame first_frame + k
+        self.offsets = np.zeros(self.chunk_size, dtype=np.int64)
+        self.first_frame = None
+        self.n_frames = 0
+
+        # frames before first_frame + head are trimmed
+        self.head = 0
+        self.base_frame = 0
+
+    def __getstate__(self):
+        # leave out the unused capacity
+        state = self.__dict__.copy()
+        state["data"] = self.data[: self.n_rows].copy()
+        state["offsets"] = self.offsets[: self.n_frames + 1].copy()
+        return state
+
+    def __len__(self):
+        return self.n_rows - self.offsets[self.head]
+
+    @property
+    def last_frame(self):
+        if self.first_frame is None:
+            return None
+        return self.first_frame + self.n_frames - 1
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+    def append(self, frame, result):
+        """
+        result should be the rows of the frame without the frame column
+        """
+
+        if self.first_frame is None:
+            self.first_frame = frame
+        assert frame > self.last_frame, "Frames should be appended in order"
+
+        # frames without any result still get an offset
+        n_new_frames = frame - self.last_frame
+        self.offsets = self._reserve(self.offsets, self.n_frames + n_new_frames + 1)
+        self.offsets[self.n_frames + 1 : self.n_frames + n_new_frames + 1] = self.n_rows
+        self.n_frames += n_new_frames
+
+        if len(result) > 0:
+            n = len(result)
+            self.data = self._reserve(self.data, self.n_rows + n)
+            self.data[self.n_rows : self.n_rows + n, 0] = frame - self.base_frame
+            self.data[self.n_rows : self.n_rows + n, 1:] = result
+            self.n_rows += n
+            self.offsets[self.n_frames] = self.n_rows
+
+    def view(self, start_frame, end_frame):
+        """
+        Return the rows from start_frame to end_frame (inclusive) without copying.
+        Their frame numbers are relative to base_frame.
+        """
+
+        if self.first_frame is None:
+            return self.data[:0]
+
+        start = min(max(start_frame - self.first_frame, self.head), self.n_frames)
+        end = min(max(end_frame - self.first_frame + 1, start), self.n_frames)
+        return self.data[self.offsets[start] : self.offsets[end]]
+
+    def trim(self, before_frame):
+        """
+        Drop the rows of every frame before before_frame
+        """
+
+        if self.first_frame is None:
+            return
+
+        self.head = min(max(before_frame - self.first_frame, self.head), self.n_frames)
+        if self.head > 0 and 2 * self.head >= self.n_frames:
+            self._compact()
+
+    def _compact(self):
+        start_row = self.offsets[self.head]
+        n_rows = self.n_rows - start_row
+        n_frames = self.n_frames - self.head
+        first_frame = self.first_frame + self.head
+
+        self.data[:n_rows] = self.data[start_row : self.n_rows]
+        self.data[:n_rows, 0] -= first_frame - self.base_frame
+        self.offsets[: n_frames + 1] = (
+            self.offsets[self.head : self.n_frames + 1] - start_row
+        )
+
+        self.n_rows = n_rows
+        self.n_frames = n_frames
+        self.first_frame = first_frame
+        self.base_frame = first_frame
+        self.head = 0
+
+    def _reserve(self, array, size):
+        if size <= len(array):
+            return array
+
+        capacity = max(size, 2 * len(array))
+        capacity = -(-capacity // self.chunk_size) * self.chunk_size
+        grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[: len(array)] = array
+        return grown
@@ -0,0 +1,135 @@
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from time_manager import StageTimer
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackWorker:
+    """
+    Solves feedback requests on a background thread so that tracking never waits
+    for the offline tracker.
+
+    At most max_pending requests are kept. When a new request arrives on a full
+    queue, the policy decides what happens to it:
+    - drop: the new request is discarded
+    - coalesce: the newest request which has not started yet is replaced by the new one
+    - block: wait for the oldest requests to finish until there is room for it
+    """
+
+    def __init__(self, solve_fn, max_pending=2, policy="coalesce", timer=None):
+        if policy not in ("drop", "coalesce", "block"):
+            raise NameError("Please enter a valid back-pressure policy")
+
+        self.solve_fn = solve_fn
+        self.max_pending = max_pending
+        self.policy = policy
+        self.timer = StageTimer() if timer is None else timer
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = deque()
+        # solved requests which left the queue but have not been collected yet
+        self.finished = deque()
+        self.n_submitted = 0
+        self.n_dropped = 0
+        self.n_failed = 0
+
+    def reset(self):
+        requests = list(self.finished) + list(self.pending)
+        for _, _, _, future, _ in requests:
+            future.cancel()
+        wait([future for _, _, _, future, _ in requests])
+        self.pending.clear()
+        self.finished.clear()
+        self.n_submitted = 0
+        self.n_dropped = 0
+        self.n_failed = 0
+
+    def state_dict(self):
+        # uncollected requests are solved again after loading
+        return {
+            "pending": [
+                (frame_idx, start_frame, request)
+                for frame_idx, start_frame, request, _, _ in list(self.finished)
+                + list(self.pending)
+            ],
+            "n_submitted": self.n_submitted,
+            "n_dropped": self.n_dropped,
+            "n_failed": self.n_failed,
+        }
+
+    def load_state_dict(self, state):
+        self.reset()
+        for frame_idx, start_frame, request in state["pending"]:
+            self.submit(frame_idx, start_frame, request)
+        self.n_submitted = state["n_submitted"]
+        self.n_dropped = state["n_dropped"]
+        self.n_failed = state["n_failed"]
+
+    def stats(self):
+        return {
+            "submitted": self.n_submitted,
+            "dropped": self.n_dropped,
+            "failed": self.n_failed,
+        }
+
+    def oldest_frame(self):
+        if len(self.finished) > 0:
+            return self.finished[0][0]
+        if len(self.pending) == 0:
+            return None
+        return self.pending[0][0]
+
+    def submit(self, frame_idx, start_frame, request):
+        if len(self.pending) >= self.max_pending:
+            if self.policy == "block":
+                while len(self.pending) >= self.max_pending:
+                    wait([self.pending[0][3]])
+                    self.finished.append(self.pending.popleft())
+            elif self.policy == "coalesce" and self.pending[-1][3].cancel():
+                self.pending.pop()
+                self.n_dropped += 1
+            else:
+                self.n_dropped += 1
+                return False
+
+        if request is None:
+            future = Future()
+            future.set_result(None)
+        else:
+            future = self.executor.submit(self._solve, frame_idx, start_frame, request)
+        self.pending.append(
+            (frame_idx, start_frame, request, future, time.perf_counter())
+        )
+        self.n_submitted += 1
+        return True
+
+    def completed(self, block=False):
+        """
+        Return [(frame_idx, start_frame, feedback)] of the finished requests in submission order
+        """
+
+        while len(self.pending) > 0 and (block or self.pending[0][3].done()):
+            self.finished.append(self.pending.popleft())
+
+        results = []
+        while len(self.finished) > 0:
+            frame_idx, start_frame, _, future, submitted = self.finished.popleft()
+            result = future.result()
+            self.timer.add("worker.turnaround", time.perf_counter() - submitted)
+            results.append((frame_idx, start_frame, result))
+        return results
+
+    def _solve(self, frame_idx, start_frame, request):
+        try:
+            with self.timer.measure("offline.solve"):
+                return self.solve_fn(request)
+        except (RuntimeError, ValueError) as error:
+            # the window is treated like one without feedback
+            self.n_failed += 1
+            logger.warning(
+                "Feedback of frames %d-%d failed: %s", start_frame, frame_idx, error
+            )
+            return None
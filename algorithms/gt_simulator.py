@@ -0,0 +1,125 @@
+import numpy as np
+
+from algorithms.waa import WAADelayed
+from algorithms.aaa_util import reduce_loss
+from algorithms.clear_mot import PreparedFeedback
+
+
+def compute_gt_losses(gts, experts_results):
+    """
+    gts: [rows of [frame, id, x, y, w, h, ...]] of each frame
+    experts_results: [[rows of [id, x, y, w, h]] of each frame] of each expert
+    Return the loss tensor of [fp, fn, ids] with shape (frames, experts, 3) and the number of gt boxes per frame
+    """
+
+    n_frames = len(gts)
+    feedback = [
+        np.asarray(gt)[:, :6] for gt in gts if gt is not None and len(gt) > 0
+    ]
+    feedback = np.concatenate(feedback) if len(feedback) > 0 else np.empty((0, 6))
+    n_gts = np.bincount(
+        feedback[:, 0].astype(np.int64) - 1, minlength=n_frames
+    )[:n_frames]
+
+    prepared = PreparedFeedback(feedback)
+    losses = np.zeros((n_frames, len(experts_results), 3))
+    for i, expert_results in enumerate(experts_results):
+        rows = [
+            np.concatenate([np.full((len(result), 1), frame_idx + 1), result], axis=1)
+            for frame_idx, result in enumerate(expert_results)
+            if len(result) > 0
+        ]
+        rows = np.concatenate(rows) if len(rows) > 0 else np.empty((0, 6))
+        losses[:, i] = prepared.frame_loss(rows, range(1, n_frames + 1))
+
+    return losses, n_gts
+
+
+def replay(losses, n_gts, config):
+    """
+    Replay the weight updates of AAA with gt feedback from a loss tensor.
+
+    The detectors and the delayed updates follow AAA, but every frame keeps the loss
+    of the whole sequence evaluation, so an id switch is counted even when the
+    evaluated window of AAA starts right before it.
+
+    Return the weights after each frame and the gradient losses of each update
+    """
+
+    n_frames, n_experts, _ = losses.shape
+    duration = config["DETECTOR"]["duration"]
+    frame_losses = reduce_loss(losses, config["LOSS"]["type"])
+
+    learner = WAADelayed()
+    learner.initialize(n_experts)
+    n_pending = 0
+    delay_sum = 0
+    first_unevaluated = 0
+    previous_end = None
+
+    ws = np.zeros((n_frames, n_experts))
+    gradient_losses = {}
+    for frame_idx in range(n_frames):
+        if config["LOSS"]["delayed"]:
+            delay_sum += n_pending
+        n_pending += 1
+        delay_sum += 1
+
+        # the gt feedback of overlapping windows always agrees, so MOTA is 1 unless the overlap is empty
+        if config["DETECTOR"]["type"] == "fixed":
+            feedback_length = duration
+            is_anchor = (frame_idx + 1) % duration == 0
+        elif config["DETECTOR"]["type"] == "stable":
+            start_frame = max(frame_idx + 1 - duration, 0)
+            feedback_length = frame_idx + 1 - start_frame
+            is_anchor = (
+                previous_end is not None
+                and previous_end >= start_frame
+                and n_gts[start_frame : previous_end + 1].sum() > 0
+                and config["DETECTOR"]["threshold"] <= 1
+            )
+            previous_end = frame_idx
+        else:
+            raise NameError("Please enter a valid detector type")
+
+        if is_anchor:
+            feedback_start = frame_idx + 1 - feedback_length
+            first_unevaluated_idx = max(first_unevaluated - feedback_start, 0)
+            is_last = False
+            if first_unevaluated_idx == feedback_length - 1:
+                first_unevaluated_idx = feedback_length - 2
+                is_last = True
+
+            # the evaluation ends at the last frame of the window which has a gt box
+            dt = feedback_start + first_unevaluated_idx
+            window_gts = np.flatnonzero(n_gts[dt : frame_idx + 1])
+            feedback_max = window_gts[-1] + 1 if len(window_gts) > 0 else 0
+
+            if feedback_max > 0:
+                loss = frame_losses[dt : dt + feedback_max].T
+                if is_last:
+                    loss = loss[:, -1:]
+                loss = loss / config["LOSS"]["bound"]
+                gradient_losses[frame_idx] = loss.sum(axis=1)
+                learner.update(gradient_losses[frame_idx], delay_sum)
+
+                n_pending -= frame_idx + 1 - max(first_unevaluated, feedback_start)
+                first_unevaluated = frame_idx + 1
+
+        ws[frame_idx] = learner.w
+
+    return ws, gradient_losses
+
+
+def regret(ws, losses, loss_type):
+    """
+    Cumulative expected loss of the learner minus the one of the best expert in hindsight
+    """
+
+    frame_losses = reduce_loss(losses, loss_type)
+
+    # the weights before a frame are the ones after the previous frame
+    n_experts = ws.shape[1]
+    previous_ws = np.concatenate([np.ones((1, n_experts)) / n_experts, ws[:-1]])
+    learner_loss = (previous_ws * frame_losses).sum()
+    return learner_loss - frame_losses.sum(axis=0).min()
@@ -1,11 +1,48 @@
 import random
+from collections import defaultdict
 from collections.abc import Iterable
 import numpy as np
 import networkx as nx
-from algorithms.aaa_util import overlap_ratio, goverlap_ratio
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+from time_manager import StageTimer
+from algorithms.aaa_util import (
+    overlap_ratio,
+    goverlap_ratio,
+    overlap_matrix,
+    goverlap_matrix,
+    overlapping_pairs,
+    stack_results,
+)
+
+
+# the components of the graph matching up to this number of boxes are partitioned exactly
+EXACT_PARTITION_SIZE = 8
+# the distances of the kmeans matching up to this number of boxes are computed at once
+DENSE_DISTANCE_SIZE = 512
 
 
 def proper_overlap(x, y, mode):
+    """
+    Overlap of every pair of boxes of x and y as a len(x) x len(y) matrix
+    """
+
+    if mode == "iou":
+        score = overlap_matrix(x, y)
+    elif mode == "giou":
+        score = goverlap_matrix(x, y)
+    else:
+        raise NameError("Please enter a valid iou method")
+
+    return score
+
+
+def proper_pair_overlap(x, y, mode):
+    """
+    Overlap of each box of x with the box of y in the same row
+    """
+
     if mode == "iou":
         score = overlap_ratio(x, y)
     elif mode == "giou":
@@ -18,13 +55,13 @@ def proper_overlap(x, y, mode):
 
 def overlap_distance(iou_mode):
     def distance(x, y):
-        valid_x = x.copy()
-        valid_y = y.copy()
-        if len(valid_x) == 5:
-            valid_x = valid_x[1:]
-            valid_y = valid_y[:, 1:]
+        x = np.atleast_2d(x)
+        y = np.atleast_2d(y)
+        if x.shape[1] == 5:
+            x = x[:, 1:]
+            y = y[:, 1:]
 
-        score = proper_overlap(valid_x, valid_y, iou_mode)
+        score = proper_overlap(x, y, iou_mode)
         return 1 - score
 
     return distance
@@ -33,6 +70,7 @@ def overlap_distance(iou_mode):
 def hungarian_matching(left_nodes, right_nodes, threshold, dist_fn):
     """
     node shoud be [id, features]
+    dist_fn should return the matrix of the distances between the left and right nodes
     """
 
     if len(right_nodes) == 0 or left_nodes is None or len(left_nodes) == 0:
@@ -40,12 +78,12 @@ def hungarian_matching(left_nodes, right_nodes, threshold, dist_fn):
 
     G = nx.DiGraph()
     edges = []
-    for left_node in left_nodes:
+    dists = dist_fn(left_nodes, right_nodes)
+    for left_node, costs in zip(left_nodes, dists):
         if isinstance(left_node, Iterable):
             left_id = int(left_node[0])
         else:
             left_id = int(left_node)
-        costs = dist_fn(left_node, right_nodes)
         valid_idxs = np.where(costs < threshold)[0]
 
         for valid_idx in valid_idxs:
@@ -90,117 +128,393 @@ def hungarian_matching(left_nodes, right_nodes, threshold, dist_fn):
     return result
 
 
+def node_id(node):
+    if isinstance(node, Iterable):
+        return node[0]
+    else:
+        return node
+
+
+def assignment_matching(left_nodes, right_nodes, threshold, dist_fn):
+    """
+    Same matching as hungarian_matching solved as a rectangular assignment
+    node shoud be [id, features]
+    """
+
+    if len(right_nodes) == 0 or left_nodes is None or len(left_nodes) == 0:
+        return []
+
+    costs = dist_fn(left_nodes, right_nodes)
+    valid = costs < threshold
+    weights = np.zeros(costs.shape, dtype=np.int64)
+    weights[valid] = (costs[valid] * 100).astype(np.int64)
+
+    # the node of a new id can take every left node, so it gets a column for each of them
+    right_ids = [node_id(right_node) for right_node in right_nodes]
+    columns = []
+    for right_idx, right_id in enumerate(right_ids):
+        columns += [right_idx] * (len(left_nodes) if right_id == -1 else 1)
+    columns = np.array(columns)
+    valid = valid[:, columns]
+    weights = weights[:, columns]
+
+    # a match costs less than any sum of weights, so the number of matches is maximized
+    # first and the sum of weights is minimized among the maximum matchings like the flow
+    if not valid.any():
+        return []
+    penalty = (weights[valid].max() + 1) * (min(valid.shape) + 1)
+    rows, cols = linear_sum_assignment(np.where(valid, weights - penalty, 0))
+
+    result = []
+    for row, col in zip(rows, cols):
+        if valid[row, col]:
+            left_id = int(node_id(left_nodes[row]))
+            result.append((left_id, right_ids[columns[col]]))
+    return result
+
+
+def clique_bound(can_link, groups):
+    """
+    Size of a clique of the cannot-link graph, which is a lower bound of the number
+    of clusters, grown greedily from each group of boxes which are all cannot-linked.
+    can_link should be the csr matrix of the pairs of boxes which are not cannot-linked
+    """
+
+    # the node with the fewest links has the most cannot-links
+    degrees = np.diff(can_link.indptr)
+    max_size = 0
+    for group in groups:
+        clique = list(group)
+        candidates = np.ones(can_link.shape[0], dtype=bool)
+        candidates[clique] = False
+        for node in clique:
+            candidates[neighbors(can_link, node)] = False
+        while candidates.any():
+            # the candidate with the most cannot-links keeps the most candidates
+            node = np.flatnonzero(candidates)[np.argmin(degrees[candidates])]
+            clique.append(node)
+            candidates[node] = False
+            candidates[neighbors(can_link, node)] = False
+        max_size = max(max_size, len(clique))
+    return max_size
+
+
+def neighbors(pairs, node):
+    # the nodes paired with the node in a csr matrix
+    return pairs.indices[pairs.indptr[node] : pairs.indptr[node + 1]]
+
+
+def sparse_pairs(matrix):
+    """
+    Return the csr matrix of the nonzero pairs of the square matrix, which can be dense,
+    without the pairs of a node with itself
+    """
+
+    # the matrices built by sparse_pairs are kept as they are
+    if (
+        isinstance(matrix, csr_matrix)
+        and matrix.has_canonical_format
+        and matrix.data.all()
+        and not matrix.diagonal().any()
+    ):
+        return matrix
+
+    matrix = coo_matrix(matrix)
+    keep = (matrix.row != matrix.col) & (matrix.data != 0)
+    pairs = csr_matrix(
+        (np.ones(keep.sum(), dtype=bool), (matrix.row[keep], matrix.col[keep])),
+        shape=matrix.shape,
+    )
+    pairs.sum_duplicates()
+    return pairs
+
+
+class DistanceColumns:
+    """
+    Distances of the boxes of data to the boxes which are asked for.
+
+    The k-means only compares the boxes with its medoids and the boxes of a cluster
+    with each other, so the distances to a box are computed when it is first a medoid
+    instead of computing the whole matrix, unless there are at most DENSE_DISTANCE_SIZE
+    boxes, where a single matrix costs less. known can be {(i, j): distance} of the pairs
+    whose distances are already computed, which are the linked pairs of a cluster.
+    """
+
+    def __init__(self, data, dist_func, known=None):
+        self.data = data
+        self.dist_func = dist_func
+        self.known = {} if known is None else known
+        # the columns of the boxes are kept in the order they are computed
+        self.slots = np.full(len(data), -1)
+        self.columns = np.empty((len(data), 0))
+        self.n_columns = 0
+        # the clusters repeat over the iterations and the fits of each k
+        self.blocks = {}
+
+    def to(self, idxs):
+        """
+        Return the len(data) x len(idxs) matrix of the distances to the boxes idxs
+        """
+
+        missing = np.unique(idxs[self.slots[idxs] == -1])
+        if len(missing) > 0 and len(self.data) <= DENSE_DISTANCE_SIZE:
+            missing = np.flatnonzero(self.slots == -1)
+        if len(missing) > 0:
+            n_columns = self.n_columns + len(missing)
+            if n_columns > self.columns.shape[1]:
+                columns = np.empty(
+                    (len(self.data), max(n_columns, 2 * self.columns.shape[1]))
+                )
+                columns[:, : self.n_columns] = self.columns[:, : self.n_columns]
+                self.columns = columns
+            self.columns[:, self.n_columns : n_columns] = self.dist_func(
+                self.data, self.data[missing]
+            )
+            self.slots[missing] = np.arange(self.n_columns, n_columns)
+            self.n_columns = n_columns
+        return self.columns[:, self.slots[idxs]]
+
+    def between(self, idxs):
+        """
+        Return the len(idxs) x len(idxs) matrix of the distances between the boxes idxs
+        """
+
+        key = tuple(idxs)
+        if key not in self.blocks:
+            slots = self.slots[idxs]
+            pairs = [(i, j) for i in key for j in key if i != j]
+            if (slots != -1).all():
+                block = self.columns[np.ix_(idxs, slots)]
+            elif all(pair in self.known for pair in pairs):
+                block = np.zeros((len(key), len(key)))
+                block[~np.eye(len(key), dtype=bool)] = [self.known[pair] for pair in pairs]
+            else:
+                block = self.dist_func(self.data[idxs], self.data[idxs])
+            self.blocks[key] = block
+        return self.blocks[key]
+
+
+def greedy_partition(can_link, overlaps, nodes):
+    """
+    Merge the clusters of the pairs of nodes from the largest overlap while every
+    pair of nodes of the merged cluster can be linked
+    """
+
+    clusters = {node: [node] for node in nodes}
+    owner = {node: node for node in nodes}
+    pairs = [
+        (overlaps[i, j], i, j)
+        for n, i in enumerate(nodes)
+        for j in nodes[n + 1 :]
+        if can_link[i, j]
+    ]
+    pairs.sort(key=lambda pair: -pair[0])
+
+    for _, i, j in pairs:
+        left = owner[i]
+        right = owner[j]
+        if left == right or not can_link[np.ix_(clusters[left], clusters[right])].all():
+            continue
+        clusters[left] += clusters.pop(right)
+        for node in clusters[left]:
+            owner[node] = left
+    return canonical_partition(clusters.values())
+
+
+def canonical_partition(clusters):
+    # the clusters are sorted by their first node so a partition has a single order
+    return sorted(sorted(cluster) for cluster in clusters)
+
+
+def exact_partition(can_link, overlaps, nodes):
+    """
+    Partition with the minimum number of clusters of nodes which can all be linked,
+    and the maximum sum of the overlaps in the clusters among them
+    """
+
+    def score(clusters):
+        return sum(overlaps[np.ix_(c, c)].sum() for c in clusters)
+
+    # the greedy partition is the only one when it is a single cluster
+    best = greedy_partition(can_link, overlaps, nodes)
+    if len(best) == 1:
+        return best
+    best_key = (len(best), -score(best))
+
+    clusters = []
+
+    def search(idx):
+        nonlocal best, best_key
+        if len(clusters) > best_key[0]:
+            return
+        if idx == len(nodes):
+            partition = canonical_partition(clusters)
+            key = (len(partition), -score(partition))
+            if key < best_key:
+                best = partition
+                best_key = key
+            return
+
+        node = nodes[idx]
+        for cluster in clusters:
+            if can_link[node, cluster].all():
+                cluster.append(node)
+                search(idx + 1)
+                cluster.pop()
+        clusters.append([node])
+        search(idx + 1)
+        clusters.pop()
+
+    search(0)
+    return best
+
+
 class COP_KMeans:
     """
     https://github.com/Behrouz-Babaki/COP-Kmeans
     https://github.com/lars76/kmeans-anchor-boxes
+
+    ml should be the matrix of the must-link pairs and can_link the one of the pairs
+    which are not cannot-linked, dense or sparse, so that the cannot-links, which are
+    most of the pairs of a frame, are never stored. The centroids are kept as the
+    indices of the boxes which are medoids
     """
 
-    def __init__(self, k, ml, cl, dist_func, max_iterations=300):
+    def __init__(self, k, ml, can_link, dist_func, max_iterations=300, rng=random):
         self.k = k
         self.ml = ml
-        self.cl = cl
+        self.can_link = can_link
         self.dist_func = dist_func
         self.max_iterations = max_iterations
+        self.rng = rng
+
+    def fit(self, data, initial_method="random", dists=None):
+        """
+        dists can be the DistanceColumns of data shared by the fits of several k
+        """
+
+        if dists is None:
+            dists = DistanceColumns(data, self.dist_func)
+
+        # a box is not constrained by itself
+        ml = sparse_pairs(self.ml)
+        can_link = sparse_pairs(self.can_link)
+        has_ml = np.diff(ml.indptr) > 0
 
-    def fit(self, data, initial_method="random"):
         # initialize the centroids, the random 'k' elements in the dataset will be our initial centroids
-        self.centroids = self.initialize_centers(data, self.k, initial_method)
+        self.centroid_idxs = self.initialize_centers(data, self.k, initial_method)
+        self.centroids = data[self.centroid_idxs]
+
+        # the iterations only depend on the centroids, so they cycle once the centroids repeat
+        seen = {tuple(self.centroid_idxs): 0}
 
         # begin iterations
-        for i in range(self.max_iterations):
-            self.is_clustered = [-1] * len(data)
+        iteration = 0
+        while iteration < self.max_iterations:
+            self.is_clustered = np.full(len(data), -1)
 
             self.clusters = {}
             for i in range(self.k):
                 self.clusters[i] = set()
 
+            # the boxes of each cluster and how many of them each box can be in a cluster with,
+            # so a box can only join the clusters where it can be with all of them.
+            # They are updated by each assignment since a box keeps its cluster
+            # until the next iteration
+            n_members = np.zeros(self.k, dtype=np.int64)
+            n_allowed = np.zeros((len(data), self.k), dtype=np.int64)
+
             # find the distance between the point and cluster; choose the nearest centroid
+            sorted_distances = np.argsort(dists.to(self.centroid_idxs), axis=1)
             for x_index in range(len(data)):
-                distances = self.dist_func(data[x_index], self.centroids)
-
-                sorted_distances = np.argsort(distances)
-                empty_flag = True
-
-                for center_index in sorted_distances:
-                    vc_result = self.violate_constraints(
-                        x_index, center_index, self.ml, self.cl
-                    )
-
-                    if not vc_result:
-                        self.clusters[center_index].add(x_index)
-                        self.is_clustered[x_index] = center_index
-
-                        for j in self.ml[x_index]:
-                            self.is_clustered[j] = center_index
-
-                        empty_flag = False
-                        break
+                feasible = n_allowed[x_index] == n_members
+                if has_ml[x_index]:
+                    linked = neighbors(ml, x_index)
+                    feasible &= self.linked_clusters(linked)
+                center_indices = sorted_distances[x_index][
+                    feasible[sorted_distances[x_index]]
+                ]
 
                 # Unfeasible
-                if empty_flag:
+                if len(center_indices) == 0:
                     return -1
 
+                center_index = center_indices[0]
+                self.clusters[center_index].add(x_index)
+                self.is_clustered[x_index] = center_index
+                n_members[center_index] += 1
+                n_allowed[neighbors(can_link, x_index), center_index] += 1
+
+                if has_ml[x_index]:
+                    self.is_clustered[linked] = center_index
+                    # the must-linked boxes are checked later, and a box can be with itself
+                    n_members[center_index] += len(linked)
+                    n_allowed[linked, center_index] += 1
+                    for clustered in linked:
+                        n_allowed[neighbors(can_link, clustered), center_index] += 1
+
             previous = self.centroids.copy()
 
-            # average the cluster data points to re-calculate the centroids
+            # the medoid of a cluster is its box with the minimum sum of the distances to the others
             for _center in self.clusters:
-                lst = []
-                for index_value in self.clusters[_center]:
-                    lst.append(data[index_value])
+                members = list(self.clusters[_center])
 
-                if len(lst) == 0:
+                if len(members) == 0:
                     continue
 
-                if len(lst) == 1:
-                    self.centroids[_center] = lst[0]
+                if len(members) == 1:
+                    self.centroid_idxs[_center] = members[0]
                     continue
 
-                min_idx = -1
-                min_sum_dist = np.inf
-                for i in range(len(lst)):
-                    others = np.array(lst[:i] + lst[i + 1 :])
-                    distances = self.dist_func(lst[i], others)
-                    sum_dist = np.sum(distances)
-                    if sum_dist < min_sum_dist:
-                        min_sum_dist = sum_dist
-                        min_idx = i
+                others = ~np.eye(len(members), dtype=bool)
+                sum_dists = (
+                    dists.between(members)[others]
+                    .reshape(len(members), -1)
+                    .sum(axis=1)
+                )
+
+                # the first minimum is kept, and the last box if no sum is finite
+                finite_idxs = np.flatnonzero(sum_dists < np.inf)
+                if len(finite_idxs) == 0:
+                    min_idx = -1
+                else:
+                    min_idx = finite_idxs[np.argmin(sum_dists[finite_idxs])]
 
-                self.centroids[_center] = lst[min_idx]
+                self.centroid_idxs[_center] = members[min_idx]
+            self.centroids = data[self.centroid_idxs]
 
             # Converged
             if (previous == self.centroids).all():
                 return 1
 
+            # skip the whole cycles which are left, the last iterations give the same result
+            iteration += 1
+            state = tuple(self.centroid_idxs)
+            if state in seen:
+                period = iteration - seen[state]
+                iteration += (self.max_iterations - iteration) // period * period
+            seen[state] = iteration
+
         # Not converged
         return 0
 
-    def violate_constraints(self, data_index, cluster_index, ml, cl):
-        for i in ml[data_index]:
-            if (
-                data_index != i
-                and self.is_clustered[i] != -1
-                and self.is_clustered[i] != cluster_index
-            ):
-                return True
-
-        for i in cl[data_index]:
-            if (
-                data_index != i
-                and self.is_clustered[i] != -1
-                and self.is_clustered[i] == cluster_index
-            ):
-                return True
-
-        return False
+    def linked_clusters(self, linked):
+        """
+        Return whether each cluster is the one of every must-linked box which is clustered,
+        where linked are the indices of the must-linked boxes
+        """
+
+        clusters = self.is_clustered[linked]
+        clusters = np.unique(clusters[clusters != -1])
+        if len(clusters) == 0:
+            return np.ones(self.k, dtype=bool)
+        return (np.arange(self.k) == clusters[0]) & (len(clusters) == 1)
 
     def initialize_centers(self, dataset, k, method):
         if method == "random":
-            c = np.zeros((k, 4))
             index_list = list(range(len(dataset)))
-            random.shuffle(index_list)
-            for i in range(k):
-                c[i] = dataset[index_list[i]]
+            self.rng.shuffle(index_list)
+            centers = index_list[:k]
 
         elif method == "km++":
             chances = [1] * len(dataset)
@@ -209,29 +523,56 @@ class COP_KMeans:
 
             for i in range(k):
                 chances = [x / sum(chances) for x in chances]
-                r = random.random()
+                r = self.rng.random()
                 acc = 0.0
                 for index, chance in enumerate(chances):
                     if acc + chance >= r:
                         break
                     acc += chance
-                centers.append(dataset[index])
+                centers.append(index)
                 c[i] = dataset[index]
-                for index, point in enumerate(dataset):
-                    distances = self.dist_func(point, c)
-                    chances[index] = np.min(distances)
+                chances = np.min(self.dist_func(dataset, c), axis=1).tolist()
 
-        return c
+        return np.array(centers, dtype=np.int64)
 
 
 class IDMatcher:
-    def __init__(self, config):
+    def __init__(self, config, timer=None):
         self.config = config
+        self.timer = StageTimer() if timer is None else timer
         self.overlap_fn = overlap_distance(self.config["MATCHING"]["iou_mode"])
 
-    def initialize(self, n_experts):
+        solver = self.config["MATCHING"]["solver"]
+        if solver == "flow":
+            self.matching_fn = hungarian_matching
+        elif solver == "assignment":
+            self.matching_fn = assignment_matching
+        else:
+            raise NameError("Please enter a valid matching solver")
+
+    def initialize(self, n_experts, rng=random):
         self.last_id = 0
-        self.id_table = {i: {} for i in range(n_experts)}
+        self.rng = rng
+
+        # fits of kmeans_match in each frame, without and with the pruning of the k search
+        self.fit_counts = []
+
+        # tables are made when an expert gets its first id
+        self.id_table = defaultdict(dict)
+
+    def state_dict(self):
+        return {
+            "last_id": self.last_id,
+            "id_table": self.id_table,
+            "rng": self.rng.getstate(),
+            "fit_counts": self.fit_counts,
+        }
+
+    def load_state_dict(self, state):
+        self.last_id = state["last_id"]
+        self.id_table = state["id_table"]
+        self.rng.setstate(state["rng"])
+        self.fit_counts = state["fit_counts"]
 
     def get_id(self, expert_id, box_id):
         if box_id not in self.id_table[expert_id].keys():
@@ -250,12 +591,13 @@ class IDMatcher:
         if prev_selected_expert != selected_expert and prev_selected_expert is not None:
             curr_expert_bboxes = results[selected_expert].copy()
             prev_expert_bboxes = results[prev_selected_expert].copy()
-            matched_id = hungarian_matching(
-                prev_expert_bboxes,
-                curr_expert_bboxes,
-                self.config["MATCHING"]["threshold"],
-                self.overlap_fn,
-            )
+            with self.timer.measure("matcher.hungarian"):
+                matched_id = self.matching_fn(
+                    prev_expert_bboxes,
+                    curr_expert_bboxes,
+                    self.config["MATCHING"]["threshold"],
+                    self.overlap_fn,
+                )
 
             # match id
             for prev_id, curr_id in matched_id:
@@ -277,64 +619,260 @@ class IDMatcher:
 
         return curr_expert_bboxes
 
-    def kmeans_match(self, experts_w, selected_expert, results):
-        # flatten results
-        flatid2originid = []
-        originid2flatid = []
-        flat_bboxes = []
-        for e_i, result in enumerate(results):
-            flatids = []
-            for box in result:
-                flat_bboxes.append(box[1:])
-                flatids.append(len(flatid2originid))
-                flatid2originid.append((e_i, box[0]))
-            originid2flatid.append(flatids)
-        flat_bboxes = np.array(flat_bboxes)
+    def linear_search(self, data, dists, ml, can_link, min_k, lower_bound):
+        """
+        Fit every k from min_k until a fit converges like the search without pruning,
+        where the fits under lower_bound only draw their initial centroids
+        """
+
+        for k in range(min_k, lower_bound):
+            kmeans = COP_KMeans(k, ml, can_link, self.overlap_fn, rng=self.rng)
+            kmeans.initialize_centers(data, k, "random")
+
+        n_fits = 0
+        for k in range(lower_bound, len(data) + 1):
+            kmeans = COP_KMeans(k, ml, can_link, self.overlap_fn, rng=self.rng)
+            fit_result = kmeans.fit(data, dists=dists)
+            n_fits += 1
+            if fit_result == 1:
+                break
+        return kmeans, n_fits
+
+    def gallop_search(self, data, dists, ml, can_link, lower_bound):
+        """
+        Double the step over k from lower_bound until a fit converges, then bisect
+        between the last k which did not converge and the first one which did,
+        assuming that the fits converge from some k on
+        """
+
+        fits = {}
+
+        def fit(k):
+            kmeans = COP_KMeans(k, ml, can_link, self.overlap_fn, rng=self.rng)
+            fits[k] = (kmeans.fit(data, dists=dists), kmeans)
+            return fits[k][0] == 1
+
+        low = lower_bound - 1
+        high = lower_bound
+        step = 1
+        while not fit(high):
+            if high == len(data):
+                return fits[high][1], len(fits)
+            low = high
+            high = min(high + step, len(data))
+            step *= 2
+
+        while high - low > 1:
+            middle = (low + high) // 2
+            if fit(middle):
+                high = middle
+            else:
+                low = middle
+        return fits[high][1], len(fits)
+
+    def flatten_results(self, results, candidates=None):
+        # flatten the results of the candidate experts
+        if candidates is None:
+            candidates = np.arange(len(results))
+        flat_results = stack_results([results[e_i] for e_i in candidates])
+        flat_experts = np.asarray(candidates)[flat_results[:, 0].astype(np.int64)]
+        flat_bboxes = flat_results[:, 2:]
+        flatid2originid = list(zip(flat_experts.tolist(), flat_results[:, 1].tolist()))
+        return flat_experts, flat_bboxes, flatid2originid
+
+    def box_pairs(self, flat_bboxes, dense=False):
+        """
+        Return the pairs (i, j) with i < j of the boxes which are compared and their overlaps.
+
+        Two separate boxes can not be linked when the threshold is at least their overlap,
+        which is 0 for iou and at most 0.5 for giou, so only the boxes whose extents
+        intersect are compared unless dense. The empty boxes are all compared since their
+        iou is nan.
+        """
+
+        iou_mode = self.config["MATCHING"]["iou_mode"]
+        threshold = self.config["MATCHING"]["threshold"]
+        if not dense and (
+            (iou_mode == "iou" and threshold >= 0)
+            or (iou_mode == "giou" and threshold >= 0.5)
+        ):
+            left, right = overlapping_pairs(flat_bboxes)
+            empty = np.flatnonzero(flat_bboxes[:, 2] * flat_bboxes[:, 3] == 0)
+            if len(empty) > 1:
+                n = len(flat_bboxes)
+                empty_left, empty_right = np.triu_indices(len(empty), 1)
+                pairs = np.unique(
+                    np.concatenate(
+                        [left * n + right, empty[empty_left] * n + empty[empty_right]]
+                    )
+                )
+                left = pairs // n
+                right = pairs % n
+            scores = proper_pair_overlap(flat_bboxes[left], flat_bboxes[right], iou_mode)
+            return left, right, scores
+
+        overlaps = proper_overlap(flat_bboxes, flat_bboxes, iou_mode)
+        left, right = np.triu_indices(len(flat_bboxes), 1)
+        return left, right, overlaps[left, right]
+
+    def can_link(self, flat_experts, left, right, scores):
+        """
+        Return the pairs of box_pairs which can be in a cluster and their overlaps
+        """
+
+        # the boxes from an expert can not be in a cluster,
+        # and when the score is lower than the threshold, the boxes can not be connected
+        valid = (flat_experts[left] != flat_experts[right]) & ~(
+            scores <= self.config["MATCHING"]["threshold"]
+        )
+        return left[valid], right[valid], scores[valid]
+
+    def kmeans_match(self, experts_w, selected_expert, results, candidates=None):
+        flat_experts, flat_bboxes, flatid2originid = self.flatten_results(
+            results, candidates
+        )
 
         if len(flat_bboxes) == 0:
             return []
 
-        # make can not link
-        min_k = 0
-        cl = [[] for i in range(len(flat_bboxes))]
-        for i in range(len(flat_bboxes)):
-            expert_idx = flatid2originid[i][0]
+        # only the pairs which can be linked are kept, every other pair is cannot-linked
+        left, right, scores = self.box_pairs(flat_bboxes)
+        link_left, link_right, link_scores = self.can_link(flat_experts, left, right, scores)
+        n_boxes = len(flat_bboxes)
+        can_link = sparse_pairs(
+            coo_matrix(
+                (
+                    np.ones(2 * len(link_left), dtype=bool),
+                    (
+                        np.concatenate([link_left, link_right]),
+                        np.concatenate([link_right, link_left]),
+                    ),
+                ),
+                shape=(n_boxes, n_boxes),
+            )
+        )
 
-            # the boxes from an expert can not be in a cluster
-            cl[i] += originid2flatid[expert_idx]
+        # get the maximum number of elements
+        min_k = np.bincount(flat_experts).max()
 
-            # get the maximum number of elements
-            if len(originid2flatid[expert_idx]) > min_k:
-                min_k = len(originid2flatid[expert_idx])
+        # make must link
+        ml = csr_matrix((n_boxes, n_boxes), dtype=bool)
 
-            scores = proper_overlap(
-                flat_bboxes[i],
-                flat_bboxes[i + 1 :],
-                self.config["MATCHING"]["iou_mode"],
-            )
+        # the distances to the medoids are computed once for every k,
+        # and the ones of the boxes of a cluster are the ones of their links
+        link_dists = (1 - link_scores).tolist()
+        known = dict(zip(zip(link_left.tolist(), link_right.tolist()), link_dists))
+        known.update(zip(zip(link_right.tolist(), link_left.tolist()), link_dists))
+        dists = DistanceColumns(flat_bboxes, self.overlap_fn, known)
 
-            # when the score is lower than the threshold, the boxes can not be connected
-            for j, score in enumerate(scores):
-                if score <= self.config["MATCHING"]["threshold"]:
-                    cl[i].append(i + 1 + j)
-                    cl[i + 1 + j].append(i)
+        # the fits under the size of a clique of the cannot-link graph are infeasible
+        groups = [np.flatnonzero(flat_experts == e_i) for e_i in np.unique(flat_experts)]
+        lower_bound = max(min_k, clique_bound(can_link, groups))
 
-        # make must link
-        ml = [[] for i in range(len(flat_bboxes))]
+        # cluster boxes
+        with self.timer.measure("matcher.cop_kmeans"):
+            k_search = self.config["MATCHING"]["k_search"]
+            if k_search == "linear":
+                kmeans, n_fits = self.linear_search(
+                    flat_bboxes, dists, ml, can_link, min_k, lower_bound
+                )
+            elif k_search == "gallop":
+                kmeans, n_fits = self.gallop_search(
+                    flat_bboxes, dists, ml, can_link, lower_bound
+                )
+            else:
+                raise NameError("Please enter a valid k search")
+        self.fit_counts.append((kmeans.k - min_k + 1, n_fits))
+
+        self.match_clusters(experts_w, kmeans.clusters, flatid2originid)
+
+        # assign id
+        curr_expert_bboxes = self.default_match(selected_expert, results)
+
+        return curr_expert_bboxes
+
+    def graph_match(self, experts_w, selected_expert, results, candidates=None):
+        """
+        Cluster the boxes by partitioning each connected component of the graph of the
+        boxes which can be linked, instead of fitting COP-KMeans for each k
+        """
+
+        flat_experts, flat_bboxes, flatid2originid = self.flatten_results(
+            results, candidates
+        )
+
+        if len(flat_bboxes) == 0:
+            return []
+
+        # the graph is kept as the list of the pairs which can be linked
+        left, right, scores = self.box_pairs(flat_bboxes)
+        left, right, scores = self.can_link(flat_experts, left, right, scores)
+        links = coo_matrix(
+            (np.ones(len(left)), (left, right)),
+            shape=(len(flat_bboxes), len(flat_bboxes)),
+        )
 
         # cluster boxes
-        for k in range(min_k, len(flat_bboxes) + 1):
-            kmeans = COP_KMeans(k, ml, cl, self.overlap_fn)
-            fit_result = kmeans.fit(flat_bboxes)
-            if fit_result == 1:
-                break
+        clusters = {}
+        with self.timer.measure("matcher.partition"):
+            n_components, labels = connected_components(links, directed=False)
+
+            # the boxes and the links of each component are contiguous in these orders
+            node_order = np.argsort(labels, kind="stable")
+            node_bounds = np.searchsorted(
+                labels[node_order], np.arange(n_components + 1)
+            )
+            link_order = np.argsort(labels[left], kind="stable")
+            link_bounds = np.searchsorted(
+                labels[left][link_order], np.arange(n_components + 1)
+            )
+
+            position = np.zeros(len(flat_bboxes), dtype=np.int64)
+            for component in range(n_components):
+                nodes = node_order[node_bounds[component] : node_bounds[component + 1]]
+                if len(nodes) == 1:
+                    clusters[len(clusters)] = nodes.tolist()
+                    continue
+
+                # the links of the component between its own boxes
+                position[nodes] = np.arange(len(nodes))
+                idxs = link_order[link_bounds[component] : link_bounds[component + 1]]
+                i = position[left[idxs]]
+                j = position[right[idxs]]
+                can_link = np.zeros((len(nodes), len(nodes)), dtype=bool)
+                can_link[i, j] = True
+                can_link[j, i] = True
+                overlaps = np.zeros((len(nodes), len(nodes)))
+                overlaps[i, j] = scores[idxs]
+                overlaps[j, i] = scores[idxs]
+
+                local_nodes = list(range(len(nodes)))
+                if len(nodes) <= EXACT_PARTITION_SIZE:
+                    partition = exact_partition(can_link, overlaps, local_nodes)
+                else:
+                    partition = greedy_partition(can_link, overlaps, local_nodes)
+
+                for cluster in partition:
+                    clusters[len(clusters)] = nodes[cluster].tolist()
+
+        self.match_clusters(experts_w, clusters, flatid2originid)
+
+        # assign id
+        curr_expert_bboxes = self.default_match(selected_expert, results)
+
+        return curr_expert_bboxes
+
+    def match_clusters(self, experts_w, clusters, flatid2originid):
+        """
+        Give each cluster the id voted by its boxes, or a new id
+        """
 
         target_ids = set()
         scores = {}
-        cluster_idxs = sorted(kmeans.clusters.keys())
+        cluster_idxs = sorted(clusters.keys())
         for cluster_idx in cluster_idxs:
             candidates = {-1: 0}
-            flat_ids = kmeans.clusters[cluster_idx]
+            flat_ids = clusters[cluster_idx]
             for flat_id in flat_ids:
                 expert_idx, box_id = flatid2originid[flat_id]
                 candidate = self.id_table[expert_idx].get(box_id, -1)
@@ -355,25 +893,29 @@ class IDMatcher:
             scores[cluster_idx] = candidates
         target_ids = list(target_ids)
 
-        def bullet_dist(left_id, right_ids):
-            dists = np.ones((len(right_ids))) * np.inf
-            total = sum(scores[left_id].values())
-            for i in range(len(right_ids)):
-                right_id = right_ids[i]
-                if right_id in scores[left_id].keys():
-                    if total > 0:
-                        score = scores[left_id][right_id] / total
-                        dists[i] = 1 - score
-                    else:
-                        dists[i] = 0
+        def bullet_dist(left_ids, right_ids):
+            dists = np.ones((len(left_ids), len(right_ids))) * np.inf
+            for i, left_id in enumerate(left_ids):
+                total = sum(scores[left_id].values())
+                for j in range(len(right_ids)):
+                    right_id = right_ids[j]
+                    if right_id in scores[left_id].keys():
+                        if total > 0:
+                            score = scores[left_id][right_id] / total
+                            dists[i, j] = 1 - score
+                        else:
+                            dists[i, j] = 0
             return dists
 
         # find best matching
-        matched_id = hungarian_matching(cluster_idxs, target_ids, np.inf, bullet_dist)
+        with self.timer.measure("matcher.hungarian"):
+            matched_id = self.matching_fn(
+                cluster_idxs, target_ids, np.inf, bullet_dist
+            )
 
         # match the cluster id to id pool
         for cluster_idx, target_id in matched_id:
-            flat_ids = kmeans.clusters[cluster_idx]
+            flat_ids = clusters[cluster_idx]
 
             if target_id == -1:
                 cluster_id = self.last_id
@@ -384,8 +926,3 @@ class IDMatcher:
             for flat_id in flat_ids:
                 expert_idx, box_id = flatid2originid[flat_id]
                 self.id_table[expert_idx][box_id] = cluster_id
-
-        # assign id
-        curr_expert_bboxes = self.default_match(selected_expert, results)
-
-        return curr_expert_bboxes
@@ -0,0 +1,148 @@
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from time_manager import StageTimer
+from algorithms.clear_mot import FrameMemo, PreparedFeedback
+
+
+def _ready(_):
+    return True
+
+
+def _evaluate(task):
+    prepared, expert_results, feedback_max, memo, offset = task
+    loss = prepared.frame_loss(expert_results, range(1, feedback_max + 1), memo, offset)
+    # the memo of the worker is a copy which replaces the one of the evaluator
+    return loss, memo
+
+
+class LossEvaluator:
+    """
+    Evaluates the frame losses of experts against a feedback, which is prepared
+    once for all the experts.
+
+    With n_workers > 0, the experts are evaluated concurrently by a pool of worker
+    processes which is started by the first initialize and kept for the following
+    sequences, and which is shared by the evaluators returned by share until close.
+    The losses are always returned in the order of the given experts.
+
+    With memo, the frames of the overlapping windows which are matched in the same
+    way as before take the counts of the FrameMemo of their expert, and the memos
+    are shared with the evaluators returned by share.
+    """
+
+    def __init__(self, n_workers=0, timer=None, memo=False):
+        self.n_workers = n_workers
+        self.timer = StageTimer() if timer is None else timer
+        self.executor = None
+        self.memo = memo
+
+        # (sequence name, expert) -> FrameMemo
+        self.memos = {}
+        self.seq_name = None
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def share(self, timer=None):
+        """
+        Return an evaluator for another session which uses the same pool
+        """
+
+        self._start()
+        evaluator = copy.copy(self)
+        evaluator.timer = StageTimer() if timer is None else timer
+        return evaluator
+
+    def initialize(self, seq_info):
+        self._start()
+
+        # the memos of the previous sequence of this session are not used anymore
+        seq_name = None if seq_info is None else seq_info["seq_name"]
+        if self.seq_name is not None and self.seq_name != seq_name:
+            self.evict(self.seq_name)
+        self.seq_name = seq_name
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def evict(self, seq_name, frame=None):
+        """
+        Drop the memos of the frames of a sequence before frame, or all of them
+        """
+
+        for key in [key for key in self.memos if key[0] == seq_name]:
+            if frame is not None:
+                self.memos[key].evict(frame)
+            if frame is None or len(self.memos[key].frames) == 0:
+                del self.memos[key]
+
+    def stats(self):
+        return {"hits": self.n_hits, "misses": self.n_misses}
+
+    def _start(self):
+        if self.n_workers > 0 and self.executor is None:
+            # spawn so that workers do not inherit the threads and CUDA context of the tracker
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+            # start every worker now rather than at the first anchor
+            list(self.executor.map(_ready, range(self.n_workers)))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def evaluate(self, feedback, experts_results, feedback_max, experts=None, offset=0):
+        """
+        feedback and experts_results should be rows of [frame, id, x, y, w, h]
+        experts are the indices of the experts for their memos, and offset is the frame
+        of the sequence before the first frame of the window
+        Return [frame losses of (fp, fn, ids)] of each expert
+        """
+
+        # the offline feedback has no distractor, so nothing is ignored
+        with self.timer.measure("loss.prepare"):
+            prepared = PreparedFeedback(feedback)
+
+        if self.memo and experts is not None:
+            keys = [(self.seq_name, expert) for expert in experts]
+            memos = [self.memos.setdefault(key, FrameMemo()) for key in keys]
+        else:
+            keys = None
+            memos = [None] * len(experts_results)
+        counts = self._counts(memos)
+
+        if self.executor is None:
+            losses = []
+            for expert_results, memo in zip(experts_results, memos):
+                with self.timer.measure("loss.frame_loss"):
+                    losses.append(
+                        prepared.frame_loss(
+                            expert_results, range(1, feedback_max + 1), memo, offset
+                        )
+                    )
+        else:
+            tasks = [
+                (prepared, expert_results, feedback_max, memo, offset)
+                for expert_results, memo in zip(experts_results, memos)
+            ]
+            losses, memos = zip(*self.executor.map(_evaluate, tasks))
+            losses = list(losses)
+            if keys is not None:
+                self.memos.update(zip(keys, memos))
+
+        n_hits, n_misses = self._counts(memos)
+        self.n_hits += n_hits - counts[0]
+        self.n_misses += n_misses - counts[1]
+        return losses
+
+    @staticmethod
+    def _counts(memos):
+        memos = [memo for memo in memos if memo is not None]
+        return (
+            sum(memo.n_hits for memo in memos),
+            sum(memo.n_misses for memo in memos),
+        )
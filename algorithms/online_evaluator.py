@@ -0,0 +1,150 @@
+from collections import Counter
+
+import numpy as np
+from motmetrics.distances import iou_matrix
+from motmetrics.lap import linear_sum_assignment
+
+from algorithms.clear_mot import drop_distractors, match_frame
+
+# the classes of MOT16 which are removed with the hypotheses matched to them
+DISTRACTOR_CLASSES = [2, 7, 8, 12]
+
+
+class OnlineEvaluator:
+    """
+    MOT metrics of a tracker updated frame by frame as motmetrics computes them
+    over the whole sequence in eval_tracker (compare_to_groundtruth for MOT15, and
+    CLEAR_MOT_M for MOT16, MOT17 and MOT20).
+
+    FP, FN and IDSW are counted in each frame. IDF1 needs the global assignment of
+    the ids, so only the counts of the ids and the matchable pairs are kept in each
+    frame and the assignment is solved when the summary is asked.
+    """
+
+    def __init__(self, dataset_name, distth=0.5):
+        if dataset_name == "MOT15":
+            self.use_distractors = False
+        elif dataset_name in ["MOT16", "MOT17", "MOT20"]:
+            self.use_distractors = True
+        else:
+            raise NameError("Invalid dataset")
+        self.distth = distth
+
+    def initialize(self):
+        self.m = {}
+        self.n_frames = 0
+        self.num_objects = 0
+        self.num_predictions = 0
+        self.fp = 0
+        self.fn = 0
+        self.ids = 0
+
+        # frames of each object and hypothesis, and frames in which a pair can be matched
+        self.object_counts = Counter()
+        self.hypothesis_counts = Counter()
+        self.pair_counts = Counter()
+
+    def state_dict(self):
+        return {key: value for key, value in vars(self).items()}
+
+    def load_state_dict(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    def update(self, gts, results):
+        """
+        gts should be rows of the gt file of the frame or None,
+        and results should be rows of [id, x, y, w, h]
+        """
+
+        self.n_frames += 1
+
+        gts = np.empty((0, 9)) if gts is None else np.asarray(gts, dtype=np.float64)
+        results = np.asarray(results, dtype=np.float64).reshape(-1, 5)
+        oids = gts[:, 1]
+        obj_boxes = gts[:, 2:6]
+        hids = results[:, 0]
+        boxes = results[:, 1:5]
+
+        if self.use_distractors:
+            ignore = np.isin(gts[:, 7], DISTRACTOR_CLASSES) | (gts[:, 8] < 0)
+            keep = drop_distractors(obj_boxes, ignore, hids, boxes)
+            hids = hids[keep]
+            boxes = boxes[keep]
+            valid = (gts[:, 6] >= 0.99) & (gts[:, 7] == 1)
+        else:
+            valid = gts[:, 6] >= 1
+        oids = oids[valid]
+        obj_boxes = obj_boxes[valid]
+
+        self.num_objects += len(oids)
+        self.num_predictions += len(hids)
+        self.object_counts.update(np.unique(oids).tolist())
+        self.hypothesis_counts.update(np.unique(hids).tolist())
+
+        dists = None
+        if len(oids) > 0 and len(hids) > 0:
+            dists = iou_matrix(obj_boxes, boxes, max_iou=self.distth)
+            for i, j in zip(*np.nonzero(np.isfinite(dists))):
+                self.pair_counts[(oids[i], hids[j])] += 1
+
+        fp, fn, ids = match_frame(self.m, oids, hids, dists)
+        self.fp += fp
+        self.fn += fn
+        self.ids += ids
+
+    def idtp(self):
+        # same global min-cost assignment as id_global_assignment of motmetrics
+        oids = sorted(self.object_counts.keys())
+        hids = sorted(self.hypothesis_counts.keys())
+        oids_idx = {o: i for i, o in enumerate(oids)}
+        hids_idx = {h: i for i, h in enumerate(hids)}
+        no = len(oids)
+        nh = len(hids)
+        if no == 0 or nh == 0:
+            return 0
+
+        fpmatrix = np.zeros((no + nh, no + nh))
+        fnmatrix = np.zeros((no + nh, no + nh))
+        fpmatrix[no:, :nh] = np.nan
+        fnmatrix[:no, nh:] = np.nan
+
+        for oid, count in self.object_counts.items():
+            r = oids_idx[oid]
+            fnmatrix[r, :nh] = count
+            fnmatrix[r, nh + r] = count
+
+        for hid, count in self.hypothesis_counts.items():
+            c = hids_idx[hid]
+            fpmatrix[:no, c] = count
+            fpmatrix[c + no, c] = count
+
+        for (oid, hid), count in self.pair_counts.items():
+            r = oids_idx[oid]
+            c = hids_idx[hid]
+            fpmatrix[r, c] -= count
+            fnmatrix[r, c] -= count
+
+        rids, cids = linear_sum_assignment(fpmatrix + fnmatrix)
+        return self.num_objects - fnmatrix[rids, cids].sum()
+
+    def summary(self, with_idf1=True):
+        """
+        Return the running metrics, where IDF1 is solved only if with_idf1
+        """
+
+        summary = {
+            "frames": self.n_frames,
+            "num_objects": self.num_objects,
+            "num_predictions": self.num_predictions,
+            "num_false_positives": self.fp,
+            "num_misses": self.fn,
+            "num_switches": self.ids,
+            "mota": 1.0 - (self.fp + self.fn + self.ids) / self.num_objects
+            if self.num_objects > 0
+            else float("nan"),
+        }
+        if with_idf1:
+            n = self.num_objects + self.num_predictions
+            summary["idf1"] = 2 * float(self.idtp()) / n if n > 0 else float("nan")
+        return summary
@@ -0,0 +1,75 @@
+import sys
+
+import numpy as np
+
+import scipy.special as sc
+
+
+class WAADelayed:
+    def __init__(self):
+        pass
+
+    def initialize(self, n):
+        self.w = np.ones(n) / n
+        self.est_D = 1
+
+    def state_dict(self):
+        return {"w": self.w, "est_D": self.est_D}
+
+    def load_state_dict(self, state):
+        self.w = state["w"]
+        self.est_D = state["est_D"]
+
+    """
+    gradient_losses should be n
+    """
+
+    def update(self, gradient_losses, total_delayed):
+        # check the number of element
+        assert len(gradient_losses) == len(self.w)
+
+        while self.est_D < total_delayed:
+            self.est_D *= 2
+
+        lr = np.sqrt(self.est_D * np.log(len(self.w)))
+
+        changes = lr * gradient_losses
+        temp = np.log(self.w + sys.float_info.min) - changes
+        self.w = np.exp(temp - sc.logsumexp(temp))
+
+
+class MultiWAADelayed:
+    """
+    WAADelayed learners of several configurations kept as one weight matrix
+    """
+
+    def __init__(self):
+        pass
+
+    def initialize(self, n_configs, n):
+        self.w = np.ones((n_configs, n)) / n
+        self.est_D = np.ones(n_configs)
+
+    def state_dict(self):
+        return {"w": self.w, "est_D": self.est_D}
+
+    def load_state_dict(self, state):
+        self.w = state["w"]
+        self.est_D = state["est_D"]
+
+    """
+    gradient_losses should be n_configs x n, and total_delayed should be n_configs
+    """
+
+    def update(self, gradient_losses, total_delayed):
+        # check the number of element
+        assert gradient_losses.shape == self.w.shape
+
+        while (self.est_D < total_delayed).any():
+            self.est_D = np.where(self.est_D < total_delayed, self.est_D * 2, self.est_D)
+
+        lr = np.sqrt(self.est_D * np.log(self.w.shape[1]))
+
+        changes = lr[:, None] * gradient_losses
+        temp = np.log(self.w + sys.float_info.min) - changes
+        self.w = np.exp(temp - sc.logsumexp(temp, axis=1, keepdims=True))
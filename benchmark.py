@@ -0,0 +1,382 @@
+import copy
+import time
+import yaml
+
+import numpy as np
+
+from datasets.mot import MOT
+from algorithms.aaa import complete_config
+from algorithms.aaa_manager import AAAManager
+from algorithms.aaa_util import (
+    overlap_ratio,
+    goverlap_ratio,
+    overlap_matrix,
+    goverlap_matrix,
+)
+from algorithms.id_matcher import (
+    IDMatcher,
+    hungarian_matching,
+    assignment_matching,
+    overlap_distance,
+)
+from file_manager import ReadResult
+from track_algorithm import track_seq, get_algorithm
+
+
+def latency_summary(times):
+    times = np.array(times) * 1000
+    return (
+        f"mean {times.mean():.1f}ms, p50 {np.percentile(times, 50):.1f}ms, "
+        f"p95 {np.percentile(times, 95):.1f}ms, max {times.max():.1f}ms"
+    )
+
+
+def feedback_latency(config, dataset_name, seq_idx):
+    """
+    Compare the per-frame latency of the synchronous and asynchronous feedback
+    """
+
+    for enabled in [False, True]:
+        run_config = copy.deepcopy(config)
+        run_config["ASYNC_FEEDBACK"]["enabled"] = enabled
+
+        # the sequence reader can only be iterated once
+        seq = MOT(config["DATASET_DIR"][dataset_name])[seq_idx]
+        algorithm = get_algorithm(run_config)
+        *_, times = track_seq(
+            config["OUTPUT_DIR"], config["EXPERTS"], algorithm, seq
+        )
+
+        mode = "async" if enabled else "sync"
+        print(f"[{mode}] {seq.seq_info['seq_name']}: {latency_summary(times)}")
+
+
+def expert_scaling(config, dataset_name, seq_idx):
+    """
+    Measure the per-frame time of pools made by repeating the configured experts
+    """
+
+    for n_experts in [10, 50, 200]:
+        run_config = copy.deepcopy(config)
+        run_config["EXPERTS"] = [
+            config["EXPERTS"][i % len(config["EXPERTS"])] for i in range(n_experts)
+        ]
+
+        seq = MOT(config["DATASET_DIR"][dataset_name])[seq_idx]
+        algorithm = get_algorithm(run_config)
+        *_, times = track_seq(
+            config["OUTPUT_DIR"], run_config["EXPERTS"], algorithm, seq
+        )
+        print(
+            f"[{n_experts} experts] {seq.seq_info['seq_name']}: {latency_summary(times)}"
+        )
+
+
+def loss_workers(config, dataset_name, seq_idx):
+    """
+    Compare the loss evaluation time of anchor frames with different numbers of workers
+    """
+
+    for n_workers in [0, 1, 2, 4, 8]:
+        run_config = copy.deepcopy(config)
+        run_config["LOSS_EVAL"]["workers"] = n_workers
+
+        seq = MOT(config["DATASET_DIR"][dataset_name])[seq_idx]
+        algorithm = get_algorithm(run_config)
+        track_seq(config["OUTPUT_DIR"], config["EXPERTS"], algorithm, seq)
+        algorithm.close()
+
+        stats = algorithm.timer.report()["stages"].get("loss.evaluate")
+        if stats is None:
+            print(f"[{n_workers} workers] {seq.seq_info['seq_name']}: no anchor")
+        else:
+            print(
+                f"[{n_workers} workers] {seq.seq_info['seq_name']}: {stats['count']} anchors, "
+                f"mean {stats['mean'] * 1000:.1f}ms, max {stats['max'] * 1000:.1f}ms"
+            )
+
+
+def regret(ws, expert_losses):
+    """
+    Cumulative loss of the learner minus the one of the best expert in hindsight
+    """
+
+    # the weights before an update are the ones of the previous frame
+    n_experts = ws.shape[1] - 1
+    weights = {int(row[0]): row[1:] for row in ws}
+    learner_loss = 0.0
+    for row in expert_losses:
+        w = weights.get(int(row[0]) - 1, np.ones(n_experts) / n_experts)
+        learner_loss += w @ row[1:]
+    return learner_loss - expert_losses[:, 1:].sum(axis=0).min()
+
+
+def pruning_impact(config, dataset_name, seq_idx):
+    """
+    Compare the number of loss evaluations and the regret with and without pruning
+    """
+
+    for enabled in [False, True]:
+        run_config = copy.deepcopy(config)
+        run_config["PRUNING"]["enabled"] = enabled
+
+        seq = MOT(config["DATASET_DIR"][dataset_name])[seq_idx]
+        algorithm = get_algorithm(run_config)
+        _, ws, expert_losses, *_ = track_seq(
+            config["OUTPUT_DIR"], config["EXPERTS"], algorithm, seq
+        )
+
+        report = algorithm.evaluation_report()
+        mode = "pruning" if enabled else "full"
+        print(
+            f"[{mode}] {seq.seq_info['seq_name']}: {report['evaluated']} evaluations, "
+            f"{report['skipped']} skipped, regret {regret(ws, expert_losses):.3f}"
+        )
+
+
+def link_index(config, n_experts=6, repeat=5):
+    """
+    Compare the construction of the pairs of boxes which can be linked with and
+    without the spatial index on synthetic crowds seen by several experts, and time
+    the kmeans matching of the crowds, for the iou and the giou overlaps
+    """
+
+    for iou_mode in ["iou", "giou"]:
+        run_config = copy.deepcopy(config)
+        run_config["MATCHING"]["iou_mode"] = iou_mode
+        matcher = IDMatcher(run_config)
+        matcher.initialize(n_experts)
+        rng = np.random.RandomState(0)
+        for n_objects in [50, 200, 500]:
+            objects = np.c_[
+                rng.rand(n_objects, 2) * [1920, 1080], rng.rand(n_objects, 2) * 60 + 30
+            ]
+            flat_experts = np.repeat(np.arange(n_experts), n_objects)
+            flat_bboxes = np.concatenate(
+                [objects + rng.randn(n_objects, 4) * 3 for _ in range(n_experts)]
+            )
+
+            links = {}
+            for dense in [True, False]:
+                times = []
+                for _ in range(repeat):
+                    start_time = time.perf_counter()
+                    left, right, scores = matcher.box_pairs(flat_bboxes, dense)
+                    links[dense] = matcher.can_link(flat_experts, left, right, scores)
+                    times.append(time.perf_counter() - start_time)
+
+                mode = "dense" if dense else "index"
+                print(
+                    f"[{iou_mode} {mode}] {len(flat_bboxes)} boxes: {len(left)} pairs "
+                    f"compared, {len(links[dense][0])} links, {latency_summary(times)}"
+                )
+
+            if not all(np.array_equal(x, y) for x, y in zip(links[True], links[False])):
+                raise ValueError("The spatial index found different links")
+
+            # the results of each expert are rows of [id, x, y, w, h]
+            results = [
+                np.c_[np.arange(n_objects), flat_bboxes[flat_experts == e_i]]
+                for e_i in range(n_experts)
+            ]
+            experts_w = np.ones(n_experts) / n_experts
+            times = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                matcher.kmeans_match(experts_w, 0, results)
+                times.append(time.perf_counter() - start_time)
+            print(
+                f"[{iou_mode} kmeans] {len(flat_bboxes)} boxes: {latency_summary(times)}"
+            )
+
+
+def k_search(config, dataset_name, seq_idx):
+    """
+    Compare the fits of the kmeans matching per frame with and without the pruning
+    of the k search, for the linear and the galloping search
+    """
+
+    for search in ["linear", "gallop"]:
+        run_config = copy.deepcopy(config)
+        run_config["MATCHING"]["method"] = "kmeans"
+        run_config["MATCHING"]["k_search"] = search
+
+        seq = MOT(config["DATASET_DIR"][dataset_name])[seq_idx]
+        algorithm = get_algorithm(run_config)
+        track_seq(config["OUTPUT_DIR"], config["EXPERTS"], algorithm, seq)
+
+        fit_counts = np.array(algorithm.matcher.fit_counts)
+        stats = algorithm.timer.report()["stages"]["matcher.cop_kmeans"]
+        print(
+            f"[{search}] {seq.seq_info['seq_name']}: {len(fit_counts)} frames, "
+            f"fits per frame {fit_counts[:, 0].mean():.1f} before (max {fit_counts[:, 0].max()}), "
+            f"{fit_counts[:, 1].mean():.1f} after (max {fit_counts[:, 1].max()}), "
+            f"mean {stats['mean'] * 1000:.1f}ms, max {stats['max'] * 1000:.1f}ms"
+        )
+
+
+def stream_frames(config, seq):
+    experts_reader = [
+        ReadResult(
+            config["OUTPUT_DIR"],
+            seq.seq_info["dataset_name"],
+            expert_name,
+            seq.seq_info["seq_name"],
+        )
+        for expert_name in config["EXPERTS"]
+    ]
+    for frame_idx, (img_path, dets, gts) in enumerate(seq):
+        expert_results = [
+            reader.get_result_by_frame(frame_idx) for reader in experts_reader
+        ]
+        yield img_path, dets, gts, expert_results
+
+
+def stream_throughput(config, dataset_name):
+    """
+    Run every sequence of the dataset as a concurrent stream of one manager
+    """
+
+    manager = AAAManager(config)
+    streams = {}
+    for seq in MOT(config["DATASET_DIR"][dataset_name]):
+        manager.add_stream(seq.seq_info["seq_name"], seq.seq_info)
+        streams[seq.seq_info["seq_name"]] = stream_frames(config, seq)
+
+    for _ in manager.run(streams):
+        pass
+
+    report = manager.report()
+    for seq_name, stats in report["streams"].items():
+        print(
+            f"[{seq_name}] {stats['frames']} frames, mean {stats['mean'] * 1000:.1f}ms, "
+            f"p95 {stats['p95'] * 1000:.1f}ms, max {stats['max'] * 1000:.1f}ms"
+        )
+    print(
+        f"[total] {len(report['streams'])} streams, {report['frames']} frames "
+        f"in {report['time']:.1f}s, {report['fps']:.1f} fps"
+    )
+
+
+def matching_solvers(config, dataset_name, seq_idx):
+    """
+    Compare the solvers of the matching on the boxes of every pair of experts in each
+    frame, which are the matchings of the anchor method when the selection changes
+    """
+
+    seq = MOT(config["DATASET_DIR"][dataset_name])[seq_idx]
+    overlap_fn = overlap_distance(config["MATCHING"]["iou_mode"])
+    threshold = config["MATCHING"]["threshold"]
+
+    times = {"flow": [], "assignment": []}
+    n_boxes = []
+    n_same = 0
+    for _, _, _, expert_results in stream_frames(config, seq):
+        for prev_results, curr_results in zip(expert_results, expert_results[1:]):
+            if len(prev_results) == 0 or len(curr_results) == 0:
+                continue
+            n_boxes.append(len(prev_results) + len(curr_results))
+            matchings = {}
+            for solver, matching_fn in [
+                ("flow", hungarian_matching),
+                ("assignment", assignment_matching),
+            ]:
+                start_time = time.perf_counter()
+                matchings[solver] = matching_fn(
+                    prev_results, curr_results, threshold, overlap_fn
+                )
+                times[solver].append(time.perf_counter() - start_time)
+
+            # the solvers can break the ties of the costs differently
+            if len(matchings["flow"]) != len(matchings["assignment"]):
+                raise ValueError("The solvers found matchings of different sizes")
+            n_same += matchings["flow"] == matchings["assignment"]
+
+    print(
+        f"[{seq.seq_info['seq_name']}] {len(n_boxes)} matchings, "
+        f"mean {np.mean(n_boxes):.0f} boxes, max {np.max(n_boxes)} boxes, "
+        f"{n_same} identical"
+    )
+    for solver, solver_times in times.items():
+        print(f"[{solver}] {latency_summary(solver_times)}")
+
+
+def overlap_kernels(n_boxes=300, repeat=20):
+    """
+    Compare the overlap of every pair of boxes computed box by box and as a matrix
+    """
+
+    rng = np.random.RandomState(0)
+    rects1 = np.c_[rng.rand(n_boxes, 2) * 1800, rng.rand(n_boxes, 2) * 100 + 10]
+    rects2 = np.c_[rng.rand(n_boxes, 2) * 1800, rng.rand(n_boxes, 2) * 100 + 10]
+
+    for mode, ratio_fn, matrix_fn in [
+        ("iou", overlap_ratio, overlap_matrix),
+        ("giou", goverlap_ratio, goverlap_matrix),
+    ]:
+        kernels = [
+            ("loop", lambda: [ratio_fn(rect.copy(), rects2.copy()) for rect in rects1]),
+            ("float64", lambda: matrix_fn(rects1, rects2)),
+            ("float32", lambda: matrix_fn(rects1, rects2, dtype=np.float32)),
+        ]
+        for name, kernel in kernels:
+            times = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                kernel()
+                times.append(time.perf_counter() - start_time)
+            print(f"[{mode} {name}] {n_boxes}x{n_boxes}: {latency_summary(times)}")
+
+
+def main(config_path, benchmark, dataset_name, seq_idx):
+    with open(config_path) as c:
+        config = complete_config(yaml.load(c, Loader=yaml.FullLoader))
+
+    if benchmark == "feedback":
+        feedback_latency(config, dataset_name, seq_idx)
+    elif benchmark == "streams":
+        stream_throughput(config, dataset_name)
+    elif benchmark == "pruning":
+        pruning_impact(config, dataset_name, seq_idx)
+    elif benchmark == "scaling":
+        expert_scaling(config, dataset_name, seq_idx)
+    elif benchmark == "workers":
+        loss_workers(config, dataset_name, seq_idx)
+    elif benchmark == "matching":
+        matching_solvers(config, dataset_name, seq_idx)
+    elif benchmark == "overlap":
+        overlap_kernels()
+    elif benchmark == "kmeans":
+        k_search(config, dataset_name, seq_idx)
+    elif benchmark == "links":
+        link_index(config)
+    else:
+        raise ValueError("Invalid benchmark")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run benchmarks")
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        default="experiments/aaa.yaml",
+        help="The config file of the algorithm",
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        type=str,
+        default="feedback",
+        help="The benchmark to run (feedback, streams, pruning, scaling, workers, matching, overlap, kmeans or links)",
+    )
+    parser.add_argument(
+        "-d", "--dataset", type=str, default="MOT17", help="The dataset to use",
+    )
+    parser.add_argument(
+        "-s", "--seq", type=int, default=0, help="The index of the sequence to use",
+    )
+    args = parser.parse_args()
+    main(args.config, args.benchmark, args.dataset, args.seq)
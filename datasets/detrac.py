@@ -103,11 +103,14 @@ class DETRACDataReader:
         else:
             raise StopIteration()
 
-    def write_results(self, results, output_dir, filename=None):
+    def format_results(self, results):
         data = np.zeros((len(results), 10))
         data[:, :6] = results
         data[:, 6:] = -1
-        df = pd.DataFrame(data)
+        return data
+
+    def write_results(self, results, output_dir, filename=None):
+        df = pd.DataFrame(self.format_results(results))
 
         os.makedirs(output_dir, exist_ok=True)
         if filename is None:
@@ -0,0 +1,105 @@
+import copy
+
+from time_manager import StageTimer
+
+
+class CachedSolver:
+    """
+    Offline tracker shared by the sessions of a sweep over configurations.
+
+    Every sequence is preprocessed once by add_sequence, then the feedback of each
+    window is solved once and reused by every session which asks for the same
+    (start_frame, end_frame). The preprocessing does not depend on the configuration
+    and the preprocessors are online, so the boxes and embeddings of the frames of a
+    window are the same whether the rest of the sequence is preprocessed or not.
+
+    The sessions are expected to track a sequence in lockstep, so that a window is
+    only kept until evict is told that no session can ask for it anymore.
+    """
+
+    def __init__(self, solver, timer=None):
+        self.name = solver.name
+        self.solver = solver
+        self.timer = StageTimer() if timer is None else timer
+        self.crops = []
+
+        # shared by every session
+        self.sequences = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def share(self, timer=None):
+        """
+        Return a solver for another session which uses the same cache
+        """
+
+        solver = copy.copy(self)
+        solver.timer = StageTimer() if timer is None else timer
+        return solver
+
+    def add_sequence(self, seq_info, frames):
+        """
+        frames should be an iterable of (img_path, dets, gts, experts' results)
+        """
+
+        solver = self.solver.share(self.timer)
+        solver.initialize(seq_info)
+        for img_path, dets, gts, results in frames:
+            with self.timer.measure("offline.step"):
+                solver.step(img_path, dets, gts, results)
+
+        self.sequences[seq_info["seq_name"]] = {"solver": solver, "feedbacks": {}}
+
+    def remove_sequence(self, seq_info):
+        self.sequences.pop(seq_info["seq_name"])
+
+    def evict(self, seq_info, frame_idx):
+        """
+        Drop the feedbacks of the windows ending before frame_idx
+        """
+
+        feedbacks = self.sequences[seq_info["seq_name"]]["feedbacks"]
+        # an async session may add a window while the keys are listed
+        for key in list(feedbacks):
+            if key[1] < frame_idx:
+                feedbacks.pop(key, None)
+
+    def initialize(self, seq_info):
+        self.seq_info = seq_info
+        self.n_frames = 0
+
+    def state_dict(self):
+        return {"n_frames": self.n_frames}
+
+    def load_state_dict(self, state):
+        self.n_frames = state["n_frames"]
+
+    def track(self, start_frame, end_frame):
+        return self.solve(self.prepare(start_frame, end_frame))
+
+    def prepare(self, start_frame, end_frame):
+        return {
+            "seq_name": self.seq_info["seq_name"],
+            "start_frame": start_frame,
+            "end_frame": end_frame,
+        }
+
+    def solve(self, request):
+        sequence = self.sequences[request["seq_name"]]
+        key = (request["start_frame"], request["end_frame"])
+        if key in sequence["feedbacks"]:
+            self.stats["hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            solver = sequence["solver"]
+            with self.timer.measure("offline.solve"):
+                sequence["feedbacks"][key] = solver.solve(solver.prepare(*key))
+
+        # the sessions must not share a feedback which one of them could modify
+        return sequence["feedbacks"][key].copy()
+
+    def step(self, img_path, det, gt, pre_det=[], weights=[]):
+        self.preprocess(img_path, det, gt, pre_det, weights)
+
+    def preprocess(self, img_path, det, gt, pre_det=[], weights=[]):
+        # the frame is already preprocessed by add_sequence
+        self.n_frames += 1
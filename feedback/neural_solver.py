@@ -1,4 +1,6 @@
 import sys
+import copy
+import time
 import yaml
 from PIL import Image
 import numpy as np
@@ -11,6 +13,7 @@ from torchvision.transforms import Compose, Resize, ToTensor, Normalize
 
 from feedback.mot_graph_dataset import MOTGraphDataset
 from feedback.preprocessing import FRCNNPreprocessor
+from time_manager import StageTimer
 
 sys.path.append("external/mot_neural_solver/src")
 from mot_neural_solver.pl_module.pl_module import MOTNeuralSolver
@@ -166,9 +169,11 @@ class NeuralSolver:
         use_gt,
         pre_cnn,
         pre_track,
+        timer=None,
     ):
         self.name = "MPNTracker"
         self.use_gt = use_gt
+        self.timer = StageTimer() if timer is None else timer
 
         if not self.use_gt:
             with open(tracking_cfg_path) as config_file:
@@ -193,19 +198,15 @@ class NeuralSolver:
                 )
                 obj_detect.eval()
                 obj_detect.cuda()
+                self.obj_detect = obj_detect
 
                 if self.pre_track == "Tracktor":
                     self.prepr_params = tracktor_params
-                    make_deterministic(self.prepr_params["seed"])
-
-                    self.preprocessor = Tracker(
-                        obj_detect, None, self.prepr_params["tracker"]
-                    )
                 elif self.pre_track == "FRCNN":
                     self.prepr_params = frcnn_prepr_params
-                    make_deterministic(self.prepr_params["seed"])
+                make_deterministic(self.prepr_params["seed"])
 
-                    self.preprocessor = FRCNNPreprocessor(obj_detect, self.prepr_params)
+                self.preprocessor = self._build_preprocessor()
                 self.transforms = ToTensor()
 
             # Load model from checkpoint and update config entries that may vary from the ones used in training
@@ -234,10 +235,28 @@ class NeuralSolver:
                     )
                 )
 
+    def _build_preprocessor(self):
+        if self.pre_track == "Tracktor":
+            return Tracker(self.obj_detect, None, self.prepr_params["tracker"])
+        elif self.pre_track == "FRCNN":
+            return FRCNNPreprocessor(self.obj_detect, self.prepr_params)
+
+    def share(self, timer=None):
+        """
+        Return a solver for another sequence which uses the same networks
+        """
+
+        solver = copy.copy(self)
+        solver.timer = StageTimer() if timer is None else timer
+        if not self.use_gt and (self.pre_track == "Tracktor" or self.pre_track == "FRCNN"):
+            solver.preprocessor = self._build_preprocessor()
+        return solver
+
     def initialize(self, seq_info):
         self.seq_info = seq_info
         self.img_paths = []
         self.gts = []
+        self.crops = []
 
         if not self.use_gt:
             self.preprocessed = {}
@@ -256,7 +275,52 @@ class NeuralSolver:
                 self.node_embeds = {}
                 self.reid_embeds = {}
 
+    def state_dict(self):
+        state = {"seq_info": self.seq_info, "img_paths": self.img_paths, "gts": self.gts}
+
+        if not self.use_gt:
+            state["preprocessed"] = self.preprocessed
+
+            # the networks are shared and stay as they are
+            if self.pre_track == "Tracktor" or self.pre_track == "FRCNN":
+                state["preprocessor"] = {
+                    key: value
+                    for key, value in vars(self.preprocessor).items()
+                    if not isinstance(value, torch.nn.Module)
+                }
+
+            if self.pre_cnn:
+                state["node_embeds"] = self.node_embeds
+                state["reid_embeds"] = self.reid_embeds
+
+        return state
+
+    def load_state_dict(self, state):
+        self.seq_info.update(state["seq_info"])
+        self.img_paths = state["img_paths"]
+        self.gts = state["gts"]
+
+        if not self.use_gt:
+            self.preprocessed = state["preprocessed"]
+
+            if self.pre_track == "Tracktor" or self.pre_track == "FRCNN":
+                for key, value in state["preprocessor"].items():
+                    setattr(self.preprocessor, key, value)
+
+            if self.pre_cnn:
+                self.node_embeds = state["node_embeds"]
+                self.reid_embeds = state["reid_embeds"]
+
     def track(self, start_frame, end_frame):
+        return self.solve(self.prepare(start_frame, end_frame))
+
+    def prepare(self, start_frame, end_frame):
+        """
+        Take everything the feedback of the window needs from the current state,
+        so that solve can run while the following frames are being stepped.
+        """
+
+        request = {"start_frame": start_frame}
         if self.use_gt:
             feedback = []
             for frame in range(start_frame, end_frame + 1):
@@ -264,7 +328,7 @@ class NeuralSolver:
                     feedback.append(
                         [frame + 1 - start_frame, t[1], t[2], t[3], t[4], t[5]]
                     )
-            feedback = np.array(feedback)
+            request["feedback"] = np.array(feedback)
         else:
             rows = []
             for i, track in self.preprocessed.items():
@@ -290,30 +354,49 @@ class NeuralSolver:
                             -1,
                         ]
                     )
-            det_df = pd.DataFrame(np.array(rows))
+            request["det_df"] = pd.DataFrame(np.array(rows))
+            request["img_paths"] = list(self.img_paths)
 
+            # embeddings of past frames are never modified, so they can be shared
             if self.pre_cnn:
-                reid_embeds = self.reid_embeds
-                node_embeds = self.node_embeds
+                request["reid_embeds"] = self.reid_embeds
+                request["node_embeds"] = self.node_embeds
             else:
-                reid_embeds = None
-                node_embeds = None
-            dataset = MOTGraphDataset(
-                self.model.hparams["dataset_params"],
-                self.img_paths,
-                det_df,
-                self.seq_info,
-                cnn_model=self.model.cnn_model,
-                reid_embeddings=reid_embeds,
-                node_feats=node_embeds,
-                start_frame=start_frame,
-            )
+                request["reid_embeds"] = None
+                request["node_embeds"] = None
+
+        return request
+
+    def solve(self, request):
+        if self.use_gt:
+            return request["feedback"]
+
+        dataset = MOTGraphDataset(
+            self.model.hparams["dataset_params"],
+            request["img_paths"],
+            request["det_df"],
+            self.seq_info,
+            cnn_model=self.model.cnn_model,
+            reid_embeddings=request["reid_embeds"],
+            node_feats=request["node_embeds"],
+            start_frame=request["start_frame"],
+        )
+        with self.timer.measure("offline.mpn"):
             final_out = self.model.track_seq(dataset)
-            feedback = final_out.to_numpy()[:, :6]
+        feedback = final_out.to_numpy()[:, :6]
 
         return feedback
 
     def step(self, img_path, det, gt, pre_det=[], weights=[]):
+        self.preprocess(img_path, det, gt, pre_det, weights)
+        embed_crops([self])
+
+    def preprocess(self, img_path, det, gt, pre_det=[], weights=[]):
+        """
+        Run the preprocessor on the frame and crop its boxes.
+        The crops are embedded later by embed_crops, possibly with other sequences.
+        """
+
         self.img_paths.append(img_path)
         self.gts.append(gt)
 
@@ -354,7 +437,7 @@ class NeuralSolver:
                 sample["dets"] = torch.FloatTensor([]).unsqueeze(0)
             sample["img_path"] = img_path
 
-            with torch.no_grad():
+            with torch.no_grad(), self.timer.measure("offline.frcnn"):
                 self.preprocessor.step(sample)
 
         if self.pre_track == "Tracktor":
@@ -390,17 +473,48 @@ class NeuralSolver:
                         bb_imgs.append(bb_img)
                         idx.append((i + 1, current_frame + 1))
 
-            if len(bb_imgs) > 0:
-                with torch.no_grad():
-                    bb_imgs = torch.stack(bb_imgs)
-                    node_out, reid_out = self.model.cnn_model(bb_imgs.cuda())
-                    node_out = node_out.cpu()
-                    reid_out = reid_out.cpu()
-                    for n, (i, frame) in enumerate(idx):
-                        node_embed = self.node_embeds.get(i, dict())
-                        node_embed[frame] = node_out[n]
-                        self.node_embeds[i] = node_embed
-
-                        reid_embed = self.reid_embeds.get(i, dict())
-                        reid_embed[frame] = reid_out[n]
-                        self.reid_embeds[i] = reid_embed
+            self.crops = list(zip(bb_imgs, idx))
+
+
+def embed_crops(solvers):
+    """
+    Compute the appearance features of the pending crops of every solver with
+    one forward pass per network
+    """
+
+    solvers = [solver for solver in solvers if len(solver.crops) > 0]
+    if len(solvers) == 0:
+        return
+
+    groups = {}
+    for solver in solvers:
+        groups.setdefault(id(solver.model.cnn_model), []).append(solver)
+
+    for group in groups.values():
+        cnn_model = group[0].model.cnn_model
+        start = time.perf_counter()
+        with torch.no_grad():
+            bb_imgs = torch.stack(
+                [bb_img for solver in group for bb_img, _ in solver.crops]
+            )
+            node_out, reid_out = cnn_model(bb_imgs.cuda())
+            node_out = node_out.cpu()
+            reid_out = reid_out.cpu()
+
+        n = 0
+        for solver in group:
+            for _, (i, frame) in solver.crops:
+                node_embed = solver.node_embeds.get(i, dict())
+                node_embed[frame] = node_out[n]
+                solver.node_embeds[i] = node_embed
+
+                reid_embed = solver.reid_embeds.get(i, dict())
+                reid_embed[frame] = reid_out[n]
+                solver.reid_embeds[i] = reid_embed
+                n += 1
+            solver.crops = []
+
+        # the batch is shared, so every sequence is charged for the whole pass
+        elapsed = time.perf_counter() - start
+        for solver in group:
+            solver.timer.add("offline.cnn", elapsed)
@@ -1,4 +1,7 @@
 import os
+import pickle
+from collections import Counter
+import numpy as np
 import pandas as pd
 
 
@@ -23,9 +26,314 @@ class ReadResult:
                 return value[:, 1:6]
 
 
+class ReadFeedback:
+    """
+    Reads the feedback log of FeedbackLog and rebuilds the window of any anchor
+    """
+
+    def __init__(self, output_dir, dataset_name, algorithm_name, seq_name):
+        file_path = os.path.join(
+            output_dir, dataset_name, algorithm_name, f"{seq_name}_feedback.txt"
+        )
+        if os.path.getsize(file_path) > 0:
+            # the windows are rebuilt from exact values
+            log = pd.read_csv(file_path, header=None, float_precision="round_trip").values
+        else:
+            log = np.empty((0, 9))
+
+        self.records = {}
+        for anchor in np.unique(log[:, 0]):
+            rows = log[log[:, 0] == anchor]
+            header = rows[rows[:, 2] == 0][0]
+            self.records[int(anchor)] = {
+                "base": int(header[1]),
+                "start": int(header[3]),
+                "rename": rows[rows[:, 2] == 2][:, 4:6],
+                "remove": rows[rows[:, 2] == -1][:, 3:],
+                "add": rows[rows[:, 2] == 1][:, 3:],
+            }
+        self.anchors = sorted(self.records.keys())
+
+        # the last rebuilt window, which is the base of the next anchor
+        self.last_anchor = None
+        self.last_window = None
+
+    def get_feedback(self, anchor_frame):
+        """
+        Return the feedback rows of [frame in the window, id, x, y, w, h] sorted by frame and id
+        """
+
+        chain = []
+        anchor = anchor_frame
+        while anchor != 0 and anchor != self.last_anchor:
+            chain.append(anchor)
+            anchor = self.records[anchor]["base"]
+        window = Counter() if anchor == 0 else self.last_window
+
+        for anchor in reversed(chain):
+            record = self.records[anchor]
+            rename = dict(record["rename"].tolist())
+            window = Counter(
+                {
+                    (row[0], rename.get(row[1], row[1])) + row[2:]: count
+                    for row, count in window.items()
+                    if row[0] >= record["start"]
+                }
+            )
+            window.subtract(map(tuple, record["remove"].tolist()))
+            window.update(map(tuple, record["add"].tolist()))
+            window = +window
+
+        self.last_anchor = anchor_frame
+        self.last_window = window
+
+        rows = np.array(list(window.elements())).reshape(-1, 6)
+        rows = rows[np.lexsort(rows.T[::-1])]
+        rows[:, 0] -= self.records[anchor_frame]["start"] - 1
+        return rows
+
+
 def write_results(data, output_dir, filename):
     df = pd.DataFrame(data,)
 
     os.makedirs(output_dir, exist_ok=True)
     file_path = os.path.join(output_dir, filename)
     df.to_csv(file_path, index=False, header=False)
+
+
+def format_csv(data):
+    """
+    Format rows as to_csv of pandas without index and header does
+    """
+
+    data = np.asarray(data)
+    if np.issubdtype(data.dtype, np.integer):
+        return "".join(",".join(map(str, row)) + "\n" for row in data.tolist())
+
+    # the shortest repr of a float is what pandas writes, and nan is left empty
+    return "".join(
+        ",".join("" if value != value else repr(value) for value in row) + "\n"
+        for row in data.astype(np.float64).tolist()
+    )
+
+
+class StreamWriter:
+    """
+    Appends rows to a csv file in chunks instead of writing all of them at the end.
+
+    The rows go to a .part file which commit renames to the file, so an unfinished
+    output is never taken for a finished one. The offset of the written rows is the
+    state, so a resumed run continues from the last checkpoint.
+    """
+
+    def __init__(self, file_path, formatter=None, chunk_size=1000):
+        self.file_path = file_path
+        self.part_path = f"{file_path}.part"
+        self.formatter = formatter
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.n_buffered = 0
+        self.file = None
+
+    def _open(self, offset=None):
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        if offset is None:
+            self.file = open(self.part_path, "wb")
+        else:
+            self.file = open(self.part_path, "r+b")
+            self.file.truncate(offset)
+            self.file.seek(offset)
+
+    def write(self, rows):
+        self.buffer.append(rows)
+        self.n_buffered += len(rows)
+        if self.n_buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.file is None:
+            self._open()
+
+        if len(self.buffer) > 0:
+            data = np.concatenate(self.buffer, axis=0)
+            if self.formatter is not None:
+                data = self.formatter(data)
+            self.file.write(format_csv(data).encode())
+            self.buffer = []
+            self.n_buffered = 0
+        self.file.flush()
+
+    def state_dict(self):
+        self.flush()
+        return {"offset": self.file.tell()}
+
+    def load_state_dict(self, state):
+        if self.file is not None:
+            self.file.close()
+        self.buffer = []
+        self.n_buffered = 0
+        self._open(state["offset"])
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def commit(self):
+        os.replace(self.part_path, self.file_path)
+
+
+class MemoryWriter:
+    """
+    Keeps the rows in memory and returns all of them by close
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.append(rows)
+
+    def state_dict(self):
+        return {"rows": self.rows}
+
+    def load_state_dict(self, state):
+        self.rows = state["rows"]
+
+    def close(self):
+        return np.concatenate(self.rows, axis=0)
+
+
+class FeedbackLog:
+    """
+    Writes the feedback windows of anchors as the changes from the previous window.
+
+    In stable mode an anchor can come every frame with a window overlapping the
+    previous one, so a window is written as the ids renamed in the previous window,
+    the rows removed from it and the rows added to it. A window is written whole
+    when the changes are not smaller or keyframe_every windows have been written
+    as changes. Each anchor is logged as rows of
+    [anchor, base anchor, op, frame, id, x, y, w, h] where the frames are the ones
+    of the sequence, the base anchor is 0 for a whole window, and the op is
+    0 for the header whose frame is the first frame of the window,
+    2 for a renaming whose id and x are the previous and the new id,
+    -1 for a removed row and 1 for an added row.
+    """
+
+    def __init__(self, writer, keyframe_every=50):
+        self.writer = writer
+        self.keyframe_every = keyframe_every
+        self.anchor = 0
+        self.rows = None
+        self.n_changes = 0
+
+    def write_window(self, anchor_frame, start_frame, feedback):
+        """
+        feedback should be rows of [frame in the window, id, x, y, w, h],
+        and anchor_frame and start_frame are the frames of the sequence
+        """
+
+        rows = np.array(feedback, dtype=np.float64)[:, :6].reshape(-1, 6)
+        rows[:, 0] += start_frame - 1
+
+        changes = None
+        if self.rows is not None and self.n_changes < self.keyframe_every:
+            changes = self._changes(rows, start_frame)
+            if sum(len(change) for change in changes) >= len(rows):
+                changes = None
+
+        if changes is None:
+            base = 0
+            rename = np.empty((0, 2))
+            remove = np.empty((0, 6))
+            add = rows
+            self.n_changes = 0
+        else:
+            base = self.anchor
+            rename, remove, add = changes
+            self.n_changes += 1
+
+        log = np.zeros((1 + len(rename) + len(remove) + len(add), 9))
+        log[:, 0] = anchor_frame
+        log[:, 1] = base
+        log[0, 3] = start_frame
+        n = 1
+        log[n : n + len(rename), 2] = 2
+        log[n : n + len(rename), 4:6] = rename
+        n += len(rename)
+        log[n : n + len(remove), 2] = -1
+        log[n : n + len(remove), 3:] = remove
+        n += len(remove)
+        log[n:, 2] = 1
+        log[n:, 3:] = add
+        self.writer.write(log)
+
+        self.anchor = anchor_frame
+        self.rows = rows
+
+    def _changes(self, rows, start_frame):
+        previous = self.rows[self.rows[:, 0] >= start_frame]
+
+        # the offline tracker can give other ids to the same tracks, so the ids are
+        # renamed by the most boxes they share
+        previous_ids = {}
+        for row in previous:
+            previous_ids.setdefault((row[0],) + tuple(row[2:]), row[1])
+        votes = Counter()
+        for row in rows:
+            key = (row[0],) + tuple(row[2:])
+            if key in previous_ids:
+                votes[(previous_ids[key], row[1])] += 1
+
+        rename = {}
+        renamed = set()
+        for (previous_id, new_id), _ in votes.most_common():
+            if previous_id not in rename and new_id not in renamed:
+                rename[previous_id] = new_id
+                renamed.add(new_id)
+        rename = {key: value for key, value in rename.items() if key != value}
+
+        previous = Counter(
+            (row[0], rename.get(row[1], row[1])) + tuple(row[2:])
+            for row in previous.tolist()
+        )
+        current = Counter(map(tuple, rows.tolist()))
+
+        rename = np.array(list(rename.items())).reshape(-1, 2)
+        remove = np.array(list((previous - current).elements())).reshape(-1, 6)
+        add = np.array(list((current - previous).elements())).reshape(-1, 6)
+        return rename, remove, add
+
+    def state_dict(self):
+        return {
+            "writer": self.writer.state_dict(),
+            "anchor": self.anchor,
+            "rows": self.rows,
+            "n_changes": self.n_changes,
+        }
+
+    def load_state_dict(self, state):
+        self.writer.load_state_dict(state["writer"])
+        self.anchor = state["anchor"]
+        self.rows = state["rows"]
+        self.n_changes = state["n_changes"]
+
+    def close(self):
+        return self.writer.close()
+
+    def commit(self):
+        self.writer.commit()
+
+
+def save_checkpoint(checkpoint, checkpoint_path):
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+
+    # write aside and rename so that a crash never leaves a broken checkpoint
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def load_checkpoint(checkpoint_path):
+    with open(checkpoint_path, "rb") as f:
+        return pickle.load(f)
@@ -0,0 +1,128 @@
+import os
+import copy
+import hashlib
+import json
+import yaml
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from datasets.mot import MOT
+from file_manager import ReadResult
+from algorithms.gt_simulator import compute_gt_losses, replay, regret
+
+LOSS_TYPES = ["w_id", "wo_id", "fn"]
+DELAYS = [True, False]
+DETECTOR_TYPES = ["fixed", "stable"]
+DURATIONS = [10, 30, 50, 70, 100]
+
+
+def cache_key(config, dataset_name, seq):
+    """
+    Return what the loss tensor of a sequence is computed from, which are the experts
+    with the modification times and sizes of their results, and the gt
+    """
+
+    seq_name = seq.seq_info["seq_name"]
+    files = []
+    for expert_name in config["EXPERTS"]:
+        stat = os.stat(
+            os.path.join(config["OUTPUT_DIR"], dataset_name, expert_name, f"{seq_name}.txt")
+        )
+        files.append([stat.st_mtime_ns, stat.st_size])
+    gt = hashlib.sha1(pd.util.hash_pandas_object(seq.gt, index=False).values.tobytes())
+    return json.dumps({"experts": config["EXPERTS"], "files": files, "gt": gt.hexdigest()})
+
+
+def load_losses(config, dataset_name, seq):
+    """
+    Load the loss tensor of the experts against gt, computing it on the first call
+    and again when the results of the experts or the gt change
+    """
+
+    seq_name = seq.seq_info["seq_name"]
+    cache_path = Path(config["OUTPUT_DIR"]) / dataset_name / "GT_losses" / f"{seq_name}.npz"
+    key = cache_key(config, dataset_name, seq)
+    if cache_path.exists():
+        cache = np.load(cache_path)
+        if "key" in cache.files and str(cache["key"]) == key:
+            return cache["losses"], cache["n_gts"]
+
+    gts = [seq.get_label_by_index(frame_idx + 1) for frame_idx in range(len(seq))]
+    experts_results = []
+    for expert_name in config["EXPERTS"]:
+        reader = ReadResult(config["OUTPUT_DIR"], dataset_name, expert_name, seq_name)
+        experts_results.append(
+            [reader.get_result_by_frame(frame_idx) for frame_idx in range(len(seq))]
+        )
+    losses, n_gts = compute_gt_losses(gts, experts_results)
+
+    os.makedirs(cache_path.parent, exist_ok=True)
+    np.savez(cache_path, losses=losses, n_gts=n_gts, key=np.array(key))
+    return losses, n_gts
+
+
+def main(config_path):
+    with open(config_path) as c:
+        config = yaml.load(c, Loader=yaml.FullLoader)
+
+    for dataset_name in config["DATASETS"]:
+        dataset = MOT(config["DATASET_DIR"][dataset_name])
+
+        # gt is only given for the train sequences
+        seqs_losses = {
+            seq.seq_info["seq_name"]: load_losses(config, dataset_name, seq)
+            for seq in dataset.sequences["train"]
+        }
+
+        sweep = []
+        for loss_type in LOSS_TYPES:
+            for delayed in DELAYS:
+                for detector_type in DETECTOR_TYPES:
+                    for duration in DURATIONS:
+                        run_config = copy.deepcopy(config)
+                        run_config["LOSS"]["type"] = loss_type
+                        run_config["LOSS"]["delayed"] = delayed
+                        run_config["DETECTOR"]["type"] = detector_type
+                        run_config["DETECTOR"]["duration"] = duration
+
+                        regrets = {}
+                        for seq_name, (losses, n_gts) in seqs_losses.items():
+                            ws, _ = replay(losses, n_gts, run_config)
+                            regrets[seq_name] = float(regret(ws, losses, loss_type))
+
+                        total = sum(regrets.values())
+                        print(
+                            f"[{dataset_name}] {loss_type}, delayed={delayed}, "
+                            f"{detector_type}({duration}): regret {total:.2f}"
+                        )
+                        sweep.append(
+                            {
+                                "LOSS": run_config["LOSS"],
+                                "DETECTOR": run_config["DETECTOR"],
+                                "regret": total,
+                                "sequences": regrets,
+                            }
+                        )
+
+        # the losses directory is not made when the dataset has no train sequence
+        sweep_path = Path(config["OUTPUT_DIR"]) / dataset_name / "GT_losses" / "sweep.json"
+        os.makedirs(sweep_path.parent, exist_ok=True)
+        with open(sweep_path, "w") as f:
+            json.dump(sweep, f)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate AAA with gt feedback")
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        default="experiments/aaa.yaml",
+        help="The config file of the algorithm",
+    )
+    args = parser.parse_args()
+    main(args.config)
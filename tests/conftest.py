@@ -0,0 +1,76 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import yaml
+
+# the modules of the repository are imported from its root, as the scripts do
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_sequence(n_frames=120, n_objects=8, n_experts=3, seed=0):
+    """
+    Synthetic sequence of boxes moving on straight lines.
+    Return the gt rows of each frame and the results of each expert in each frame,
+    where each expert is noisier, misses more boxes and switches more ids than the previous one.
+    """
+
+    rng = np.random.RandomState(seed)
+    positions = rng.rand(n_objects, 2) * 800
+    velocities = rng.randn(n_objects, 2) * 3
+    sizes = np.c_[rng.rand(n_objects) * 40 + 30, rng.rand(n_objects) * 80 + 60]
+    # the first objects stay for the whole sequence so that every frame has gt
+    starts = np.where(np.arange(n_objects) < 3, 0, rng.randint(0, n_frames // 2, n_objects))
+    ends = np.where(
+        np.arange(n_objects) < 3, n_frames, rng.randint(n_frames // 2, n_frames, n_objects)
+    )
+    id_maps = [np.arange(n_objects) + 1 + 100 * expert for expert in range(n_experts)]
+
+    gts = []
+    experts = [[] for _ in range(n_experts)]
+    for frame_idx in range(n_frames):
+        positions += velocities
+        alive = np.flatnonzero((starts <= frame_idx) & (frame_idx <= ends))
+        gt = np.ones((len(alive), 9))
+        gt[:, 0] = frame_idx + 1
+        gt[:, 1] = alive + 1
+        gt[:, 2:4] = positions[alive]
+        gt[:, 4:6] = sizes[alive]
+        gts.append(gt)
+
+        for expert in range(n_experts):
+            detected = alive[rng.rand(len(alive)) >= 0.05 * (expert + 1)]
+            switched = detected[rng.rand(len(detected)) < 0.01 * expert]
+            id_maps[expert][switched] = rng.randint(1000, 100000, len(switched))
+
+            result = np.zeros((len(detected), 5))
+            result[:, 0] = id_maps[expert][detected]
+            result[:, 1:3] = positions[detected] + rng.randn(len(detected), 2) * (2 + 6 * expert)
+            result[:, 3:5] = sizes[detected]
+            if rng.rand() < 0.3:
+                false_positive = [rng.randint(200000, 300000), *(rng.rand(2) * 800), 40, 90]
+                result = np.vstack([result, false_positive])
+            experts[expert].append(result)
+
+    return gts, experts
+
+
+@pytest.fixture
+def sequence():
+    return make_sequence()
+
+
+@pytest.fixture
+def config():
+    with open(os.path.join(ROOT, "experiments", "aaa.yaml")) as c:
+        config = yaml.load(c, Loader=yaml.FullLoader)
+
+    # the offline tracker gives the gt as feedback, so no network is loaded
+    config["OFFLINE"]["use_gt"] = True
+    config["OFFLINE"]["pre_cnn"] = False
+    config["EXPERTS"] = ["Expert0", "Expert1", "Expert2"]
+    config["DETECTOR"]["type"] = "fixed"
+    config["DETECTOR"]["duration"] = 10
+    return config
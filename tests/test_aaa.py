@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from algorithms.aaa import AAA
+from algorithms.waa import WAADelayed
+from conftest import make_sequence
+
+SEQ_INFO = {"dataset_name": "MOT15", "seq_name": "Synth-01"}
+
+
+def track_recorded(config, gts, experts, failures=()):
+    """
+    Track the sequence, where the feedback of the windows ending at the failures cannot be solved.
+    Return the weights after each frame and the updates of the weights, which are
+    {anchor frame: (feedback length, first unevaluated index, gradient losses)}
+    """
+
+    algorithm = AAA(config)
+    algorithm.initialize(dict(SEQ_INFO))
+
+    prepare = algorithm.offline.prepare
+
+    def failing_prepare(start_frame, end_frame):
+        if end_frame in failures:
+            raise ValueError("No feedback")
+        return prepare(start_frame, end_frame)
+
+    algorithm.offline.prepare = failing_prepare
+
+    updates = {}
+    update_weight = algorithm._update_weight
+
+    def recorded_update_weight(anchor_frame, feedback, feedback_length):
+        feedback_start = anchor_frame + 1 - feedback_length
+        first_unevaluated_idx = max(algorithm.first_unevaluated - feedback_start, 0)
+        gradient_losses = update_weight(anchor_frame, feedback, feedback_length)
+        if gradient_losses is not None:
+            updates[anchor_frame] = (
+                feedback_length,
+                first_unevaluated_idx,
+                gradient_losses.copy(),
+            )
+        return gradient_losses
+
+    algorithm._update_weight = recorded_update_weight
+
+    weights = []
+    for frame_idx in range(len(gts)):
+        _, w, *_ = algorithm.track(
+            f"{frame_idx + 1:06d}.jpg",
+            None,
+            gts[frame_idx],
+            [expert[frame_idx] for expert in experts],
+        )
+        weights.append(w.copy())
+    return weights, updates
+
+
+def replay_delay_lists(n_frames, n_experts, updates, delayed):
+    """
+    Replay the updates with the per-frame delay and evaluated lists AAA kept before the counters
+    Return the weights after each frame and the first unevaluated index of each update
+    """
+
+    learner = WAADelayed()
+    learner.initialize(n_experts)
+    delay = []
+    evaluated = []
+
+    weights = []
+    first_unevaluated_idxs = {}
+    for frame_idx in range(n_frames):
+        if delayed:
+            delay = [
+                delay[i] if evaluated[i] else delay[i] + 1 for i in range(len(delay))
+            ]
+        delay.append(1)
+        evaluated.append(False)
+
+        if frame_idx in updates:
+            feedback_length, _, gradient_losses = updates[frame_idx]
+            first_unevaluated_idxs[frame_idx] = evaluated[-feedback_length:].index(False)
+
+            # the learner summed the delays of every frame
+            learner.update(gradient_losses, sum(delay))
+            evaluated[-feedback_length:] = [True] * len(evaluated[-feedback_length:])
+        weights.append(learner.w.copy())
+
+    return weights, first_unevaluated_idxs
+
+
+@pytest.mark.parametrize(
+    "detector_type, delayed",
+    [("fixed", True), ("fixed", False), ("stable", True), ("stable", False)],
+)
+def test_delay_counters_match_delay_lists(config, detector_type, delayed):
+    config["DETECTOR"]["type"] = detector_type
+    config["LOSS"]["delayed"] = delayed
+    gts, experts = make_sequence(n_frames=150, n_experts=len(config["EXPERTS"]))
+    # a failure long enough to leave frames unevaluated by the next feedback
+    failures = set(range(40, 75))
+
+    weights, updates = track_recorded(config, gts, experts, failures)
+    assert len(updates) > 0
+
+    expected_weights, first_unevaluated_idxs = replay_delay_lists(
+        len(gts), len(config["EXPERTS"]), updates, delayed
+    )
+    for anchor_frame, (_, first_unevaluated_idx, _) in updates.items():
+        assert first_unevaluated_idx == first_unevaluated_idxs[anchor_frame]
+    for w, expected_w in zip(weights, expected_weights):
+        assert np.array_equal(w, expected_w)
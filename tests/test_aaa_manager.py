@@ -0,0 +1,62 @@
+import numpy as np
+
+from algorithms.aaa import AAA
+from algorithms.aaa_manager import AAAManager
+from conftest import make_sequence
+
+
+def frames(gts, experts):
+    return [
+        (f"{frame_idx + 1:06d}.jpg", None, gts[frame_idx], [e[frame_idx] for e in experts])
+        for frame_idx in range(len(gts))
+    ]
+
+
+def track_alone(config, seq_info, stream_frames):
+    algorithm = AAA(config)
+    algorithm.initialize(dict(seq_info))
+    outputs = []
+    for frame in stream_frames:
+        result, w, _, _, selected_expert = algorithm.track(*frame)
+        outputs.append((result.copy(), w.copy(), selected_expert))
+    return outputs
+
+
+def test_streams_match_single_runs(config):
+    config["DETECTOR"]["type"] = "stable"
+    n_experts = len(config["EXPERTS"])
+    streams = {}
+    seq_infos = {}
+    # the streams end at different frames
+    for stream_id, (n_frames, seed) in enumerate([(80, 1), (50, 2)]):
+        gts, experts = make_sequence(n_frames=n_frames, n_experts=n_experts, seed=seed)
+        streams[stream_id] = frames(gts, experts)
+        seq_infos[stream_id] = {"dataset_name": "MOT15", "seq_name": f"Synth-0{seed}"}
+
+    manager = AAAManager(config)
+    for stream_id, seq_info in seq_infos.items():
+        manager.add_stream(stream_id, dict(seq_info))
+
+    outputs = {stream_id: [] for stream_id in streams}
+    for stream_id, frame_idx, output in manager.run(streams):
+        assert frame_idx == len(outputs[stream_id])
+        result, w, _, _, selected_expert = output
+        outputs[stream_id].append((result.copy(), w.copy(), selected_expert))
+
+    # the weights are updated by the feedback
+    assert not np.allclose(outputs[0][-1][1], 1 / n_experts)
+
+    for stream_id, stream_frames in streams.items():
+        expected_outputs = track_alone(config, seq_infos[stream_id], stream_frames)
+        assert len(outputs[stream_id]) == len(expected_outputs)
+        for (result, w, selected_expert), expected in zip(
+            outputs[stream_id], expected_outputs
+        ):
+            expected_result, expected_w, expected_selected_expert = expected
+            assert np.array_equal(w, expected_w)
+            assert selected_expert == expected_selected_expert
+            assert np.array_equal(result, expected_result)
+
+    report = manager.report()
+    assert report["frames"] == sum(len(stream_frames) for stream_frames in streams.values())
+    assert report["streams"][1]["frames"] == len(streams[1])
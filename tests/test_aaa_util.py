@@ -0,0 +1,22 @@
+import numpy as np
+
+from algorithms.aaa_util import top_k_experts
+
+
+def test_top_k_experts():
+    weights = np.array([0.1, 0.4, 0.0, 0.3, 0.2])
+
+    assert top_k_experts(weights, 2).tolist() == [1, 3]
+    assert top_k_experts(weights, 0).tolist() == [0, 1, 3, 4]
+    assert top_k_experts(weights, 10).tolist() == [0, 1, 3, 4]
+
+
+def test_top_k_experts_drops_small_weights():
+    weights = np.array([0.5, 1e-9, 0.3, 2e-7, 0.2 - 1e-9 - 2e-7])
+
+    assert top_k_experts(weights, 0, eps=1e-6).tolist() == [0, 2, 4]
+    assert top_k_experts(weights, 4, eps=1e-6).tolist() == [0, 2, 4]
+    assert top_k_experts(weights, 2, eps=1e-6).tolist() == [0, 2]
+    assert top_k_experts(weights, 0, eps=1e-8).tolist() == [0, 2, 3, 4]
+    # the largest weight is always a candidate
+    assert top_k_experts(weights, 0, eps=0.9).tolist() == [0]
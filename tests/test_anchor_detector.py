@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from algorithms import anchor_detector
+from algorithms.aaa import AAA
+from algorithms.aaa_util import convert_df, eval_results, get_summary
+from algorithms.anchor_detector import same_tracks
+from conftest import make_sequence
+
+SEQ_INFO = {"dataset_name": "MOT15", "seq_name": "Synth-01"}
+
+
+def window(gts, start_frame, end_frame, id_offset=0):
+    # feedback rows of [frame in the window, id, x, y, w, h]
+    rows = np.concatenate(gts[start_frame : end_frame + 1])[:, :6].copy()
+    rows[:, 0] -= start_frame
+    rows[:, 1] += id_offset
+    return rows
+
+
+def mean_mota(previous, current):
+    # what the stable check computes with motmetrics when the shortcut is not taken
+    previous = convert_df(previous, is_offline=True)
+    current = convert_df(current, is_offline=True)
+    prev_acc, prev_ana, _ = eval_results(SEQ_INFO, previous, current)
+    curr_acc, curr_ana, _ = eval_results(SEQ_INFO, current, previous)
+    return (get_summary(prev_acc, prev_ana)[3] + get_summary(curr_acc, curr_ana)[3]) / 2
+
+
+def perturbations(previous):
+    rng = np.random.RandomState(0)
+
+    moved = previous.copy()
+    moved[rng.randint(len(moved)), 2] += 30
+
+    switched = previous.copy()
+    ids = np.unique(switched[:, 1])
+    later = switched[:, 0] > 5
+    first = later & (switched[:, 1] == ids[0])
+    second = later & (switched[:, 1] == ids[1])
+    switched[first, 1] = ids[1]
+    switched[second, 1] = ids[0]
+
+    dropped = np.delete(previous, rng.randint(len(previous)), axis=0)
+
+    merged = previous.copy()
+    merged[merged[:, 1] == ids[2], 1] = ids[3]
+
+    return {"moved": moved, "switched": switched, "dropped": dropped, "merged": merged}
+
+
+def test_same_tracks_agrees_with_mota():
+    gts, _ = make_sequence(n_frames=10)
+    previous = window(gts, 0, 9)
+
+    # the same tracks with other ids are a perfect result of each other
+    relabelled = window(gts, 0, 9, id_offset=1000)
+    assert same_tracks(previous, relabelled)
+    assert same_tracks(previous, previous[::-1].copy())
+    assert mean_mota(previous, relabelled) == 1.0
+
+    for name, current in perturbations(previous).items():
+        assert not same_tracks(previous, current), name
+        assert mean_mota(previous, current) < 1.0, name
+
+    empty = np.empty((0, 6))
+    assert not same_tracks(empty, empty)
+    assert not same_tracks(previous, empty)
+    assert not same_tracks(empty, previous)
+
+
+def track(config, gts, experts):
+    """
+    Track the sequence with feedback whose ids change in every window and whose
+    boxes are perturbed in some of them.
+    Return the gradient losses, the weights and the selected expert of each frame
+    """
+
+    algorithm = AAA(config)
+    algorithm.initialize(dict(SEQ_INFO))
+
+    prepare = algorithm.offline.prepare
+
+    def perturbed_prepare(start_frame, end_frame):
+        request = prepare(start_frame, end_frame)
+        feedback = request["feedback"].copy()
+        feedback[:, 1] += 1000 * end_frame
+        if end_frame % 7 == 0:
+            feedback[len(feedback) // 2, 2] += 30
+        if end_frame % 11 == 0:
+            feedback = feedback[1:]
+        request["feedback"] = feedback
+        return request
+
+    algorithm.offline.prepare = perturbed_prepare
+
+    outputs = []
+    for frame_idx in range(len(gts)):
+        _, w, gradient_losses, _, selected_expert = algorithm.track(
+            f"{frame_idx + 1:06d}.jpg",
+            None,
+            gts[frame_idx],
+            [expert[frame_idx] for expert in experts],
+        )
+        outputs.append((gradient_losses, w.copy(), selected_expert))
+    return outputs, algorithm.detector
+
+
+@pytest.mark.parametrize("delayed", [True, False])
+def test_same_tracks_shortcut_keeps_losses(config, monkeypatch, delayed):
+    config["DETECTOR"]["type"] = "stable"
+    config["LOSS"]["delayed"] = delayed
+    gts, experts = make_sequence(n_frames=60, n_experts=len(config["EXPERTS"]))
+
+    outputs, detector = track(config, gts, experts)
+    assert 0 < detector.n_check_hits < detector.n_checks
+
+    monkeypatch.setattr(anchor_detector, "same_tracks", lambda previous, current: False)
+    expected_outputs, expected_detector = track(config, gts, experts)
+    assert expected_detector.n_check_hits == 0
+
+    for (gradient_losses, w, selected_expert), expected in zip(outputs, expected_outputs):
+        expected_gradient_losses, expected_w, expected_selected_expert = expected
+        if expected_gradient_losses is None:
+            assert gradient_losses is None
+        else:
+            assert np.array_equal(gradient_losses, expected_gradient_losses)
+        assert np.array_equal(w, expected_w)
+        assert selected_expert == expected_selected_expert
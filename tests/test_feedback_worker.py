@@ -0,0 +1,40 @@
+import threading
+
+from algorithms.feedback_worker import FeedbackWorker
+
+
+def test_block_keeps_max_pending():
+    release = threading.Event()
+
+    def solve(request):
+        release.wait()
+        return request["start_frame"]
+
+    worker = FeedbackWorker(solve, max_pending=2, policy="block")
+    worker.submit(0, 0, {"start_frame": 0})
+    worker.submit(1, 1, {"start_frame": 1})
+    release.set()
+    for frame_idx in range(2, 6):
+        assert worker.submit(frame_idx, frame_idx, {"start_frame": frame_idx})
+        assert len(worker.pending) <= worker.max_pending
+
+    results = worker.completed(block=True)
+    assert [frame_idx for frame_idx, _, _ in results] == list(range(6))
+    assert [feedback for _, _, feedback in results] == list(range(6))
+    assert worker.stats() == {"submitted": 6, "dropped": 0, "failed": 0}
+
+
+def test_failures_are_counted():
+    def solve(request):
+        if request["start_frame"] % 2 == 1:
+            raise ValueError("no tracks")
+        return request["start_frame"]
+
+    worker = FeedbackWorker(solve, max_pending=4, policy="block")
+    for frame_idx in range(4):
+        worker.submit(frame_idx, frame_idx, {"start_frame": frame_idx})
+
+    results = worker.completed(block=True)
+    assert [feedback for _, _, feedback in results] == [0, None, 2, None]
+    assert worker.stats()["failed"] == 2
+    assert worker.state_dict()["n_failed"] == 2
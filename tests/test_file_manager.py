@@ -0,0 +1,47 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from file_manager import StreamWriter, format_csv
+
+
+def to_csv(data):
+    buffer = io.StringIO()
+    pd.DataFrame(data).to_csv(buffer, index=False, header=False)
+    return buffer.getvalue()
+
+
+def test_format_csv_matches_pandas():
+    rng = np.random.RandomState(0)
+    floats = rng.rand(20, 6) * 1000
+    floats[3, 2] = np.nan
+    floats[:, 0] = np.arange(1, 21)
+    ints = rng.randint(0, 10, size=(20, 4))
+
+    assert format_csv(floats) == to_csv(floats)
+    assert format_csv(ints) == to_csv(ints)
+
+
+def test_stream_writer_resumes_from_state(tmp_path):
+    rows = [np.array([[frame, frame % 3, frame * 0.5]]) for frame in range(1, 31)]
+    file_path = str(tmp_path / "S_weight.txt")
+
+    writer = StreamWriter(file_path, chunk_size=4)
+    for frame_rows in rows[:10]:
+        writer.write(frame_rows)
+    state = writer.state_dict()
+    # the rows after the state are lost by the interruption
+    for frame_rows in rows[10:15]:
+        writer.write(frame_rows)
+    writer.close()
+
+    writer = StreamWriter(file_path, chunk_size=4)
+    writer.load_state_dict(state)
+    for frame_rows in rows[10:]:
+        writer.write(frame_rows)
+    writer.close()
+    writer.commit()
+
+    with open(file_path) as f:
+        assert f.read() == to_csv(np.concatenate(rows))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from algorithms.id_matcher import assignment_matching, hungarian_matching
+
+
+def random_problem(rng, with_new_id):
+    n_left = rng.randint(0, 9)
+    n_right = rng.randint(0, 9)
+    left_nodes = np.c_[rng.permutation(100)[:n_left] + 1, rng.rand(n_left, 4)]
+    right_ids = rng.permutation(100)[:n_right] + 1
+    if with_new_id and n_right > 0:
+        right_ids[rng.randint(n_right)] = -1
+    right_nodes = np.c_[right_ids, rng.rand(n_right, 4)]
+
+    # coarse costs make ties between matchings of the same size
+    costs = np.round(rng.rand(n_left, n_right) * 20) / 20
+
+    def dist_fn(left, right):
+        return costs
+
+    return left_nodes, right_nodes, costs, dist_fn
+
+
+def matching_cost(result, left_nodes, right_nodes, costs, threshold):
+    """
+    Check that the result is a matching of the edges under the threshold and return its cost
+    """
+
+    left_idxs = {int(node[0]): i for i, node in enumerate(left_nodes)}
+    right_idxs = {int(node[0]): i for i, node in enumerate(right_nodes)}
+    left_ids = [left_id for left_id, _ in result]
+    right_ids = [right_id for _, right_id in result if right_id != -1]
+    assert len(set(left_ids)) == len(left_ids)
+    assert len(set(right_ids)) == len(right_ids)
+
+    total = 0
+    for left_id, right_id in result:
+        cost = costs[left_idxs[left_id], right_idxs[int(right_id)]]
+        assert cost < threshold
+        total += int(cost * 100)
+    return total
+
+
+@pytest.mark.parametrize("with_new_id", [False, True])
+def test_assignment_matches_min_cost_flow(with_new_id):
+    rng = np.random.RandomState(int(with_new_id))
+    for _ in range(300):
+        left_nodes, right_nodes, costs, dist_fn = random_problem(rng, with_new_id)
+        threshold = rng.choice([0.3, 0.5, 1.0])
+
+        expected = hungarian_matching(left_nodes, right_nodes, threshold, dist_fn)
+        result = assignment_matching(left_nodes, right_nodes, threshold, dist_fn)
+
+        assert len(result) == len(expected)
+        assert matching_cost(
+            result, left_nodes, right_nodes, costs, threshold
+        ) == matching_cost(expected, left_nodes, right_nodes, costs, threshold)
@@ -0,0 +1,113 @@
+import copy
+
+import numpy as np
+
+from algorithms.aaa import AAA
+from algorithms.loss_evaluator import LossEvaluator
+from conftest import make_sequence
+
+SEQ_INFO = {"dataset_name": "MOT15", "seq_name": "Synth-01"}
+
+
+def rows(frames):
+    # rows of [frame in the window, id, x, y, w, h]
+    return np.concatenate(
+        [
+            np.c_[np.full(len(frame), frame_idx + 1), frame[:, :5]]
+            for frame_idx, frame in enumerate(frames)
+        ]
+    )
+
+
+def test_shared_pool_matches_serial_losses():
+    gts, experts = make_sequence(n_frames=20)
+    feedback = np.concatenate(gts)[:, :6].copy()
+    experts_results = [rows(results) for results in experts]
+
+    expected = LossEvaluator().evaluate(feedback, experts_results, len(gts))
+
+    evaluator = LossEvaluator(n_workers=1)
+    shared = [evaluator.share() for _ in range(2)]
+    for session in shared:
+        session.initialize(None)
+        # the sessions evaluate on the pool of the evaluator they were shared from
+        assert session.executor is evaluator.executor
+        losses = session.evaluate(feedback, experts_results, len(gts))
+        for loss, expected_loss in zip(losses, expected):
+            assert np.array_equal(loss, expected_loss)
+
+    evaluator.close()
+    assert evaluator.executor is None
+
+
+def test_memo_matches_overlapping_windows():
+    gts, experts = make_sequence(n_frames=30)
+    evaluator = LossEvaluator(memo=True)
+    evaluator.initialize(SEQ_INFO)
+    for start_frame in range(20):
+        # the windows of 10 frames overlap by 9 frames, and each starts with no correspondence
+        feedback = rows(gts[start_frame : start_frame + 10])[:, :6].copy()
+        experts_results = [rows(results[start_frame : start_frame + 10]) for results in experts]
+
+        expected = LossEvaluator().evaluate(feedback, experts_results, 10)
+        losses = evaluator.evaluate(
+            feedback, experts_results, 10, range(len(experts)), start_frame
+        )
+        for loss, expected_loss in zip(losses, expected):
+            assert np.array_equal(loss, expected_loss)
+
+    stats = evaluator.stats()
+    assert stats["hits"] + stats["misses"] == 20 * 10 * len(experts)
+
+    evaluator.evict(SEQ_INFO["seq_name"], 25)
+    assert all(min(memo.frames) >= 25 for memo in evaluator.memos.values())
+    evaluator.evict(SEQ_INFO["seq_name"])
+    assert evaluator.memos == {}
+
+
+def track_sweep(configs, gts, experts, evaluator):
+    algorithms = [AAA(config, evaluator=evaluator) for config in configs]
+    for algorithm in algorithms:
+        algorithm.initialize(dict(SEQ_INFO))
+
+    outputs = [[] for _ in algorithms]
+    for frame_idx in range(len(gts)):
+        for algorithm, algorithm_outputs in zip(algorithms, outputs):
+            _, w, gradient_losses, _, _ = algorithm.track(
+                f"{frame_idx + 1:06d}.jpg",
+                None,
+                gts[frame_idx],
+                [expert[frame_idx] for expert in experts],
+            )
+            algorithm_outputs.append((gradient_losses, w.copy()))
+    return outputs, algorithms
+
+
+def test_memo_keeps_gradient_losses(config):
+    config["DETECTOR"]["type"] = "stable"
+    configs = []
+    for threshold, duration in [(0.5, 10), (0.9, 10), (0.7, 5)]:
+        run_config = copy.deepcopy(config)
+        run_config["DETECTOR"]["threshold"] = threshold
+        run_config["DETECTOR"]["duration"] = duration
+        configs.append(run_config)
+    gts, experts = make_sequence(n_frames=60, n_experts=len(config["EXPERTS"]))
+
+    evaluator = LossEvaluator(memo=True)
+    outputs, algorithms = track_sweep(configs, gts, experts, evaluator)
+    expected_outputs, _ = track_sweep(configs, gts, experts, LossEvaluator())
+
+    # the sessions after the first one match the same frames of the same windows
+    for algorithm in algorithms[1:]:
+        assert algorithm.evaluation_report()["loss_memo"]["hits"] > 0
+    # only the frames which can still be evaluated are kept
+    assert all(len(memo.frames) <= 10 for memo in evaluator.memos.values())
+
+    for session_outputs, expected_session_outputs in zip(outputs, expected_outputs):
+        for (gradient_losses, w), expected in zip(session_outputs, expected_session_outputs):
+            expected_gradient_losses, expected_w = expected
+            if expected_gradient_losses is None:
+                assert gradient_losses is None
+            else:
+                assert np.array_equal(gradient_losses, expected_gradient_losses)
+            assert np.array_equal(w, expected_w)
@@ -0,0 +1,64 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import simulate_feedback
+from conftest import make_sequence
+from datasets.mot import MOT
+from simulate_feedback import load_losses
+from test_track_algorithm import SEQ_NAME, write_dataset
+
+
+def test_losses_are_computed_again_when_the_experts_change(tmp_path, config, monkeypatch):
+    dataset_dir = tmp_path / "MOT15"
+    output_dir = tmp_path / "output"
+    gts, experts = make_sequence(n_frames=40, n_experts=len(config["EXPERTS"]))
+    write_dataset(dataset_dir, output_dir, config["EXPERTS"], gts, experts)
+    config["OUTPUT_DIR"] = str(output_dir)
+    seq = MOT(str(dataset_dir)).sequences["train"][0]
+
+    losses, n_gts = load_losses(config, "MOT15", seq)
+
+    computed = []
+    compute_gt_losses = simulate_feedback.compute_gt_losses
+
+    def counted_gt_losses(*args):
+        computed.append(args)
+        return compute_gt_losses(*args)
+
+    monkeypatch.setattr(simulate_feedback, "compute_gt_losses", counted_gt_losses)
+    cached_losses, cached_n_gts = load_losses(config, "MOT15", seq)
+    assert len(computed) == 0
+    assert np.array_equal(cached_losses, losses)
+    assert np.array_equal(cached_n_gts, n_gts)
+
+    # the first expert misses every box of the first frame after it is tracked again
+    expert_path = output_dir / "MOT15" / config["EXPERTS"][0] / f"{SEQ_NAME}.txt"
+    rows = pd.read_csv(expert_path, header=None)
+    rows[rows[0] > 1].to_csv(expert_path, index=False, header=False)
+    stat = os.stat(expert_path)
+    os.utime(expert_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    new_losses, _ = load_losses(config, "MOT15", seq)
+    assert len(computed) == 1
+    assert not np.array_equal(new_losses, losses)
+
+
+def test_sweep_without_train_sequences(tmp_path, config):
+    dataset_dir = tmp_path / "MOT15"
+    (dataset_dir / "train").mkdir(parents=True)
+    (dataset_dir / "test").mkdir()
+    config["DATASET_DIR"] = {"MOT15": str(dataset_dir)}
+    config["DATASETS"] = ["MOT15"]
+    config["OUTPUT_DIR"] = str(tmp_path / "output")
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.dump(config))
+
+    simulate_feedback.main(str(config_path))
+
+    with open(tmp_path / "output" / "MOT15" / "GT_losses" / "sweep.json") as f:
+        sweep = json.load(f)
+    assert all(entry["sequences"] == {} for entry in sweep)
@@ -0,0 +1,33 @@
+import time_manager
+from time_manager import StageTimer
+
+
+def test_only_kept_anchors_are_recorded():
+    timer = StageTimer()
+    for frame_idx in range(10):
+        with timer.anchor(frame_idx):
+            timer.add("step", 0.001)
+            if frame_idx % 3 == 0:
+                timer.keep_anchor()
+
+    report = timer.report()
+    assert [breakdown["frame"] for breakdown in report["anchors"]] == [0, 3, 6, 9]
+    assert report["n_anchors"] == 4
+    assert report["stages"]["step"]["count"] == 10
+
+
+def test_anchors_are_capped(monkeypatch):
+    monkeypatch.setattr(time_manager, "MAX_ANCHORS", 5)
+    timer = StageTimer()
+    for frame_idx in range(12):
+        with timer.anchor(frame_idx):
+            timer.add("step", 0.001)
+            timer.keep_anchor()
+
+    state = timer.state_dict()
+    assert [breakdown["frame"] for breakdown in state["anchors"]] == list(range(7, 12))
+    assert state["n_anchors"] == 12
+
+    loaded = StageTimer()
+    loaded.load_state_dict(state)
+    assert loaded.report()["anchors"] == timer.report()["anchors"]
@@ -0,0 +1,152 @@
+import copy
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_sequence
+from evaluate_tracker import eval_tracker
+from feedback.cached_solver import CachedSolver
+from track_algorithm import check_seeding, get_context, run_seq
+
+SEQ_NAME = "Synth-01"
+
+
+def write_dataset(dataset_dir, output_dir, experts_name, gts, experts):
+    """
+    Write the sequence as a MOT15 train sequence and the results of the experts on it
+    """
+
+    seq_dir = dataset_dir / "train" / SEQ_NAME
+    (seq_dir / "gt").mkdir(parents=True)
+    (seq_dir / "det").mkdir()
+    (dataset_dir / "test").mkdir()
+    (seq_dir / "seqinfo.ini").write_text(
+        f"[Sequence]\nname={SEQ_NAME}\nimDir=img1\nframeRate=30\n"
+        f"seqLength={len(gts)}\nimWidth=1920\nimHeight=1080\nimExt=.jpg\n"
+    )
+
+    gt = np.concatenate(gts)
+    pd.DataFrame(gt).to_csv(seq_dir / "gt" / "gt.txt", index=False, header=False)
+    det = np.c_[gt[:, 0], np.full(len(gt), -1), gt[:, 2:6], np.ones(len(gt))]
+    pd.DataFrame(det).to_csv(seq_dir / "det" / "det.txt", index=False, header=False)
+
+    for expert_name, results in zip(experts_name, experts):
+        rows = np.concatenate(
+            [
+                np.c_[np.full(len(result), frame_idx + 1), result, np.ones(len(result))]
+                for frame_idx, result in enumerate(results)
+            ]
+        )
+        expert_dir = output_dir / "MOT15" / expert_name
+        expert_dir.mkdir(parents=True)
+        pd.DataFrame(rows).to_csv(expert_dir / f"{SEQ_NAME}.txt", index=False, header=False)
+
+
+def test_online_eval_matches_eval_tracker(tmp_path, config):
+    dataset_dir = tmp_path / "MOT15"
+    output_dir = tmp_path / "output"
+    gts, experts = make_sequence(n_frames=80, n_experts=len(config["EXPERTS"]))
+    write_dataset(dataset_dir, output_dir, config["EXPERTS"], gts, experts)
+
+    config["DATASET_DIR"] = {"MOT15": str(dataset_dir)}
+    config["DATASETS"] = ["MOT15"]
+    config["OUTPUT_DIR"] = str(output_dir)
+    context = get_context(config, [config])
+    algorithm = context["algorithms"][0]
+
+    rows, _ = run_seq(context, "MOT15", SEQ_NAME, 0, online_eval=True, split="train")
+    assert rows[algorithm.name]["frames"] == len(gts)
+
+    algorithm_dir = output_dir / "MOT15" / algorithm.name
+    with open(algorithm_dir / f"{SEQ_NAME}_online_eval.json") as f:
+        online = json.load(f)
+
+    # eval_tracker takes every txt file of the tracker directory as results
+    results_dir = tmp_path / "evaluated" / "MOT15" / "AAA"
+    results_dir.mkdir(parents=True)
+    (algorithm_dir / f"{SEQ_NAME}.txt").rename(results_dir / f"{SEQ_NAME}.txt")
+    eval_tracker(
+        {"MOT15": str(dataset_dir)},
+        str(tmp_path / "evaluated"),
+        "AAA",
+        "MOT15",
+        str(tmp_path / "eval"),
+    )
+    summary = pd.read_csv(tmp_path / "eval" / "AAA" / "MOT15" / "summary.csv", index_col=0)
+
+    assert online["frames"] == len(gts)
+    assert np.isclose(online["mota"], summary.loc[SEQ_NAME, "mota"])
+    assert np.isclose(online["idf1"], summary.loc[SEQ_NAME, "idf1"])
+    assert online["num_switches"] == summary.loc[SEQ_NAME, "num_switches"]
+
+
+def test_sweep_matches_single_runs(tmp_path, config):
+    dataset_dir = tmp_path / "MOT15"
+    output_dir = tmp_path / "output"
+    gts, experts = make_sequence(n_frames=80, n_experts=len(config["EXPERTS"]))
+    write_dataset(dataset_dir, output_dir, config["EXPERTS"], gts, experts)
+
+    config["DATASET_DIR"] = {"MOT15": str(dataset_dir)}
+    config["DATASETS"] = ["MOT15"]
+    config["OUTPUT_DIR"] = str(output_dir)
+    configs = []
+    for detector_type, threshold in [("stable", 0.5), ("stable", 0.7), ("fixed", 0.5)]:
+        run_config = copy.deepcopy(config)
+        run_config["DETECTOR"]["type"] = detector_type
+        run_config["DETECTOR"]["threshold"] = threshold
+        configs.append(run_config)
+
+    context = get_context(config, configs)
+    offline = context["offline"]
+    assert isinstance(offline, CachedSolver)
+
+    # the windows kept after each frame, before the ones no session needs are dropped
+    n_windows = []
+    evict = offline.evict
+
+    def recorded_evict(seq_info, frame_idx):
+        n_windows.append(len(offline.sequences[seq_info["seq_name"]]["feedbacks"]))
+        evict(seq_info, frame_idx)
+
+    offline.evict = recorded_evict
+    _, stats = run_seq(context, "MOT15", SEQ_NAME, 0, split="train")
+    assert stats["hits"] > 0
+    assert 0 < max(n_windows) <= len(configs)
+
+    # each configuration alone writes to another output directory with the same experts' results
+    single_dir = tmp_path / "single"
+    for expert_name in config["EXPERTS"]:
+        shutil.copytree(output_dir / "MOT15" / expert_name, single_dir / "MOT15" / expert_name)
+    for run_config in configs:
+        run_config["OUTPUT_DIR"] = str(single_dir)
+        single_context = get_context(run_config, [run_config])
+        assert not isinstance(single_context["offline"], CachedSolver)
+        run_seq(single_context, "MOT15", SEQ_NAME, 0, split="train")
+
+        algorithm = single_context["algorithms"][0]
+        for suffix in ["", "_weight", "_loss", "_selected"]:
+            file_name = f"{SEQ_NAME}{suffix}.txt"
+            assert (output_dir / "MOT15" / algorithm.name / file_name).read_text() == (
+                single_dir / "MOT15" / algorithm.name / file_name
+            ).read_text()
+
+
+def test_stale_seeding_is_refused(tmp_path, config):
+    config["SEED"] = 0
+    algorithm_dir = tmp_path / "MOT15" / "AAA"
+    check_seeding(algorithm_dir, config)
+    check_seeding(algorithm_dir, config)
+
+    # a seed is not in the name of the results, which are then tracked with another one
+    config["SEED"] = 1
+    with pytest.raises(ValueError):
+        check_seeding(algorithm_dir, config)
+
+    # the results written before the seeding was recorded are seeded by the whole run
+    (algorithm_dir / "seeding.json").unlink()
+    (algorithm_dir / f"{SEQ_NAME}.txt").write_text("")
+    with pytest.raises(ValueError):
+        check_seeding(algorithm_dir, config)
@@ -0,0 +1,112 @@
+import time
+import threading
+from bisect import bisect_right
+from collections import deque
+from contextlib import contextmanager
+
+# upper edges of the histogram bins in seconds, from 10us to about 3 minutes
+HISTOGRAM_EDGES = [1e-5 * 2 ** i for i in range(25)]
+
+# number of the latest anchor breakdowns which are kept
+MAX_ANCHORS = 1000
+
+
+class StageTimer:
+    """
+    Collects the elapsed time of named stages with a monotonic clock.
+
+    Each stage keeps a count, a total, a maximum and a log-scale histogram. While
+    an anchor is open, the stages measured by the same thread are also added to
+    that anchor's breakdown, which is kept if keep_anchor is called before it closes.
+    Only the latest MAX_ANCHORS breakdowns are kept.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.anchors = deque(maxlen=MAX_ANCHORS)
+            self.n_anchors = 0
+        self.local.anchor = None
+
+    def state_dict(self):
+        with self.lock:
+            return {
+                "stages": self.stages,
+                "anchors": list(self.anchors),
+                "n_anchors": self.n_anchors,
+            }
+
+    def load_state_dict(self, state):
+        with self.lock:
+            self.stages = state["stages"]
+            self.anchors = deque(state["anchors"], maxlen=MAX_ANCHORS)
+            self.n_anchors = state["n_anchors"]
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def anchor(self, frame_idx):
+        breakdown = {"frame": frame_idx}
+        self.local.anchor = breakdown
+        self.local.keep = False
+        try:
+            yield breakdown
+        finally:
+            self.local.anchor = None
+
+            # keep only the frames which turned out to be anchors
+            if self.local.keep:
+                with self.lock:
+                    self.anchors.append(breakdown)
+                    self.n_anchors += 1
+
+    def keep_anchor(self):
+        self.local.keep = True
+
+    def add(self, stage, elapsed):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = [0, 0.0, 0.0, [0] * (len(HISTOGRAM_EDGES) + 1)]
+                self.stages[stage] = stats
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3][bisect_right(HISTOGRAM_EDGES, elapsed)] += 1
+
+        anchor = getattr(self.local, "anchor", None)
+        if anchor is not None:
+            anchor[stage] = anchor.get(stage, 0.0) + elapsed
+
+    def report(self):
+        with self.lock:
+            stages = {
+                stage: {
+                    "count": count,
+                    "total": total,
+                    "mean": total / count,
+                    "max": maximum,
+                    "histogram": histogram,
+                }
+                for stage, (count, total, maximum, histogram) in self.stages.items()
+            }
+            anchors = list(self.anchors)
+            n_anchors = self.n_anchors
+
+        return {
+            "histogram_edges": HISTOGRAM_EDGES,
+            "stages": stages,
+            "anchors": anchors,
+            "n_anchors": n_anchors,
+        }
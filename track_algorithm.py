@@ -1,4 +1,8 @@
 import os
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import json
 import yaml
 import time
 from pathlib import Path
@@ -8,38 +12,105 @@ import numpy as np
 import random
 
 from datasets.mot import MOT
-from algorithms.aaa import AAA
+from algorithms.aaa import AAA, SEED_STREAMS, get_name, complete_config
+from algorithms.aaa_util import sequence_seed
+from algorithms.online_evaluator import OnlineEvaluator
+from algorithms.loss_evaluator import LossEvaluator
+from feedback.neural_solver import NeuralSolver
+from feedback.cached_solver import CachedSolver
 from print_manager import do_not_print
-from file_manager import ReadResult, write_results
+from file_manager import (
+    ReadResult,
+    StreamWriter,
+    MemoryWriter,
+    FeedbackLog,
+    save_checkpoint,
+    load_checkpoint,
+)
 from evaluate_tracker import eval_tracker
 
 SEED = 0
+
+# the outputs of track_seq and the suffixes of their files
+OUTPUTS = {
+    "results": "",
+    "weight": "_weight",
+    "loss": "_loss",
+    "feedback": "_feedback",
+    "selected": "_selected",
+}
+# the outputs of the learners of the other loss configurations, if there are any
+MULTI_OUTPUTS = {
+    "multi_weight": "_multi_weight",
+    "multi_selected": "_multi_selected",
+}
 torch.manual_seed(SEED)
 np.random.seed(SEED)
 random.seed(SEED)
 
 
-@do_not_print
-def track_seq(output_dir, experts_name, algorithm, seq):
+def get_rng_state():
+    return {
+        "numpy": np.random.get_state(),
+        "random": random.getstate(),
+        "torch": torch.get_rng_state(),
+    }
+
+
+def set_rng_state(state):
+    np.random.set_state(state["numpy"])
+    random.setstate(state["random"])
+    torch.set_rng_state(state["torch"])
+
+
+def get_outputs(algorithm):
+    if algorithm.multi_learner is None:
+        return OUTPUTS
+    return {**OUTPUTS, **MULTI_OUTPUTS}
+
+
+def get_default_writers(algorithm):
+    writers = {output: MemoryWriter() for output in get_outputs(algorithm)}
+    writers["feedback"] = FeedbackLog(writers["feedback"])
+    return writers
+
+
+def step_seq(
+    algorithm,
+    seq,
+    experts_reader,
+    writers,
+    times,
+    checkpoint_path=None,
+    checkpoint_interval=0,
+    evaluator=None,
+):
+    """
+    Track the sequence like track_seq, appending the time of each frame to times.
+    Yield the frame to start from, then the next frame after each tracked one
+    """
+
     algorithm.initialize(seq.seq_info)
-    experts_reader = [
-        ReadResult(
-            output_dir,
-            seq.seq_info["dataset_name"],
-            expert_name,
-            seq.seq_info["seq_name"],
-        )
-        for expert_name in experts_name
-    ]
+    if evaluator is not None:
+        evaluator.initialize()
 
-    results = []
-    ws = []
-    expert_losses = []
-    feedbacks = []
-    selected_experts = []
-    times = []
+    # resume from the last checkpoint
+    start_frame = 0
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        checkpoint = load_checkpoint(checkpoint_path)
+        start_frame = checkpoint["n_frames"]
+        algorithm.load_state_dict(checkpoint["algorithm"])
+        set_rng_state(checkpoint["rng"])
+        for output, writer in writers.items():
+            writer.load_state_dict(checkpoint["writers"][output])
+        times[:] = checkpoint["times"]
+        if evaluator is not None:
+            evaluator.load_state_dict(checkpoint["evaluator"])
+    yield start_frame
+
+    for frame_idx in range(start_frame, len(seq)):
+        img_path, dets, gts = seq[frame_idx]
 
-    for frame_idx, (img_path, dets, gts) in enumerate(seq):
         expert_results = []
         for reader in experts_reader:
             expert_results.append(reader.get_result_by_frame(frame_idx))
@@ -52,109 +123,456 @@ def track_seq(output_dir, experts_name, algorithm, seq):
         times.append(end_time)
         # print(f"Frame {frame_idx}: {end_time}s")
 
+        if evaluator is not None:
+            evaluator.update(gts, result)
+
         if len(result) > 0:
             frame_result = np.zeros((result.shape[0], result.shape[1] + 1))
             frame_result[:, 1:] = result
             frame_result[:, 0] = frame_idx + 1
-            results.append(frame_result)
+            writers["results"].write(frame_result)
 
         frame_w = np.zeros((1, len(w) + 1))
         frame_w[0, 1:] = w
         frame_w[0, 0] = frame_idx + 1
-        ws.append(frame_w)
+        writers["weight"].write(frame_w)
 
         if expert_loss is not None:
             frame_expert_loss = np.zeros((1, len(expert_loss) + 1))
             frame_expert_loss[0, 1:] = expert_loss
             frame_expert_loss[0, 0] = frame_idx + 1
-            expert_losses.append(frame_expert_loss)
+            writers["loss"].write(frame_expert_loss)
 
         if feedback is not None:
-            frame_feedback = np.zeros((feedback.shape[0], feedback.shape[1] + 1))
-            frame_feedback[:, 1:] = feedback
-            frame_feedback[:, 0] = frame_idx + 1
-            feedbacks.append(frame_feedback)
+            writers["feedback"].write_window(
+                frame_idx + 1, algorithm.feedback_start + 1, feedback
+            )
 
         frame_selected = np.zeros((1, 2))
         frame_selected[0, 1] = selected_expert
         frame_selected[0, 0] = frame_idx + 1
-        selected_experts.append(frame_selected)
+        writers["selected"].write(frame_selected)
+
+        if algorithm.multi_learner is not None:
+            n_configs = len(algorithm.multi_configs)
+            frame_multi_w = np.zeros((n_configs, algorithm.n_experts + 2))
+            frame_multi_w[:, 2:] = algorithm.multi_learner.w
+            frame_multi_w[:, 1] = np.arange(n_configs)
+            frame_multi_w[:, 0] = frame_idx + 1
+            writers["multi_weight"].write(frame_multi_w)
+
+            frame_multi_selected = np.zeros((1, n_configs + 1), dtype=np.int64)
+            frame_multi_selected[0, 1:] = algorithm.multi_selected
+            frame_multi_selected[0, 0] = frame_idx + 1
+            writers["multi_selected"].write(frame_multi_selected)
 
-    results = np.concatenate(results, axis=0)
-    ws = np.concatenate(ws, axis=0)
-    expert_losses = np.concatenate(expert_losses, axis=0)
-    feedbacks = np.concatenate(feedbacks, axis=0)
-    selected_experts = np.concatenate(selected_experts, axis=0)
+        if checkpoint_interval > 0 and (frame_idx + 1) % checkpoint_interval == 0:
+            save_checkpoint(
+                {
+                    "n_frames": frame_idx + 1,
+                    "algorithm": algorithm.state_dict(),
+                    "rng": get_rng_state(),
+                    "writers": {
+                        output: writer.state_dict() for output, writer in writers.items()
+                    },
+                    "times": times,
+                    "evaluator": None if evaluator is None else evaluator.state_dict(),
+                },
+                checkpoint_path,
+            )
 
-    return results, ws, expert_losses, feedbacks, selected_experts, times
+        yield frame_idx + 1
 
 
 @do_not_print
-def get_algorithm(config):
-    return AAA(config)
+def track_seq(
+    output_dir,
+    experts_name,
+    algorithm,
+    seq,
+    checkpoint_path=None,
+    checkpoint_interval=0,
+    experts_reader=None,
+    writers=None,
+    evaluator=None,
+):
+    """
+    Track the sequence and write the rows of each output to its writer.
+    The metrics of the results are updated in each frame if an evaluator is given.
+    Return what the writers of get_outputs return by close, which are the arrays
+    of the outputs with the default writers, and the times of the frames
+    """
 
+    if experts_reader is None:
+        experts_reader = get_experts_reader(output_dir, experts_name, seq)
+    if writers is None:
+        writers = get_default_writers(algorithm)
+
+    times = []
+    for _ in step_seq(
+        algorithm,
+        seq,
+        experts_reader,
+        writers,
+        times,
+        checkpoint_path,
+        checkpoint_interval,
+        evaluator,
+    ):
+        pass
+
+    return tuple(writers[output].close() for output in get_outputs(algorithm)) + (times,)
+
+
+@do_not_print
+def track_seqs(seq, steps, cache=None):
+    """
+    Run the step_seq of every session in lockstep.
+    After each frame, the cache drops the windows which no session can ask for anymore
+    """
+
+    next_frames = {algorithm: next(step) for algorithm, step in steps.items()}
+    while len(next_frames) > 0:
+        # a resumed session waits for the others to reach its checkpoint
+        frame_idx = min(next_frames.values())
+        for algorithm, next_frame in list(next_frames.items()):
+            if next_frame == frame_idx:
+                next_frame = next(steps[algorithm], None)
+                if next_frame is None:
+                    del next_frames[algorithm]
+                else:
+                    next_frames[algorithm] = next_frame
+
+        if cache is not None and len(next_frames) > 0:
+            cache.evict(
+                seq.seq_info, min(algorithm.oldest_request() for algorithm in next_frames)
+            )
+
+
+def get_experts_reader(output_dir, experts_name, seq):
+    return [
+        ReadResult(
+            output_dir,
+            seq.seq_info["dataset_name"],
+            expert_name,
+            seq.seq_info["seq_name"],
+        )
+        for expert_name in experts_name
+    ]
+
+
+@do_not_print
+def preprocess_seq(offline, seq, experts_reader):
+    offline.add_sequence(
+        seq.seq_info,
+        (
+            seq[frame_idx]
+            + ([reader.get_result_by_frame(frame_idx) for reader in experts_reader],)
+            for frame_idx in range(len(seq))
+        ),
+    )
+
+
+@do_not_print
+def get_offline(config):
+    return NeuralSolver(
+        config["FEEDBACK"]["ckpt_path"],
+        config["FEEDBACK"]["frcnn_weights_path"],
+        config["FEEDBACK"]["reid_weights_path"],
+        config["FEEDBACK"]["tracking_cfg_path"],
+        config["FEEDBACK"]["preprocessing_cfg_path"],
+        config["OFFLINE"]["use_gt"],
+        config["OFFLINE"]["pre_cnn"],
+        config["OFFLINE"]["pre_track"],
+    )
+
+
+@do_not_print
+def get_algorithm(config, offline=None, evaluator=None):
+    return AAA(config, offline, evaluator)
 
-def main(config_path):
-    with open(config_path) as c:
-        config = yaml.load(c, Loader=yaml.FullLoader)
 
+def get_writers(dataset_dir, seq, algorithm):
+    seq_name = seq.seq_info["seq_name"]
+    writers = {
+        output: StreamWriter(os.path.join(dataset_dir, f"{seq_name}{suffix}.txt"))
+        for output, suffix in get_outputs(algorithm).items()
+    }
+    writers["results"].formatter = seq.format_results
+    writers["feedback"] = FeedbackLog(writers["feedback"])
+    return writers
+
+
+def write_seq(dataset_dir, seq, algorithm, writers, times, evaluator=None):
+    seq_name = seq.seq_info["seq_name"]
+
+    np.savetxt(dataset_dir / f"{seq_name}_time.txt", times)
+    with open(dataset_dir / f"{seq_name}_memory.json", "w") as f:
+        json.dump(algorithm.memory_report(), f)
+    with open(dataset_dir / f"{seq_name}_stages.json", "w") as f:
+        json.dump(algorithm.timer.report(), f)
+    with open(dataset_dir / f"{seq_name}_evaluation.json", "w") as f:
+        json.dump(algorithm.evaluation_report(), f)
+    if evaluator is not None:
+        with open(dataset_dir / f"{seq_name}_online_eval.json", "w") as f:
+            json.dump(evaluator.summary(), f)
+
+    # the results are the last since a sequence with results is taken as finished
+    for output in writers:
+        if output != "results":
+            writers[output].commit()
+    writers["results"].commit()
+
+
+def check_seeding(dataset_dir, config):
+    """
+    Record how the random streams of the results in dataset_dir are seeded,
+    and refuse the directory if its results are seeded otherwise
+    """
+
+    seeding = {"seed": config["SEED"], "streams": SEED_STREAMS}
+    seeding_path = dataset_dir / "seeding.json"
+    if seeding_path.exists():
+        with open(seeding_path) as f:
+            previous = json.load(f)
+    elif dataset_dir.exists() and any(dataset_dir.iterdir()):
+        # the results written before the seeding was recorded use the global streams
+        previous = None
+    else:
+        dataset_dir.mkdir(parents=True, exist_ok=True)
+        with open(seeding_path, "w") as f:
+            json.dump(seeding, f)
+        return
+
+    if previous != seeding:
+        raise ValueError(
+            f"The results in {dataset_dir} are seeded by {previous} instead of {seeding}, "
+            "move them to track the sequences again"
+        )
+
+
+def print_summary(summary):
+    print(f"{'Algorithm':<60} {'Dataset':<8} {'Seqs':>5} {'Frames':>7} {'Time(s)':>9} {'Updates':>8}")
+    for (name, dataset_name), row in summary.items():
+        print(
+            f"{name[:60]:<60} {dataset_name:<8} {row['sequences']:>5} {row['frames']:>7} "
+            f"{row['time']:>9.1f} {row['updates']:>8}"
+        )
+
+
+def get_configs(config):
     durations = [100]
     thresholds = [0.4, 0.5, 0.6, 0.7]
+    configs = []
     for threshold in thresholds:
         for duration in durations:
-            config["DETECTOR"]["duration"] = duration
-            config["DETECTOR"]["threshold"] = threshold
+            run_config = copy.deepcopy(config)
+            run_config["DETECTOR"]["duration"] = duration
+            run_config["DETECTOR"]["threshold"] = threshold
+            configs.append(run_config)
+    return configs
+
+
+def get_context(config, configs):
+    # the datasets, the networks and the experts' results are loaded once for every configuration,
+    # and each sequence is preprocessed once and its feedbacks are shared by the configurations
+    datasets = {
+        dataset_name: MOT(config["DATASET_DIR"][dataset_name])
+        for dataset_name in config["DATASETS"]
+    }
+    offline = get_offline(config)
+    if len(configs) > 1:
+        offline = CachedSolver(offline)
+    # the configurations also share one pool of loss workers, and the counts of the frames
+    # which they match in the same way when there are several of them
+    evaluator = LossEvaluator(config["LOSS_EVAL"]["workers"], memo=len(configs) > 1)
+    algorithms = [
+        get_algorithm(run_config, offline, evaluator) for run_config in configs
+    ]
+    return {
+        "config": config,
+        "datasets": datasets,
+        "offline": offline,
+        "evaluator": evaluator,
+        "algorithms": algorithms,
+    }
+
+
+def run_seq(
+    context, dataset_name, seq_name, checkpoint_interval, online_eval=False, split="test"
+):
+    """
+    Track a sequence of the split with every configuration which has not finished it yet
+    Return {algorithm name: summary of the sequence} and the feedback cache stats
+    """
+
+    config = context["config"]
+    offline = context["offline"]
+    seq = next(
+        seq
+        for seq in context["datasets"][dataset_name].sequences[split]
+        if seq.seq_info["seq_name"] == seq_name
+    )
+    if online_eval and seq.gt is None:
+        print(f"No gt for {seq_name}, which is evaluated only with the train split")
+
+    pending = []
+    for algorithm in context["algorithms"]:
+        dataset_dir = Path(
+            os.path.join(config["OUTPUT_DIR"], dataset_name, algorithm.name)
+        )
+        if (dataset_dir / f"{seq_name}.txt").exists():
+            print(f"Pass {seq_name} of {algorithm.name}")
+        else:
+            pending.append((algorithm, dataset_dir))
+
+    rows = {}
+    # a single configuration asks for each window once, so its feedback is not cached
+    cached = isinstance(offline, CachedSolver)
+    stats = dict(offline.stats) if cached else {"hits": 0, "misses": 0}
+    if len(pending) > 0:
+        # the global streams of the networks are also seeded per sequence
+        seed = sequence_seed(config["SEED"], seq_name)
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        random.seed(seed)
+
+        experts_reader = get_experts_reader(config["OUTPUT_DIR"], config["EXPERTS"], seq)
+        if cached:
+            print(f"Preprocess {seq_name}")
+            preprocess_seq(offline, seq, experts_reader)
+
+        sessions = []
+        steps = {}
+        for algorithm, dataset_dir in pending:
+            print(f"Start {seq_name} of {algorithm.name}")
+            checkpoint_path = dataset_dir / f"{seq_name}_checkpoint.pkl"
+            writers = get_writers(dataset_dir, seq, algorithm)
+
+            # the metrics are only known for the sequences with gt
+            if online_eval and seq.gt is not None:
+                evaluator = OnlineEvaluator(dataset_name)
+            else:
+                evaluator = None
 
-            datasets = {
-                dataset_name: MOT(config["DATASET_DIR"][dataset_name])
-                for dataset_name in config["DATASETS"]
+            times = []
+            steps[algorithm] = step_seq(
+                algorithm,
+                seq,
+                experts_reader,
+                writers,
+                times,
+                checkpoint_path,
+                checkpoint_interval,
+                evaluator,
+            )
+            sessions.append((algorithm, dataset_dir, checkpoint_path, writers, evaluator, times))
+
+        # the configurations are stepped together so that the cache only keeps a few windows
+        track_seqs(seq, steps, offline if cached else None)
+
+        for algorithm, dataset_dir, checkpoint_path, writers, evaluator, times in sessions:
+            for writer in writers.values():
+                writer.close()
+            write_seq(dataset_dir, seq, algorithm, writers, times, evaluator)
+            if evaluator is not None:
+                metrics = evaluator.summary()
+                print(f"{seq_name}: MOTA {metrics['mota']:.3f}, IDF1 {metrics['idf1']:.3f}")
+            if checkpoint_path.exists():
+                checkpoint_path.unlink()
+
+            rows[algorithm.name] = {
+                "sequences": 1,
+                "frames": len(seq),
+                "time": sum(times),
+                "updates": algorithm.n_updates,
             }
 
-            algorithm = get_algorithm(config)
-
-            for dataset_name, dataset in datasets.items():
-                dataset_dir = Path(
-                    os.path.join(config["OUTPUT_DIR"], dataset_name, algorithm.name)
-                )
-
-                total_time = []
-
-                for seq in dataset:
-                    if (dataset_dir / f"{seq.seq_info['seq_name']}.txt").exists():
-                        print(f"Pass {seq.seq_info['seq_name']}")
-                    else:
-                        print(f"Start {seq.seq_info['seq_name']}")
-                        (results, ws, expert_losses, feedbacks, selected_experts, times) = track_seq(
-                            config["OUTPUT_DIR"], config["EXPERTS"], algorithm, seq
-                        )
-                        seq.write_results(results, dataset_dir)
-                        write_results(
-                            ws, dataset_dir, f"{seq.seq_info['seq_name']}_weight.txt",
-                        )
-                        write_results(
-                            expert_losses, dataset_dir, f"{seq.seq_info['seq_name']}_loss.txt",
-                        )
-                        write_results(
-                            feedbacks, dataset_dir, f"{seq.seq_info['seq_name']}_feedback.txt",
-                        )
-                        write_results(
-                            selected_experts,
-                            dataset_dir,
-                            f"{seq.seq_info['seq_name']}_selected.txt",
-                        )
-                        np.savetxt(dataset_dir / f"{seq.seq_info['seq_name']}_time.txt", times)
-                        total_time += times
-
-                print(f"Total time: {sum(total_time)}s")
-                # tracker_dir = os.path.join(config["EVAL_DIR"], "Ours", dataset_name)
-                # eval_tracker(
-                #     config["DATASET_DIR"],
-                #     config["OUTPUT_DIR"],
-                #     algorithm.name,
-                #     dataset_name,
-                #     config["EVAL_DIR"],
-                #     tracker_dir,
-                # )
+        if cached:
+            offline.remove_sequence(seq.seq_info)
+
+    if cached:
+        stats = {key: offline.stats[key] - value for key, value in stats.items()}
+    return rows, stats
+
+
+# the context of a worker process, which is loaded once by _init_worker
+_context = None
+
+
+def _init_worker(config, configs):
+    global _context
+    _context = get_context(config, configs)
+
+
+def _run_seq(task):
+    return run_seq(_context, *task)
+
+
+def main(config_path, checkpoint_interval, n_workers, online_eval, split):
+    with open(config_path) as c:
+        config = complete_config(yaml.load(c, Loader=yaml.FullLoader))
+
+    configs = get_configs(config)
+    names = [get_name(run_config) for run_config in configs]
+
+    # the finished sequences are passed, so they should have the results of the same seeding
+    for run_config, name in zip(configs, names):
+        for dataset_name in config["DATASETS"]:
+            check_seeding(
+                Path(os.path.join(config["OUTPUT_DIR"], dataset_name, name)), run_config
+            )
+
+    if n_workers > 0:
+        # the workers load their own models, so only the sequence names are needed here
+        tasks = [
+            (dataset_name, seq_name, checkpoint_interval, online_eval, split)
+            for dataset_name in config["DATASETS"]
+            for seq_name in MOT(config["DATASET_DIR"][dataset_name]).sequence_names[split]
+        ]
+        # spawn so that each worker starts its own CUDA context
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(config, configs),
+        ) as executor:
+            seq_results = list(executor.map(_run_seq, tasks))
+    else:
+        context = get_context(config, configs)
+        tasks = [
+            (dataset_name, seq.seq_info["seq_name"], checkpoint_interval, online_eval, split)
+            for dataset_name, dataset in context["datasets"].items()
+            for seq in dataset.sequences[split]
+        ]
+        seq_results = [run_seq(context, *task) for task in tasks]
+        context["evaluator"].close()
+
+    # the summary is gathered in the order of the tasks whatever the order they finished in
+    summary = {}
+    stats = {"hits": 0, "misses": 0}
+    for (dataset_name, *_), (rows, seq_stats) in zip(tasks, seq_results):
+        for name in names:
+            row = summary.setdefault(
+                (name, dataset_name),
+                {"sequences": 0, "frames": 0, "time": 0.0, "updates": 0},
+            )
+            for key, value in rows.get(name, {}).items():
+                row[key] += value
+        for key, value in seq_stats.items():
+            stats[key] += value
+
+    print_summary(summary)
+    print(f"Feedback cache: {stats['hits']} hits, {stats['misses']} misses")
+    # tracker_dir = os.path.join(config["EVAL_DIR"], "Ours", dataset_name)
+    # eval_tracker(
+    #     config["DATASET_DIR"],
+    #     config["OUTPUT_DIR"],
+    #     algorithm.name,
+    #     dataset_name,
+    #     config["EVAL_DIR"],
+    #     tracker_dir,
+    # )
 
 
 if __name__ == "__main__":
@@ -168,5 +586,29 @@ if __name__ == "__main__":
         default="experiments/aaa.yaml",
         help="The config file of the algorithm",
     )
+    parser.add_argument(
+        "--checkpoint",
+        type=int,
+        default=0,
+        help="Save a checkpoint every N frames to resume an interrupted sequence (0 to disable)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Track the sequences on a pool of N processes, each loading its own models (0 to disable)",
+    )
+    parser.add_argument(
+        "--online_eval",
+        action="store_true",
+        help="Update MOTA and IDF1 of the sequences with gt in each frame, which are the ones of the train split",
+    )
+    parser.add_argument(
+        "--split",
+        type=str,
+        default="test",
+        choices=["train", "test"],
+        help="The split of the sequences to track",
+    )
     args = parser.parse_args()
-    main(args.config)
+    main(args.config, args.checkpoint, args.workers, args.online_eval, args.split)